@@ -0,0 +1,346 @@
+import argparse
+import asyncio
+import os
+import socket
+import struct
+import time
+import autoDriver
+import modelEnsemble
+import tickProfiler
+import driveLog
+
+log = driveLog.get_logger('asyncClient')
+
+# Control period of the SCRC server: it sends a sensor frame every 20 ms
+TICK_PERIOD = 0.02
+
+# Kernel receive timestamps (struct timespec) on every datagram, where the
+# platform's socket module has the option
+SO_TIMESTAMPNS = getattr(socket, 'SO_TIMESTAMPNS', None)
+TIMESPEC = struct.Struct('@qq')
+RECV_SIZE = 1000
+
+
+class DriverProtocol(asyncio.DatagramProtocol):
+    '''
+    Drives one TORCS client on an asyncio event loop. Keeps the blocking
+    client's handshake, restart and shutdown handling, and counts ticks
+    answered after the deadline (late) and tick periods without a frame
+    (missed). Latency runs from the datagram's arrival: its kernel
+    timestamp over a TimestampedTransport, else the callback.
+    '''
+    def __init__(self, driver, bot_id='SCR', max_episodes=1, max_steps=0, deadline=0.02, timeout=1.0,
+                 profiler=tickProfiler.NULL, period=TICK_PERIOD):
+        '''Constructor'''
+        self.driver = driver
+        self.profiler = profiler
+        driver.profiler = profiler
+        self.bot_id = bot_id
+        self.max_episodes = max_episodes
+        self.max_steps = max_steps
+        self.deadline = deadline
+        self.timeout = timeout
+        self.period = period
+
+        self.loop = asyncio.get_running_loop()
+        self.done = self.loop.create_future()
+        self.transport = None
+        self.timer = None
+        self.identified = False
+        self.cur_episode = 0
+        self.current_step = 0
+        self.last_frame = None
+
+        self.ticks = 0
+        self.late = 0
+        self.missed = 0
+        self.worst = 0.0
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.identify()
+
+    def identify(self):
+        '''Send the init string, and again every second until ***identified***'''
+        self.identified = False
+        self.send(self.bot_id + self.driver.init())
+        self.arm(self.identify)
+
+    def arm(self, callback):
+        '''(Re)start the one-second timer of the current phase'''
+        if self.timer is not None:
+            self.timer.cancel()
+        self.timer = self.loop.call_later(self.timeout, callback)
+
+    def on_timeout(self):
+        log.warning("didn't get response from server...")
+        self.count_missed(time.perf_counter())
+        self.arm(self.on_timeout)
+
+    def count_missed(self, now):
+        '''
+        Count the whole tick periods since the last frame that brought none,
+        up to now. A frame the server sent a little late (less than a period)
+        isn't a missed tick.
+        '''
+        if self.last_frame is None:
+            return
+        missed = int((now - self.last_frame) / self.period) - 1
+        if missed > 0:
+            self.missed += missed
+            self.last_frame += missed * self.period
+
+    def send(self, buf):
+        if self.transport is not None and not self.transport.is_closing():
+            self.transport.sendto(buf.encode())
+
+    def datagram_received(self, data, addr, received=None):
+        if received is None:
+            received = time.perf_counter()
+        tick_start = self.profiler.clock()
+        buf = data.decode()
+
+        if not self.identified:
+            if buf.find('***identified***') >= 0:
+                self.identified = True
+                self.current_step = 0
+                self.last_frame = None
+                self.arm(self.on_timeout)
+            return
+
+        # Handle shutdown or restart
+        if '***shutdown***' in buf:
+            self.profiler.end_episode()
+            self.driver.onShutDown()
+            log.info('Client Shutdown')
+            self.finish()
+            return
+
+        if '***restart***' in buf:
+            self.profiler.end_episode()
+            self.driver.onRestart()
+            log.info('Client Restart')
+            self.cur_episode += 1
+            if self.cur_episode == self.max_episodes:
+                self.finish()
+            else:
+                self.identify()
+            return
+
+        self.count_missed(received)
+        self.last_frame = received
+
+        self.current_step += 1
+        if self.current_step != self.max_steps:
+            buf = self.driver.drive(buf)
+        else:
+            buf = '(meta 1)'
+        t = self.profiler.clock()
+        self.send(buf)
+        self.profiler.record('socket.send', t)
+        self.profiler.record('tick', tick_start)
+
+        elapsed = time.perf_counter() - received
+        self.ticks += 1
+        if elapsed > self.deadline:
+            self.late += 1
+        if elapsed > self.worst:
+            self.worst = elapsed
+        self.arm(self.on_timeout)
+
+    def error_received(self, exc):
+        log.error('Socket error: %s', exc)
+
+    def connection_lost(self, exc):
+        self.finish()
+
+    def finish(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        if not self.done.done():
+            self.done.set_result(None)
+
+    def summary(self):
+        return (f'ticks: {self.ticks}  late: {self.late}  missed: {self.missed}  '
+                f'worst: {self.worst * 1000:.2f} ms')
+
+
+class TimestampedTransport(object):
+    '''
+    Datagram transport reading with recvmsg, so every datagram comes with
+    the kernel's receive timestamp: the latency then includes the time it
+    queued while the loop served the other cars. Only where the platform
+    has SO_TIMESTAMPNS and recvmsg, and the loop has add_reader (not the
+    Windows proactor loop); see open_endpoint().
+    '''
+    def __init__(self, loop, sock, protocol):
+        '''Constructor'''
+        self.loop = loop
+        self.sock = sock
+        self.protocol = protocol
+        loop.add_reader(sock.fileno(), self.read_ready)
+        protocol.connection_made(self)
+
+    def read_ready(self):
+        '''Hand every datagram queued on the socket to the protocol'''
+        while self.sock is not None:
+            try:
+                data, ancdata, _, addr = self.sock.recvmsg(RECV_SIZE, socket.CMSG_SPACE(TIMESPEC.size))
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as exc:
+                self.protocol.error_received(exc)
+                return
+            self.protocol.datagram_received(data, addr, arrival(ancdata))
+
+    def sendto(self, data, addr=None):
+        try:
+            self.sock.send(data)
+        except OSError as exc:
+            self.protocol.error_received(exc)
+
+    def is_closing(self):
+        return self.sock is None
+
+    def close(self):
+        if self.sock is not None:
+            self.loop.remove_reader(self.sock.fileno())
+            self.sock.close()
+            self.sock = None
+            self.protocol.connection_lost(None)
+
+
+async def open_endpoint(host, port, protocol):
+    '''
+    Connect protocol to the server: over a TimestampedTransport where the
+    platform and loop support one, else a plain asyncio datagram endpoint
+    '''
+    loop = asyncio.get_running_loop()
+    if SO_TIMESTAMPNS is not None and hasattr(socket.socket, 'recvmsg'):
+        family, kind, proto, _, address = socket.getaddrinfo(host, port, type=socket.SOCK_DGRAM)[0]
+        sock = socket.socket(family, kind, proto)
+        try:
+            sock.setblocking(False)
+            sock.setsockopt(socket.SOL_SOCKET, SO_TIMESTAMPNS, 1)
+            sock.connect(address)
+            return TimestampedTransport(loop, sock, protocol)
+        except (OSError, NotImplementedError):
+            sock.close()
+    transport, _ = await loop.create_datagram_endpoint(lambda: protocol, remote_addr=(host, port))
+    return transport
+
+
+def arrival(ancdata):
+    '''
+    perf_counter() time a datagram arrived, from its kernel timestamp in
+    ancdata, or now without one
+    '''
+    now = time.perf_counter()
+    for level, kind, data in ancdata:
+        if level == socket.SOL_SOCKET and kind == SO_TIMESTAMPNS and len(data) >= TIMESPEC.size:
+            seconds, nanoseconds = TIMESPEC.unpack_from(data)
+            age = time.time_ns() - (seconds * 1000000000 + nanoseconds)
+            return now - max(0, age) / 1e9
+    return now
+
+
+async def run_clients(host, ports, bot_id='SCR', stage=3, max_episodes=1, max_steps=0, deadline=0.02, timeout=1.0,
+                      profile=None, mode='xgb', budget=0.0, steer_model=False, model_threads=None):
+    '''
+    Drive one client per port on the running event loop until all have shut down.
+    With profile set, each client's stage timings go to that file (one per port when there are several).
+    With budget set (ms), ticks the model would overrun get the fallback controller's controls.
+    With steer_model, steer comes from the dedicated steer controller, run next to the main one.
+    '''
+    # The first driver loads the scaler and model, the others share them
+    first = autoDriver.autoDriver(stage, mode=mode)
+    drivers = [first] + [autoDriver.autoDriver(stage, first.scaler, first.model, first.pipeline, mode)
+                         for _ in ports[1:]]
+    if steer_model:
+        import controllerRegistry
+        member = modelEnsemble.load_member(controllerRegistry.Registry())
+        for driver in drivers:
+            driver.add_models([member], model_threads)
+        print('Extra models:', first.ensemble.describe())
+    if budget > 0:
+        # The fallback keeps no per-car state, so one serves every car
+        fallback = first.enable_budget(budget)
+        for driver in drivers[1:]:
+            driver.enable_budget(budget, fallback)
+
+    endpoints = []
+    try:
+        for port, driver in zip(ports, drivers):
+            profiler = tickProfiler.StageProfiler(int(deadline * 1e9)) if profile else tickProfiler.NULL
+            protocol = DriverProtocol(driver, bot_id, max_episodes, max_steps, deadline, timeout, profiler)
+            transport = await open_endpoint(host, port, protocol)
+            endpoints.append((port, transport, protocol))
+        await asyncio.gather(*(protocol.done for _, _, protocol in endpoints))
+    finally:
+        for _, transport, _ in endpoints:
+            transport.close()
+
+    for port, _, protocol in endpoints:
+        print('Port', port, '-', protocol.summary())
+        if budget > 0:
+            paths = protocol.driver.paths
+            print('Port', port, '- control paths:', ', '.join(f'{path} {n}' for path, n in paths.most_common()))
+        if profile:
+            root, ext = os.path.splitext(profile)
+            protocol.profiler.dump(profile if len(endpoints) == 1 else f'{root}_{port}{ext}')
+    return [protocol for _, _, protocol in endpoints]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Asyncio client to connect to one or more TORCS SCRC servers.')
+    parser.add_argument('--host', action='store', dest='host_ip', default='localhost',
+                        help='Host IP address (default: localhost)')
+    parser.add_argument('--port', action='store', type=int, dest='host_port', default=3001,
+                        help='Port of the first car; car i uses port + i (default: 3001)')
+    parser.add_argument('--cars', action='store', type=int, dest='cars', default=1,
+                        help='Number of cars to drive on this event loop (default: 1)')
+    parser.add_argument('--id', action='store', dest='id', default='SCR',
+                        help='Bot ID (default: SCR)')
+    parser.add_argument('--maxEpisodes', action='store', dest='max_episodes', type=int, default=1,
+                        help='Maximum number of learning episodes (default: 1)')
+    parser.add_argument('--maxSteps', action='store', dest='max_steps', type=int, default=0,
+                        help='Maximum number of steps (default: 0)')
+    parser.add_argument('--stage', action='store', dest='stage', type=int, default=3,
+                        help='Stage (0 - Warm-Up, 1 - Qualifying, 2 - Race, 3 - Unknown)')
+    parser.add_argument('--mode', action='store', dest='mode', default='xgb', choices=sorted(autoDriver.MODES),
+                        help='Controller to drive with: xgb or lstm (default: xgb)')
+    parser.add_argument('--deadline', action='store', dest='deadline', type=float, default=20.0,
+                        help='Milliseconds allowed to answer a sensor frame (default: 20)')
+    parser.add_argument('--timeout', action='store', dest='timeout', type=float, default=1.0,
+                        help='Seconds without a frame before warning that the server stopped answering (default: 1)')
+    parser.add_argument('--budget', action='store', dest='budget', type=float, default=0.0,
+                        help='Milliseconds per tick for the model; ticks it would overrun are answered by the '
+                             'steer model and throttle/gear rules, 0 to disable (default: 0)')
+    parser.add_argument('--steerModel', action='store_true', dest='steer_model',
+                        help='Take steer from the dedicated steer controller, run next to the main one')
+    parser.add_argument('--modelThreads', action='store', dest='model_threads', type=int, default=None,
+                        help='Threads running the extra models per car, 0 to run them inline (default: CPUs - 1)')
+    parser.add_argument('--profile', action='store', dest='profile', default=None,
+                        help='Write per-stage tick latencies to this .json or .csv file on shutdown')
+    driveLog.add_arguments(parser)
+    arguments = parser.parse_args()
+    driveLog.configure(arguments.log_level, every=arguments.log_every)
+
+    ports = [arguments.host_port + i for i in range(arguments.cars)]
+    print('Connecting to server host ip:', arguments.host_ip, '@ ports:', ports)
+    print('Bot ID:', arguments.id)
+    print('Maximum episodes:', arguments.max_episodes)
+    print('Maximum steps:', arguments.max_steps)
+    print('Stage:', arguments.stage)
+    print('Mode:', arguments.mode)
+    print('Deadline:', arguments.deadline, 'ms')
+    print('*********************************************')
+
+    asyncio.run(run_clients(arguments.host_ip, ports, arguments.id, arguments.stage, arguments.max_episodes,
+                            arguments.max_steps, arguments.deadline / 1000.0, arguments.timeout, arguments.profile,
+                            arguments.mode, arguments.budget, arguments.steer_model, arguments.model_threads))
+
+
+if __name__ == '__main__':
+    main()
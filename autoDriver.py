@@ -1,110 +1,340 @@
 import msgParser
 import carState
 import carControl
+import featureCompiler
+import tickProfiler
+import treeModel
+import lstmModel
+import driverLoader
+import predictionCache
+import inferencePipeline
+import fallbackController
+import modelEnsemble
+import driveLog
 import joblib
-import xgboost as xgb
 import numpy as np
+import collections
+import threading
+import time
 # from tensorflow import keras
 # from sklearn.ensemble import RandomForestRegressor
 import os
 
+log = driveLog.get_logger('autoDriver')
+
+# Scaler and model artefacts in controller/ for each driver mode
+MODES = driverLoader.MODES
+
+
+def load_model(path):
+    '''
+    Load a model artefact. Tree models exported with treeModel.py are loaded
+    from their .npz arrays instead, so xgboost is never imported at run time,
+    unless the arrays were exported from an older .joblib;
+    .keras LSTMs run on NumPy through lstmModel, without TensorFlow.
+    '''
+    if path.endswith('.keras'):
+        return lstmModel.load(path)
+    forest = treeModel.load_compiled(path)
+    if forest is not None:
+        return forest
+    compiled = treeModel.compiled_path(path)
+    if os.path.exists(compiled):
+        log.warning('%s was exported from another version of %s, loading the .joblib instead '
+                    '(re-run treeModel.py to update it)', compiled, path)
+    return joblib.load(path)
+
+
 class autoDriver(object):
     '''
     A model-based driver for TORCS using a trained neural network
     '''
 
-    def __init__(self, stage):
+    def __init__(self, stage, scaler=None, model=None, pipeline=None, mode='xgb'):
         self.stage = stage
+        self.mode = mode
         self.parser = msgParser.MsgParser()
         self.state = carState.CarState()
         self.control = carControl.CarControl()
 
-        # Load scaler and model
+        # (step, per-feature steps, size) of the optional prediction cache
+        self.cache_config = None
+
+        # Load scaler and model, unless they are shared with other drivers
         controller_dir = os.path.join(os.path.dirname(__file__), "controller")
-        self.scaler = joblib.load(os.path.join(controller_dir, "G-Speedway_controller_scaler.joblib"))
-        self.model = joblib.load(os.path.join(controller_dir, "G-Speedway_controller_xgb.joblib"))
-        
-        # The order of features expected by the model
-        self.input_features = [
-            'angle', 'distFromStart', 'distRaced','focus_0', 'focus_1', 'focus_2', 'focus_3', 'focus_4',
-            'rpm', 'speedX', 'speedY', 'speedZ', 'trackPos', 'track_0',
-            'track_1', 'track_10', 'track_11', 'track_12', 'track_13', 'track_14',
-            'track_15', 'track_16', 'track_17', 'track_18', 'track_2', 'track_3',
-            'track_4', 'track_5', 'track_6', 'track_7', 'track_8', 'track_9',
-            'wheelSpinVel_0', 'wheelSpinVel_1', 'wheelSpinVel_2', 'wheelSpinVel_3','z'
-        ]
+        scaler_file, model_file = MODES[mode]
+        if scaler is None:
+            scaler = joblib.load(os.path.join(controller_dir, scaler_file))
+        if model is None:
+            model = load_model(os.path.join(controller_dir, model_file))
+        self.use(scaler, model, pipeline)
+
+        # Artefacts prepared by request_swap(), picked up by the next drive().
+        # The lock keeps a swap requested while drive() takes the previous one
+        self.pending = None
+        self.swap_lock = threading.Lock()
+
+        # Per-stage tick timings, switched on by the client
+        self.profiler = tickProfiler.NULL
+
+        # Whether the last drive() applied a model prediction
+        self.valid = False
+
+        # Tick budget in ns (None: always run the model) and the controller
+        # answering when the model would not fit into it, or fails
+        self.budget_ns = None
+        self.fallback = None
+        # Recent worst model latency, decaying by 1/16 per tick
+        self.estimate_ns = 0
+
+        # Extra models run next to the pipeline, merged per output channel
+        self.ensemble = None
+
+        # Which path produced the last control: 'model', 'fallback' or 'safe'
+        self.path = None
+        self.paths = collections.Counter()
+
+        # Per-tick debug output and errors, rate-limited
+        self.trace = driveLog.Sampled(log)
+        self.errors = driveLog.Sampled(log)
+
+    def prepare_swap(self, scaler, model, pipeline=None):
+        '''Feature compiler and pipeline for a scaler and model, checked against each other'''
+        # The order of features expected by the model, read from the scaler
+        # and model metadata (alphabetical: track_10 comes before track_2)
+        features = featureCompiler.FeatureCompiler.from_artifacts(scaler, model)
+
+        # Scaler folded into the model: one call per tick on the raw features.
+        # Sequence models keep per-car history, so a shared one is forked
+        if pipeline is None:
+            pipeline = inferencePipeline.build(scaler, model)
+        elif pipeline.stateful:
+            pipeline = pipeline.fork()
+        if self.cache_config is not None and not pipeline.stateful:
+            step, overrides, size = self.cache_config
+            steps = predictionCache.grid_steps(features.names, step, overrides)
+            pipeline = predictionCache.CachedPipeline(pipeline, scaler, steps, size)
+        return scaler, model, features, pipeline
+
+    def use(self, scaler, model, pipeline=None):
+        '''Switch to a scaler and model, and their fused pipeline if it is already built'''
+        self.apply_swap(self.prepare_swap(scaler, model, pipeline))
+
+    def apply_swap(self, prepared):
+        self.scaler, self.model, self.features, self.pipeline = prepared
+        self.input_features = self.features.names
+
+    def enable_cache(self, step=predictionCache.DEFAULT_STEP, size=predictionCache.DEFAULT_SIZE, overrides=None):
+        '''
+        Memoize predictions on the feature vector quantized to step standard
+        deviations (per-feature steps in overrides). Sequence models are not cached.
+        '''
+        self.cache_config = (step, overrides, size)
+        if isinstance(self.pipeline, predictionCache.CachedPipeline):
+            self.pipeline = self.pipeline.pipeline
+        self.use(self.scaler, self.model, self.pipeline)
+        return self.pipeline
+
+    def request_swap(self, scaler, model, pipeline=None):
+        '''
+        Hot-swap the model from another thread: everything is built here, and
+        the next drive() only switches references before its tick
+        '''
+        prepared = self.prepare_swap(scaler, model, pipeline)
+        with self.swap_lock:
+            self.pending = prepared
 
     def init(self):
         '''Return init string with rangefinder angles'''
-        self.angles = [0 for x in range(19)]
-        for i in range(5):
-            self.angles[i] = -90 + i * 15
-            self.angles[18 - i] = 90 - i * 15
-        for i in range(5, 9):
-            self.angles[i] = -20 + (i-5) * 5
-            self.angles[18 - i] = 20 - (i-5) * 5
-        self.angles[9] = 0
+        self.angles = driverLoader.init_angles()
         return self.parser.stringify({'init': self.angles})
 
+    def representative_message(self):
+        '''
+        A sensor message whose model inputs are the scaler's training means
+        and whose other sensors are 0, for warming up the tick path
+        '''
+        values = {name: [0] * size for name, size, _ in msgParser.SENSOR_SCHEMA}
+        mean = getattr(self.scaler, 'mean_', None)
+        for index, name in enumerate(self.input_features):
+            value = 0.0 if mean is None else float(mean[index])
+            base, _, pos = name.rpartition('_')
+            if name in values:
+                values[name][0] = value
+            elif base in values and pos.isdigit() and int(pos) < len(values[base]):
+                values[base][int(pos)] = value
+        values['gear'] = [int(round(values['gear'][0]))]
+        return self.parser.stringify(values)
+
+    def warm_up(self, ticks=20):
+        '''
+        Run the whole tick path on a representative message so lazy
+        initialisation and first-call costs are paid before the race, then
+        reset the car state, the controls, any sequence history and the
+        record of which path served the last tick
+        '''
+        msg = self.representative_message()
+        profiler, self.profiler = self.profiler, tickProfiler.NULL
+        for _ in range(ticks):
+            self.drive(msg)
+        self.profiler = profiler
+        self.state = carState.CarState()
+        self.control = carControl.CarControl()
+        self.pipeline.reset()
+        self.valid = False
+        self.path = None
+        self.paths.clear()
+
     def drive(self, msg):
         '''Process sensor data and return control commands'''
+        started = time.perf_counter_ns()
+        if self.pending is not None:
+            with self.swap_lock:
+                prepared, self.pending = self.pending, None
+            self.apply_swap(prepared)
+
+        prof = self.profiler
+        t = prof.clock()
+
         # Parse and update car state
         self.state.setFromMsg(msg)
-        
+        t = prof.record('setFromMsg', t)
+
         # Extract features for the model
         features = self.extract_features()
-        if features is not None:
+        t = prof.record('extract_features', t)
+        if features is None:
+            self.errors.warning('Error extracting features')
+            self.use_fallback()
+        elif self.budget_ns is not None and not self.affordable(started):
+            # The model would answer too late: keep its history, answer from the fallback.
+            # Keeping the history is part of a prediction's cost, so the
+            # estimate doesn't decay below it
+            t_model = time.perf_counter_ns()
+            self.pipeline.observe(features)
+            self.estimate_ns = max(time.perf_counter_ns() - t_model, self.estimate_ns)
+            t = prof.record('pipeline.observe', t)
+            self.use_fallback()
+        else:
             try:
-                # Scale and predict
-                X = self.scaler.transform([features])
-                print("Feature vector length:", len(features))
-                print("Expected input length:", len(self.input_features))
-                prediction = self.model.predict(X)[0]  # [accel, brake, clutch, gear, steer]
-                
-                # Apply predictions to controls by adding to previous values
-                current_accel = self.control.accel if hasattr(self.control, 'accel') else 0
-                current_brake = self.control.brake if hasattr(self.control, 'brake') else 0
-                current_clutch = self.control.clutch if hasattr(self.control, 'clutch') else 0
-                current_steer = self.control.steer if hasattr(self.control, 'steer') else 0
-                current_gear = self.control.gear if hasattr(self.control, 'gear') else 1
-                current_focus = self.control.focus if hasattr(self.control, 'focus') else 0
-                current_meta = self.control.meta if hasattr(self.control, 'meta') else 0
-
-                # Add new values to current values and clip to valid ranges
-                self.control.setAccel(float(np.clip(current_accel + prediction[0], 0, 1)))
-                self.control.setBrake(float(np.clip(prediction[1], 0, 1)))
-                self.control.setClutch(0)
-                
-                
-                gear = int(np.round(prediction[3]))
-                self.control.setGear(int(np.clip(gear, 1, 6)))
-                
-                self.control.setSteer(float(np.clip(prediction[4], -1, 1)))
-                self.control.focus = current_focus + 0  # Add to current focus
-                self.control.meta = current_meta + 0   # Add to current meta
-
-                # Print current state and controls for debugging
-                print("\nCurrent State:")
-                print(f"Speed: {self.state.speedX:.2f}")
-                print(f"RPM: {self.state.rpm:.2f}")
-                print(f"Gear: {self.control.gear}")
-                print(f"Track Position: {self.state.trackPos:.2f}")
-                
-                print("\nControl Outputs:")
-                print(f"Accel: {self.control.accel:.2f}")
-                print(f"Brake: {self.control.brake:.2f}")
-                print(f"Steer: {self.control.steer:.2f}")
-                print(f"Clutch: {self.control.clutch:.2f}")
+                # Scale and predict in one fused call
+                t = prof.clock()
+                t_model = time.perf_counter_ns()
+                if self.ensemble is None:
+                    prediction = self.pipeline.predict_row(features)  # [accel, brake, clutch, gear, steer]
+                else:
+                    prediction = self.ensemble.predict(self.pipeline, features, self.state)
+                self.estimate_ns = max(time.perf_counter_ns() - t_model, self.estimate_ns - (self.estimate_ns >> 4))
+                t = prof.record('pipeline.predict', t)
+
+                self.apply_prediction(prediction)
+                prof.record('apply_prediction', t)
+                self.path = 'model'
 
             except Exception as e:
-                print(f"Error in model prediction: {e}")
-                self.set_safe_controls()
-        else:
-            print("Error extracting features")
-            self.set_safe_controls()
+                self.errors.warning('Error in model prediction: %s', e)
+                self.use_fallback()
+        self.valid = self.path == 'model'
+        self.paths[self.path] += 1
 
         # Return control message using carControl's toMsg method
-        return self.control.toMsg()
+        t = prof.clock()
+        msg = self.control.toMsg()
+        prof.record('CarControl.toMsg', t)
+        return msg
+
+    def affordable(self, started):
+        '''
+        Whether the model is expected to answer within the tick budget.
+        A skipped tick decays the estimate too, so the model is tried again
+        after a slow spell instead of being left out for good.
+        '''
+        if time.perf_counter_ns() - started + self.estimate_ns <= self.budget_ns:
+            return True
+        self.estimate_ns -= self.estimate_ns >> 4
+        return False
+
+    def enable_budget(self, budget_ms, fallback=None):
+        '''
+        Answer every tick within budget_ms: when the model's recent latency
+        would not fit into what is left of the tick, or the model fails, the
+        controls come from the fallback controller (the steer model plus
+        throttle and gear rules by default) instead of the safe ones.
+        '''
+        fallback = fallback if fallback is not None else fallbackController.load()
+        # Pay its first-call costs now rather than on the first late tick
+        state = carState.CarState()
+        state.setFromMsg(self.representative_message())
+        fallback.control(state, carControl.CarControl())
+        self.fallback = fallback
+        self.budget_ns = int(budget_ms * 1e6)
+        return fallback
+
+    def add_models(self, members, workers=None):
+        '''
+        Run the models of members (modelEnsemble.Member) next to the
+        pipeline on every tick, on a pool of workers threads, and take the
+        output channels they provide from them
+        '''
+        if self.ensemble is not None:
+            self.ensemble.close()
+        self.ensemble = modelEnsemble.ModelPool(members, workers)
+        # Start the threads and pay the first-call costs before the race
+        state = carState.CarState()
+        state.setFromMsg(self.representative_message())
+        self.ensemble.predict(self.pipeline, self.features.fill(state), state)
+        self.pipeline.reset()
+        return self.ensemble
+
+    def use_fallback(self):
+        '''Controls from the fallback controller, or the safe ones without one or if it fails'''
+        if self.fallback is not None:
+            try:
+                t = self.profiler.clock()
+                self.fallback.control(self.state, self.control)
+                self.profiler.record('fallback', t)
+                self.path = 'fallback'
+                return
+            except Exception as e:
+                self.errors.warning('Error in fallback controller: %s', e)
+        self.set_safe_controls()
+        self.path = 'safe'
+
+    def prepare(self, msg):
+        '''Update the car state from a sensor message and return its feature vector, or None'''
+        self.state.setFromMsg(msg)
+        return self.extract_features()
+
+    def apply_prediction(self, prediction):
+        '''Apply one model prediction [accel, brake, clutch, gear, steer] to the controls'''
+        # Apply predictions to controls by adding to previous values
+        current_accel = self.control.accel if hasattr(self.control, 'accel') else 0
+        current_brake = self.control.brake if hasattr(self.control, 'brake') else 0
+        current_clutch = self.control.clutch if hasattr(self.control, 'clutch') else 0
+        current_steer = self.control.steer if hasattr(self.control, 'steer') else 0
+        current_gear = self.control.gear if hasattr(self.control, 'gear') else 1
+        current_focus = self.control.focus if hasattr(self.control, 'focus') else 0
+        current_meta = self.control.meta if hasattr(self.control, 'meta') else 0
+
+        # Add new values to current values and clip to valid ranges
+        self.control.setAccel(float(np.clip(current_accel + prediction[0], 0, 1)))
+        self.control.setBrake(float(np.clip(prediction[1], 0, 1)))
+        self.control.setClutch(0)
+
+
+        gear = int(np.round(prediction[3]))
+        self.control.setGear(int(np.clip(gear, 1, 6)))
+
+        self.control.setSteer(float(np.clip(prediction[4], -1, 1)))
+        self.control.focus = current_focus + 0  # Add to current focus
+        self.control.meta = current_meta + 0   # Add to current meta
+
+        # Current state and controls for debugging
+        if self.trace.due():
+            log.debug('state speed=%.2f rpm=%.2f gear=%d trackPos=%.2f | '
+                      'accel=%.2f brake=%.2f steer=%.2f clutch=%.2f',
+                      self.state.speedX, self.state.rpm, self.control.gear, self.state.trackPos,
+                      self.control.accel, self.control.brake, self.control.steer, self.control.clutch)
 
     def set_safe_controls(self):
         '''Set safe default control values'''
@@ -128,63 +358,24 @@ class autoDriver(object):
     def extract_features(self):
         """
         Extracts the required features from the current car state.
-        Returns a list of features in the correct order, or None if any are missing.
+        Returns the reused float64 feature vector in the model's order, or None on error.
         """
         try:
-            # Get sensor data using direct attribute access
-            focus = self.state.focus if self.state.focus is not None else [-1]*5
-            track = self.state.track if self.state.track is not None else [0]*19
-            wheel = self.state.wheelSpinVel if self.state.wheelSpinVel is not None else [0]*4
-
-            # Convert all values to float to ensure proper scaling
-            feature_dict = {
-                'angle': float(self.state.angle if self.state.angle is not None else 0),
-                'distFromStart': float(self.state.distFromStart if self.state.distFromStart is not None else 0),
-                'distRaced': float(self.state.distRaced if self.state.distRaced is not None else 0),
-                'focus_0': float(focus[0]),
-                'focus_1': float(focus[1]),
-                'focus_2': float(focus[2]),
-                'focus_3': float(focus[3]),
-                'focus_4': float(focus[4]),
-                'rpm': float(self.state.rpm if self.state.rpm is not None else 0),
-                'speedX': float(self.state.speedX if self.state.speedX is not None else 0),
-                'speedY': float(self.state.speedY if self.state.speedY is not None else 0),
-                'speedZ': float(self.state.speedZ if self.state.speedZ is not None else 0),
-                'trackPos': float(self.state.trackPos if self.state.trackPos is not None else 0),
-                'track_0': float(track[0]),
-                'track_1': float(track[1]),
-                'track_2': float(track[2]),
-                'track_3': float(track[3]),
-                'track_4': float(track[4]),
-                'track_5': float(track[5]),
-                'track_6': float(track[6]),
-                'track_7': float(track[7]),
-                'track_8': float(track[8]),
-                'track_9': float(track[9]),
-                'track_10': float(track[10]),
-                'track_11': float(track[11]),
-                'track_12': float(track[12]),
-                'track_13': float(track[13]),
-                'track_14': float(track[14]),
-                'track_15': float(track[15]),
-                'track_16': float(track[16]),
-                'track_17': float(track[17]),
-                'track_18': float(track[18]),
-                'wheelSpinVel_0': float(wheel[0]),
-                'wheelSpinVel_1': float(wheel[1]),
-                'wheelSpinVel_2': float(wheel[2]),
-                'wheelSpinVel_3': float(wheel[3]),
-                'z': float(self.state.z if self.state.z is not None else 0),
-            }
-
-            # Return features in the correct order
-            return [feature_dict[k] for k in self.input_features]
+            return self.features.fill(self.state)
         except Exception as e:
-            print(f"Feature extraction error: {e}")
+            self.errors.warning('Feature extraction error: %s', e)
             return None
 
     def onShutDown(self):
-        print('Client Shutdown')
+        if self.ensemble is not None:
+            self.ensemble.close()
+        log.info('Client Shutdown')
 
     def onRestart(self):
-        print('Client Restart')
\ No newline at end of file
+        '''Start the next episode afresh: no sequence history, controls or latency estimate carried over'''
+        self.pipeline.reset()
+        self.control = carControl.CarControl()
+        self.estimate_ns = 0
+        self.valid = False
+        self.path = None
+        log.info('Client Restart')
\ No newline at end of file
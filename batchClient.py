@@ -0,0 +1,235 @@
+import sys
+import argparse
+import socket
+import selectors
+import time
+import numpy as np
+import autoDriver
+import driveLog
+
+log = driveLog.get_logger('batchClient')
+
+
+class Car(object):
+    '''
+    One TORCS client driven by the batch server: its socket, driver and progress
+    '''
+    def __init__(self, host, port, driver):
+        '''Constructor'''
+        self.address = (host, port)
+        self.driver = driver
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setblocking(False)
+        self.identified = False
+        self.done = False
+        self.next_init = 0.0
+        self.current_step = 0
+        self.cur_episode = 0
+        self.frame = None
+
+    def send(self, buf):
+        try:
+            self.sock.sendto(buf.encode(), self.address)
+        except socket.error:
+            log.error('Failed to send data to port %d ...Exiting...', self.address[1])
+            sys.exit(-1)
+
+
+class BatchServer(object):
+    '''
+    Drives several TORCS clients from one process. Sensor frames that arrive
+    within the same tick window are stacked into one matrix, so the fused
+    scaler-plus-model pipeline runs once per tick for all cars instead of
+    once per car.
+    '''
+    def __init__(self, host, ports, bot_id='SCR', stage=3, max_episodes=1, max_steps=0, window=0.005, mode='xgb'):
+        '''Constructor'''
+        self.bot_id = bot_id
+        self.max_episodes = max_episodes
+        self.max_steps = max_steps
+        self.window = window
+
+        # The first driver loads the scaler and model, the others share them
+        first = autoDriver.autoDriver(stage, mode=mode)
+        drivers = [first] + [autoDriver.autoDriver(stage, first.scaler, first.model, first.pipeline, mode)
+                             for _ in ports[1:]]
+        self.pipeline = first.pipeline
+        self.cars = [Car(host, port, d) for port, d in zip(ports, drivers)]
+        self.X = np.zeros((len(self.cars), len(first.input_features)))
+
+        self.errors = driveLog.Sampled(log)
+
+        self.selector = selectors.DefaultSelector()
+        for car in self.cars:
+            self.selector.register(car.sock, selectors.EVENT_READ, car)
+
+    def run(self):
+        while not all(car.done for car in self.cars):
+            self.identify()
+            if not self.collect():
+                continue
+            self.step()
+
+        self.selector.close()
+        for car in self.cars:
+            car.sock.close()
+
+    def identify(self):
+        '''Send the init string again to every car still waiting for ***identified***'''
+        now = time.monotonic()
+        for car in self.cars:
+            if not car.done and not car.identified and now >= car.next_init:
+                car.send(self.bot_id + car.driver.init())
+                car.next_init = now + 1.0
+
+    def collect(self):
+        '''
+        Wait for the first sensor frame of a tick, then keep collecting until
+        every racing car has sent one or the tick window closes.
+        Returns True if there are frames to drive.
+        '''
+        if not self.receive(1.0):
+            log.warning("didn't get response from server...")
+            return False
+
+        deadline = time.monotonic() + self.window
+        while True:
+            waiting = [c for c in self.cars if c.identified and not c.done and c.frame is None]
+            remaining = deadline - time.monotonic()
+            if not waiting or remaining <= 0:
+                break
+            self.receive(remaining)
+        return any(car.frame is not None for car in self.cars)
+
+    def receive(self, timeout):
+        '''Read every datagram available within timeout. Returns False on timeout.'''
+        events = self.selector.select(timeout)
+        for key, _ in events:
+            car = key.data
+            while True:
+                try:
+                    buf, _ = car.sock.recvfrom(1000)
+                except (BlockingIOError, InterruptedError):
+                    break
+                except socket.error:
+                    break
+                self.handle(car, buf.decode())
+                if car.done:
+                    break
+        return bool(events)
+
+    def handle(self, car, buf):
+        if not car.identified:
+            if buf.find('***identified***') >= 0:
+                car.identified = True
+                car.current_step = 0
+            return
+
+        if '***shutdown***' in buf:
+            car.driver.onShutDown()
+            car.done = True
+            car.frame = None
+            self.selector.unregister(car.sock)
+            return
+
+        if '***restart***' in buf:
+            car.driver.onRestart()
+            car.identified = False
+            car.frame = None
+            car.next_init = 0.0
+            car.cur_episode += 1
+            if car.cur_episode == self.max_episodes:
+                car.done = True
+                self.selector.unregister(car.sock)
+            return
+
+        # Keep only the newest frame if a car sent more than one this tick
+        car.frame = buf
+
+    def step(self):
+        '''Run one batched prediction for every car that sent a frame and answer each'''
+        batch = []
+        replies = {}
+        for car in self.cars:
+            if car.frame is None:
+                continue
+            msg, car.frame = car.frame, None
+            car.current_step += 1
+            if car.current_step == self.max_steps:
+                replies[car] = '(meta 1)'
+                continue
+
+            features = car.driver.prepare(msg)
+            if features is None:
+                self.errors.warning('Error extracting features')
+                car.driver.set_safe_controls()
+                replies[car] = car.driver.control.toMsg()
+                continue
+            self.X[len(batch)] = features
+            batch.append(car)
+
+        if batch:
+            try:
+                if self.pipeline.stateful:
+                    # Sequence models keep per-car history: one step per car
+                    predictions = [car.driver.pipeline.predict_row(x) for car, x in zip(batch, self.X)]
+                else:
+                    predictions = self.pipeline.predict(self.X[:len(batch)])
+            except Exception as e:
+                self.errors.warning('Error in model prediction: %s', e)
+                predictions = [None] * len(batch)
+
+            for car, prediction in zip(batch, predictions):
+                try:
+                    if prediction is None:
+                        raise ValueError('no prediction')
+                    car.driver.apply_prediction(prediction)
+                except Exception as e:
+                    self.errors.warning('Error in model prediction: %s', e)
+                    car.driver.set_safe_controls()
+                replies[car] = car.driver.control.toMsg()
+
+        for car, reply in replies.items():
+            car.send(reply)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Python client driving several cars on TORCS SCRC servers with batched inference.')
+    parser.add_argument('--host', action='store', dest='host_ip', default='localhost',
+                        help='Host IP address (default: localhost)')
+    parser.add_argument('--port', action='store', type=int, dest='host_port', default=3001,
+                        help='Port of the first car; car i uses port + i (default: 3001)')
+    parser.add_argument('--cars', action='store', type=int, dest='cars', default=1,
+                        help='Number of cars to drive (default: 1)')
+    parser.add_argument('--id', action='store', dest='id', default='SCR',
+                        help='Bot ID (default: SCR)')
+    parser.add_argument('--maxEpisodes', action='store', dest='max_episodes', type=int, default=1,
+                        help='Maximum number of learning episodes per car (default: 1)')
+    parser.add_argument('--maxSteps', action='store', dest='max_steps', type=int, default=0,
+                        help='Maximum number of steps (default: 0)')
+    parser.add_argument('--stage', action='store', dest='stage', type=int, default=3,
+                        help='Stage (0 - Warm-Up, 1 - Qualifying, 2 - Race, 3 - Unknown)')
+    parser.add_argument('--mode', action='store', dest='mode', default='xgb', choices=sorted(autoDriver.MODES),
+                        help='Controller to drive with: xgb or lstm (default: xgb)')
+    parser.add_argument('--window', action='store', dest='window', type=float, default=5.0,
+                        help='Milliseconds to wait for the other cars after the first frame of a tick (default: 5)')
+    driveLog.add_arguments(parser)
+    arguments = parser.parse_args()
+    driveLog.configure(arguments.log_level, every=arguments.log_every)
+
+    ports = [arguments.host_port + i for i in range(arguments.cars)]
+    print('Connecting to server host ip:', arguments.host_ip, '@ ports:', ports)
+    print('Bot ID:', arguments.id)
+    print('Maximum episodes:', arguments.max_episodes)
+    print('Maximum steps:', arguments.max_steps)
+    print('Stage:', arguments.stage)
+    print('Mode:', arguments.mode)
+    print('*********************************************')
+
+    server = BatchServer(arguments.host_ip, ports, arguments.id, arguments.stage,
+                         arguments.max_episodes, arguments.max_steps, arguments.window / 1000.0, arguments.mode)
+    server.run()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+import argparse
+import carControl
+import msgParser
+import telemetry
+from bench_parser import best_time
+
+
+def legacy_to_msg(parser, control):
+    '''The dict-of-lists plus MsgParser.stringify path CarControl.toMsg used to take'''
+    actions = {}
+    actions['accel'] = [control.accel]
+    actions['brake'] = [control.brake]
+    actions['gear'] = [control.gear]
+    actions['steer'] = [control.steer]
+    actions['clutch'] = [control.clutch]
+    actions['focus'] = [control.focus]
+    actions['meta'] = [control.meta]
+    return parser.stringify(actions)
+
+
+def load_controls(csv_path, limit=None):
+    '''Return CarControl objects holding the controls recorded in a telemetry CSV'''
+    controls = []
+    for row in telemetry.read_rows(csv_path, limit):
+        controls.append(carControl.CarControl(
+            accel=float(row['accel']), brake=float(row['brake']), gear=int(row['gear']),
+            steer=float(row['steer']), clutch=float(row['clutch']), meta=int(row['meta'])))
+    return controls
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the control message serializers on recorded controls.')
+    parser.add_argument('--csv', default='new_new.csv', help='Recorded telemetry CSV (default: new_new.csv)')
+    parser.add_argument('--limit', type=int, default=None, help='Number of rows to use (default: all)')
+    parser.add_argument('--repeat', type=int, default=5, help='Number of timed runs (default: 5)')
+    args = parser.parse_args()
+
+    controls = load_controls(args.csv, args.limit)
+    old = msgParser.MsgParser()
+
+    for control in controls:
+        if legacy_to_msg(old, control) != control.toMsg():
+            raise SystemExit('Serializers disagree on: ' + control.toMsg())
+
+    timings = [
+        ('dict + stringify + encode', best_time(lambda c: legacy_to_msg(old, c).encode(), controls, args.repeat)),
+        ('CarControl.toMsg', best_time(carControl.CarControl.toMsg, controls, args.repeat)),
+        ('CarControl.toBytes', best_time(carControl.CarControl.toBytes, controls, args.repeat)),
+    ]
+
+    n = len(controls)
+    print('Control messages:', n, 'from', args.csv)
+    for label, elapsed in timings:
+        print(f'{label:26s} {elapsed / n * 1e6:8.2f} us/msg  {timings[0][1] / elapsed:6.2f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+import argparse
+import time
+import msgParser
+import telemetry
+
+
+def legacy_parse(parser, schema, msg):
+    '''MsgParser.parse followed by the float/int conversions CarState does'''
+    sensors = parser.parse(msg)
+    typed = {}
+    for name, size, kind in schema:
+        val = sensors.get(name)
+        if val is None:
+            continue
+        if size == 1:
+            typed[name] = kind(val[0])
+        else:
+            typed[name] = [float(v) for v in val]
+    return typed
+
+
+def best_time(func, messages, repeat):
+    '''Best wall time over `repeat` runs of func over all messages'''
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for msg in messages:
+            func(msg)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the sensor message parsers on recorded telemetry.')
+    parser.add_argument('--csv', default='new_new.csv', help='Recorded telemetry CSV (default: new_new.csv)')
+    parser.add_argument('--limit', type=int, default=None, help='Number of rows to use (default: all)')
+    parser.add_argument('--repeat', type=int, default=5, help='Number of timed runs (default: 5)')
+    args = parser.parse_args()
+
+    messages = telemetry.load_messages(args.csv, args.limit)
+    old = msgParser.MsgParser()
+    new = msgParser.SensorParser()
+    schema = msgParser.SENSOR_SCHEMA
+
+    # Both parsers must agree before their timings mean anything
+    for msg in messages:
+        if legacy_parse(old, schema, msg) != new.parse(msg):
+            raise SystemExit('Parsers disagree on message: ' + msg)
+
+    t_old = best_time(lambda m: legacy_parse(old, schema, m), messages, args.repeat)
+    t_new = best_time(new.parse, messages, args.repeat)
+
+    n = len(messages)
+    print('Messages:', n, 'from', args.csv)
+    print(f'MsgParser.parse + conversion: {t_old / n * 1e6:8.2f} us/msg')
+    print(f'SensorParser.parse:           {t_new / n * 1e6:8.2f} us/msg')
+    print(f'Speedup:                      {t_old / t_new:8.2f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,226 @@
+import argparse
+import gc
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+import warnings
+import numpy as np
+import autoDriver
+import carState
+import msgParser
+import telemetry
+from bench_control import load_controls
+
+DEFAULT_BASELINE = 'bench_baseline.json'
+
+# Relative slowdown (or allocation growth) reported as a regression
+DEFAULT_THRESHOLD = 0.20
+
+
+class Case(object):
+    '''
+    One stage of the control path: func is called once per fixture item.
+    prepare, if given, runs untimed before every round, for stages whose
+    fixtures are used up by a call (e.g. CarState caches converted values).
+    '''
+    def __init__(self, name, func, items, prepare=None, chunks=50):
+        '''Constructor'''
+        self.name = name
+        self.func = func
+        self.items = items
+        self.prepare = prepare
+        size = max(1, len(items) // chunks)
+        self.parts = [items[i:i + size] for i in range(0, len(items), size)]
+        self.best = [None] * len(self.parts)
+
+    def round(self):
+        '''
+        Time one pass through the items. They are timed in chunks and each
+        chunk keeps its best time over all rounds, so a burst of load on the
+        machine spoils one chunk of one round rather than the whole result.
+        '''
+        func, best = self.func, self.best
+        clock = time.perf_counter_ns
+        if self.prepare is not None:
+            self.prepare()
+        for j, part in enumerate(self.parts):
+            start = clock()
+            for item in part:
+                func(item)
+            elapsed = clock() - start
+            if best[j] is None or elapsed < best[j]:
+                best[j] = elapsed
+
+    def time_ns(self):
+        '''Best time per call in ns so far'''
+        return sum(self.best) / len(self.items)
+
+    def allocations(self):
+        '''
+        (bytes, blocks) per call. Python keeps no count of allocations, so
+        bytes is the tracemalloc peak above the starting point of each call
+        (the temporaries it creates) and blocks the memory blocks still
+        held afterwards (what it keeps, e.g. a cache growing).
+        '''
+        func, items = self.func, self.items
+        if self.prepare is not None:
+            self.prepare()
+        gc.disable()
+        try:
+            before = sys.getallocatedblocks()
+            for item in items:
+                func(item)
+            blocks = sys.getallocatedblocks() - before
+
+            if self.prepare is not None:
+                self.prepare()
+            tracemalloc.start()
+            peak = 0
+            for item in items:
+                tracemalloc.reset_peak()
+                current = tracemalloc.get_traced_memory()[0]
+                func(item)
+                peak += tracemalloc.get_traced_memory()[1] - current
+            tracemalloc.stop()
+        finally:
+            gc.enable()
+        return peak / len(items), blocks / len(items)
+
+
+def build_cases(csv_path, limit=None, mode='xgb'):
+    '''Cases for every stage, with fixtures built from a recorded telemetry CSV'''
+    messages = telemetry.load_messages(csv_path, limit)
+    controls = load_controls(csv_path, limit)
+    actions = [dict(c.toActions()) for c in controls]
+    parser = msgParser.MsgParser()
+
+    driver = autoDriver.autoDriver(3, mode=mode)
+    states = [carState.CarState() for _ in messages]
+
+    def set_states():
+        for state, msg in zip(states, messages):
+            state.setFromMsg(msg)
+
+    def extract(state):
+        driver.state = state
+        return driver.extract_features()
+
+    set_states()
+    features = [extract(state).copy() for state in states]
+    rows = [x.reshape(1, -1) for x in features]
+    scaler = driver.scaler
+    scaled = [scaler.transform(x) for x in rows]
+    model = driver.model
+    pipeline = driver.pipeline
+    if pipeline.stateful:
+        # The LSTM takes windows, not rows: time one step of its pipeline instead
+        predict = ('pipeline.predict_row', pipeline.predict_row, features)
+    else:
+        predict = ('model.predict', model.predict, scaled)
+
+    state = carState.CarState()
+    return [
+        Case('MsgParser.parse', parser.parse, messages),
+        Case('MsgParser.stringify', parser.stringify, actions),
+        Case('CarState.setFromMsg', state.setFromMsg, messages),
+        Case('CarControl.toMsg', lambda c: c.toMsg(), controls),
+        # Its blocks/op are the sensor values each CarState keeps once converted
+        Case('autoDriver.extract_features', extract, states, prepare=set_states),
+        Case('scaler.transform', scaler.transform, rows),
+        Case(*predict),
+        Case('autoDriver.drive', driver.drive, messages, prepare=pipeline.reset),
+    ]
+
+
+def environment():
+    '''What the numbers depend on besides the code'''
+    return {'python': platform.python_version(), 'numpy': np.__version__, 'machine': platform.machine(),
+            'processor': platform.processor(), 'cpus': os.cpu_count()}
+
+
+def run(cases, repeat):
+    '''
+    Per-stage results. Rounds go through every case in turn, so a slow
+    spell of the machine hits all stages a little instead of one entirely.
+    '''
+    for _ in range(repeat):
+        for case in cases:
+            case.round()
+    results = {}
+    for case in cases:
+        alloc_bytes, blocks = case.allocations()
+        results[case.name] = {'ns_per_op': case.time_ns(), 'alloc_bytes_per_op': alloc_bytes,
+                              'blocks_per_op': blocks}
+    return results
+
+
+def regressions(results, baseline, threshold=DEFAULT_THRESHOLD):
+    '''(stage, metric, baseline, current) for every metric worse than the baseline beyond threshold'''
+    worse = []
+    for name, current in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        for metric in ('ns_per_op', 'alloc_bytes_per_op'):
+            # Small absolute slack so a stage allocating nothing can't regress on noise
+            slack = 1.0 if metric == 'ns_per_op' else 16.0
+            if current[metric] > base[metric] * (1 + threshold) + slack:
+                worse.append((name, metric, base[metric], current[metric]))
+    return worse
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Micro-benchmark every stage of the control path on recorded telemetry.')
+    parser.add_argument('--csv', default='new_new.csv', help='Recorded telemetry CSV (default: new_new.csv)')
+    parser.add_argument('--limit', type=int, default=2000, help='Number of rows to use (default: 2000)')
+    parser.add_argument('--repeat', type=int, default=7, help='Number of timed runs (default: 7)')
+    parser.add_argument('--mode', default='xgb', choices=('xgb', 'lstm'), help='autoDriver controller (default: xgb)')
+    parser.add_argument('--only', nargs='+', default=None, help='Run only the stages whose name contains one of these')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE,
+                        help=f'Baseline JSON to compare with (default: {DEFAULT_BASELINE})')
+    parser.add_argument('--save', action='store_true', help='Store these results as the new baseline')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help=f'Relative slowdown reported as a regression (default: {DEFAULT_THRESHOLD})')
+    args = parser.parse_args()
+
+    warnings.filterwarnings('ignore')
+    cases = build_cases(args.csv, args.limit, args.mode)
+    if args.only:
+        cases = [c for c in cases if any(part in c.name for part in args.only)]
+    results = run(cases, args.repeat)
+
+    stored = {'environment': environment(), 'results': {}}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            stored = json.load(f)
+        if stored['environment'] != environment():
+            print('Warning: the baseline was measured in a different environment:', stored['environment'])
+
+    baseline = stored['results'].get(args.mode, {})
+    print('Fixtures:', len(cases[0].items), 'rows from', args.csv)
+    print(f"{'stage':30s} {'ns/op':>10s} {'bytes/op':>10s} {'blocks/op':>10s} {'vs baseline':>12s}")
+    for name, r in results.items():
+        base = baseline.get(name)
+        change = f"{(r['ns_per_op'] / base['ns_per_op'] - 1) * 100:+11.1f}%" if base else ''
+        print(f"{name:30s} {r['ns_per_op']:10.0f} {r['alloc_bytes_per_op']:10.0f} {r['blocks_per_op']:10.2f} {change:>12s}")
+
+    worse = regressions(results, baseline, args.threshold)
+    for name, metric, before, after in worse:
+        change = f' ({(after / before - 1) * 100:+.1f}%)' if before else ''
+        print(f'REGRESSION {name} {metric}: {before:.0f} -> {after:.0f}{change}')
+
+    if args.save:
+        stored['environment'] = environment()
+        stored['results'].setdefault(args.mode, {}).update(results)
+        with open(args.baseline, 'w') as f:
+            json.dump(stored, f, indent=2)
+        print('Baseline saved to', args.baseline)
+    elif worse:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+import argparse
+import time
+import warnings
+import joblib
+import numpy as np
+import pandas as pd
+import treeModel
+
+
+def per_call(func, X, repeat):
+    '''Best time of one call of func(X) in seconds'''
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(X)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the compiled NumPy tree evaluator with the library predict.')
+    parser.add_argument('--model', default='controller/G-Speedway_controller_xgb.joblib', help='Tree model .joblib')
+    parser.add_argument('--scaler', default='controller/G-Speedway_controller_scaler.joblib', help='Scaler .joblib')
+    parser.add_argument('--csv', default='new_new.csv', help='Recorded telemetry CSV (default: new_new.csv)')
+    parser.add_argument('--repeat', type=int, default=50, help='Timed calls per batch size (default: 50)')
+    parser.add_argument('--tolerance', type=float, default=1e-4, help='Largest allowed prediction difference')
+    args = parser.parse_args()
+
+    warnings.filterwarnings('ignore')
+    scaler = joblib.load(args.scaler)
+    model = joblib.load(args.model)
+    compiled = treeModel.compile_model(model)
+
+    df = pd.read_csv(args.csv)
+    X = scaler.transform(df[list(scaler.feature_names_in_)])
+    diff = np.abs(np.asarray(model.predict(X)) - compiled.predict(X)).max()
+    print(f'{args.model}: {len(compiled.roots)} trees, depth {compiled.depth}')
+    print(f'Largest prediction difference over {len(X)} rows: {diff:.3g}')
+    if diff > args.tolerance:
+        raise SystemExit('Compiled predictions differ beyond the tolerance')
+
+    print(f"{'rows':>6s} {'library us':>12s} {'compiled us':>12s} {'speedup':>8s}")
+    for rows in (1, 8, 64, 1024):
+        batch = X[:rows]
+        t_lib = per_call(model.predict, batch, args.repeat)
+        t_new = per_call(compiled.predict, batch, args.repeat)
+        print(f'{rows:6d} {t_lib * 1e6:12.1f} {t_new * 1e6:12.1f} {t_lib / t_new:7.2f}x')
+
+
+if __name__ == '__main__':
+    main()
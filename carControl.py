@@ -1,5 +1,8 @@
 import msgParser
 
+# Fixed layout of a control message, formatted in one step by toMsg
+ACTION_TEMPLATE = '(accel %s)(brake %s)(gear %s)(steer %s)(clutch %s)(focus %s)(meta %s)'
+
 class CarControl(object):
     '''
     An object holding all the control parameters of the car
@@ -21,6 +24,17 @@ class CarControl(object):
         self.meta = meta
     
     def toMsg(self):
+        values = (self.accel, self.brake, self.gear, self.steer, self.clutch, self.focus, self.meta)
+        if None in values:
+            # Unset controls are left out of the message
+            return self.parser.stringify(self.toActions())
+        return ACTION_TEMPLATE % values
+    
+    def toBytes(self):
+        '''Return the control message encoded, ready for sock.sendto'''
+        return self.toMsg().encode('ascii')
+    
+    def toActions(self):
         self.actions = {}
         
         self.actions['accel'] = [self.accel]
@@ -31,7 +45,7 @@ class CarControl(object):
         self.actions['focus'] = [self.focus]
         self.actions['meta'] = [self.meta]
         
-        return self.parser.stringify(self.actions)
+        return self.actions
     
     def setAccel(self, accel):
         self.accel = accel
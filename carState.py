@@ -1,119 +1,124 @@
 import msgParser
 
+# Marks a field whose raw value has not been converted yet this tick
+_PENDING = object()
+
+
+def _decoder(size, kind):
+    '''Return a function converting a raw value string to the sensor type'''
+    if size == 1:
+        return kind
+    return lambda raw: list(map(kind, raw.split()))
+
+
+def _field(index, decode):
+    '''Property reading a sensor value, converting it on first access'''
+    def get(self):
+        value = self._values[index]
+        if value is _PENDING:
+            raw = self._raw[index]
+            value = None if raw is None else decode(raw)
+            self._values[index] = value
+        return value
+
+    def set(self, value):
+        self._values[index] = value
+
+    return property(get, set)
+
+
 class CarState(object):
     '''
-    Class that hold all the car state variables
+    Class that hold all the car state variables.
+    Raw sensor strings are kept in preallocated slots and only converted
+    when a driver reads them, so unused sensors cost nothing per tick.
     '''
-
+    __slots__ = ('parser', '_index', '_raw', '_values', '_nones', '_pending')
 
     def __init__(self):
         '''Constructor'''
-        self.parser = msgParser.MsgParser()
-        self.sensors = None
-        self.angle = None
-        self.curLapTime = None
-        self.damage = None
-        self.distFromStart = None
-        self.distRaced = None
-        self.focus = None
-        self.fuel = None
-        self.gear = None
-        self.lastLapTime = None
-        self.opponents = None
-        self.racePos = None
-        self.rpm = None
-        self.speedX = None
-        self.speedY = None
-        self.speedZ = None
-        self.track = None
-        self.trackPos = None
-        self.wheelSpinVel = None
-        self.z = None
-    
+        self.parser = msgParser.SensorParser()
+        self._index = {name: i for i, (name, _, _) in enumerate(msgParser.SENSOR_SCHEMA)}
+        self._nones = [None] * len(self._index)
+        self._pending = [_PENDING] * len(self._index)
+        self._raw = list(self._nones)
+        self._values = list(self._nones)
+
     def setFromMsg(self, str_sensors):
-        self.sensors = self.parser.parse(str_sensors)
-        
-        self.setAngleD()
-        self.setCurLapTimeD()
-        self.setDamageD()
-        self.setDistFromStartD()
-        self.setDistRacedD()
-        self.setFocusD()
-        self.setFuelD()
-        self.setGearD()
-        self.setLastLapTimeD()
-        self.setOpponentsD()
-        self.setRacePosD()
-        self.setRpmD()
-        self.setSpeedXD()
-        self.setSpeedYD()
-        self.setSpeedZD()
-        self.setTrackD()
-        self.setTrackPosD()
-        self.setWheelSpinVelD()
-        self.setZD()
-    
+        raw = self._raw
+        raw[:] = self._nones
+        self._values[:] = self._pending
+
+        groups = self.parser.split(str_sensors)
+        if groups is None:
+            return
+
+        index = self._index
+        for name, values in groups:
+            i = index.get(name)
+            if i is not None:
+                raw[i] = values
+
+    @property
+    def sensors(self):
+        '''Tags and value strings of the last message, as MsgParser.parse returns them'''
+        return {name: raw.split() for name, raw in zip(self._index, self._raw) if raw is not None}
+
     def toMsg(self):
-        self.sensors = {}
-        
-        self.sensors['angle'] = [self.angle]
-        self.sensors['curLapTime'] = [self.curLapTime]
-        self.sensors['damage'] = [self.damage]
-        self.sensors['distFromStart'] = [self.distFromStart]
-        self.sensors['distRaced'] = [self.distRaced]
-        self.sensors['focus'] = self.focus
-        self.sensors['fuel'] = [self.fuel]
-        self.sensors['gear'] = [self.gear]
-        self.sensors['lastLapTime'] = [self.lastLapTime]
-        self.sensors['opponents'] = self.opponents
-        self.sensors['racePos'] = [self.racePos]
-        self.sensors['rpm'] = [self.rpm]
-        self.sensors['speedX'] = [self.speedX]
-        self.sensors['speedY'] = [self.speedY]
-        self.sensors['speedZ'] = [self.speedZ]
-        self.sensors['track'] = self.track
-        self.sensors['trackPos'] = [self.trackPos]
-        self.sensors['wheelSpinVel'] = self.wheelSpinVel
-        self.sensors['z'] = [self.z]
-        
-        return self.parser.stringify(self.sensors)
-    
+        sensors = {}
+
+        sensors['angle'] = [self.angle]
+        sensors['curLapTime'] = [self.curLapTime]
+        sensors['damage'] = [self.damage]
+        sensors['distFromStart'] = [self.distFromStart]
+        sensors['distRaced'] = [self.distRaced]
+        sensors['focus'] = self.focus
+        sensors['fuel'] = [self.fuel]
+        sensors['gear'] = [self.gear]
+        sensors['lastLapTime'] = [self.lastLapTime]
+        sensors['opponents'] = self.opponents
+        sensors['racePos'] = [self.racePos]
+        sensors['rpm'] = [self.rpm]
+        sensors['speedX'] = [self.speedX]
+        sensors['speedY'] = [self.speedY]
+        sensors['speedZ'] = [self.speedZ]
+        sensors['track'] = self.track
+        sensors['trackPos'] = [self.trackPos]
+        sensors['wheelSpinVel'] = self.wheelSpinVel
+        sensors['z'] = [self.z]
+
+        return self.parser.stringify(sensors)
+
+    def getRawD(self, name):
+        i = self._index.get(name)
+        if i is None:
+            return None
+        return self._raw[i]
+
     def getFloatD(self, name):
-        try:
-            val = self.sensors[name]
-        except KeyError:
-            val = None
-        
+        val = self.getRawD(name)
+
         if val != None:
-            val = float(val[0])
-        
+            val = float(val.split()[0])
+
         return val
-    
+
     def getFloatListD(self, name):
-        try:
-            val = self.sensors[name]
-        except KeyError:
-            val = None
-        
+        val = self.getRawD(name)
+
         if val != None:
-            l = []
-            for v in val:
-                l.append(float(v))
-            val = l
-        
+            val = list(map(float, val.split()))
+
         return val
-    
+
     def getIntD(self, name):
-        try:
-            val = self.sensors[name]
-        except KeyError:
-            val = None
-        
+        val = self.getRawD(name)
+
         if val != None:
-            val = int(val[0])
-        
+            val = int(val.split()[0])
+
         return val
-    
+
     def setAngle(self, angle):
         self.angle = angle
     
@@ -278,5 +283,8 @@ class CarState(object):
     
     def getZ(self):
         return self.z
-    
-    
\ No newline at end of file
+
+
+# One lazily converted property per sensor in the schema (angle, track, ...)
+for _i, (_name, _size, _kind) in enumerate(msgParser.SENSOR_SCHEMA):
+    setattr(CarState, _name, _field(_i, _decoder(_size, _kind)))
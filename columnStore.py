@@ -0,0 +1,186 @@
+import argparse
+import csv
+import itertools
+import json
+import os
+import numpy as np
+from numpy.lib import format as npy_format
+import combination_script
+
+MANIFEST = 'manifest.json'
+VERSION = 1
+
+# Rows parsed and written per step while converting
+CHUNK_ROWS = 65536
+
+
+def _column_file(name):
+    return f'{name}.npy'
+
+
+def _count_rows(path):
+    '''Data rows of a CSV as csv.DictReader yields them (blank lines skipped)'''
+    with open(path, newline='', encoding='utf-8') as f:
+        reader = csv.reader(f)
+        if next(reader, None) is None:
+            return 0
+        return sum(1 for row in reader if row)
+
+
+def _read_header(path):
+    with open(path, newline='', encoding='utf-8') as f:
+        return next(csv.reader(f), None) or []
+
+
+def _to_float32(chunk):
+    '''
+    Parse a (rows, columns) array of strings. Empty or non-numeric cells
+    become NaN; the fast path converts the whole chunk in one call.
+    '''
+    try:
+        return chunk.astype(np.float64).astype(np.float32)
+    except ValueError:
+        out = np.full(chunk.shape, np.nan, dtype=np.float32)
+        for j in range(chunk.shape[1]):
+            column = chunk[:, j]
+            try:
+                out[:, j] = column.astype(np.float64)
+                continue
+            except ValueError:
+                pass
+            for i, text in enumerate(column):
+                try:
+                    out[i, j] = float(text)
+                except ValueError:
+                    pass
+        return out
+
+
+def _chunks(path, columns, chunk_rows):
+    '''Yield (rows, len(columns)) string arrays of a CSV laid out on columns'''
+    rows = combination_script.stream_rows(path, columns)
+    while True:
+        chunk = list(itertools.islice(rows, chunk_rows))
+        if not chunk:
+            return
+        yield np.array(chunk)
+
+
+def convert(csv_paths, out_dir, columns=None, chunk_rows=CHUNK_ROWS):
+    '''
+    Convert telemetry CSVs into a columnar store: one float32 .npy file per
+    column plus manifest.json. Files are concatenated in the given order and
+    each one is recorded as a segment, so episode boundaries survive.
+    Columns default to the sorted union of all headers; missing values are NaN.
+    Memory use is bounded by chunk_rows, whatever the input size.
+    Returns the manifest.
+    '''
+    csv_paths = list(csv_paths)
+    if columns is None:
+        names = set()
+        for path in csv_paths:
+            names.update(_read_header(path))
+        columns = sorted(names)
+    columns = list(columns)
+
+    segments = []
+    start = 0
+    for path in csv_paths:
+        n = _count_rows(path)
+        segments.append({'source': os.path.basename(path), 'start': start, 'stop': start + n})
+        start += n
+    n_rows = start
+
+    os.makedirs(out_dir, exist_ok=True)
+    arrays = [npy_format.open_memmap(os.path.join(out_dir, _column_file(name)), mode='w+',
+                                     dtype=np.float32, shape=(n_rows,))
+              for name in columns]
+
+    for path, segment in zip(csv_paths, segments):
+        row = segment['start']
+        for chunk in _chunks(path, columns, chunk_rows):
+            values = _to_float32(chunk)
+            stop = row + len(values)
+            for j, array in enumerate(arrays):
+                array[row:stop] = values[:, j]
+            row = stop
+
+    for array in arrays:
+        array.flush()
+    del arrays
+
+    manifest = {
+        'version': VERSION,
+        'dtype': 'float32',
+        'rows': n_rows,
+        'columns': columns,
+        'segments': segments,
+    }
+    with open(os.path.join(out_dir, MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+class ColumnStore(object):
+    '''
+    Read side of a store written by convert(). Columns are memory-mapped on
+    first use, so only the pages of the columns actually read are loaded.
+    '''
+    def __init__(self, path):
+        '''Constructor'''
+        self.path = path
+        with open(os.path.join(path, MANIFEST)) as f:
+            self.manifest = json.load(f)
+        if self.manifest.get('version') != VERSION:
+            raise ValueError(f'{path}: unsupported store version {self.manifest.get("version")}')
+        self.columns = self.manifest['columns']
+        self.rows = self.manifest['rows']
+        self.segments = self.manifest['segments']
+        self._maps = {}
+
+    def __contains__(self, name):
+        return name in self.columns
+
+    def __getitem__(self, name):
+        '''Read-only memory map of one column'''
+        array = self._maps.get(name)
+        if array is None:
+            if name not in self.columns:
+                raise KeyError(f'{self.path} has no column {name!r}')
+            array = self._maps[name] = np.load(os.path.join(self.path, _column_file(name)), mmap_mode='r')
+        return array
+
+    def matrix(self, names, dtype=np.float32, rows=None):
+        '''Copy the requested columns (optionally a row slice) into a (rows, len(names)) array'''
+        rows = slice(None) if rows is None else rows
+        first = self[names[0]][rows] if names else np.zeros(0, dtype=np.float32)
+        out = np.empty((len(first), len(names)), dtype=dtype)
+        for j, name in enumerate(names):
+            out[:, j] = self[name][rows]
+        return out
+
+    def segment_bounds(self):
+        '''(start, stop) row range of every source file'''
+        return [(s['start'], s['stop']) for s in self.segments]
+
+
+def open_store(path):
+    return ColumnStore(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Convert telemetry CSVs into a float32 columnar store.')
+    parser.add_argument('out', help='Directory to write the .npy columns and manifest.json to')
+    parser.add_argument('csv', nargs='+', help='Telemetry CSV files, concatenated in this order')
+    parser.add_argument('--chunkRows', action='store', dest='chunk_rows', type=int, default=CHUNK_ROWS,
+                        help=f'Rows parsed per step (default: {CHUNK_ROWS})')
+    args = parser.parse_args()
+
+    manifest = convert(args.csv, args.out, chunk_rows=args.chunk_rows)
+    print(f"Wrote {manifest['rows']} rows x {len(manifest['columns'])} columns to {args.out}")
+    for segment in manifest['segments']:
+        print(f"  {segment['source']}: rows {segment['start']}..{segment['stop']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,35 +1,87 @@
 import os
 import glob
 import csv
+from concurrent.futures import ThreadPoolExecutor
+from operator import itemgetter
 
-def combine_csvs(input_folder, output_file):
+# Read and write buffer size for the streaming passes
+BUFFER_SIZE = 1 << 20
+
+
+def read_header(file):
+    '''Column names of one CSV as csv.DictReader sees them (None for an empty file)'''
+    with open(file, newline='', encoding='utf-8') as f:
+        return csv.DictReader(f).fieldnames
+
+
+def collect_headers(csv_files, workers=None):
+    '''
+    Sorted union of the headers of all files. Only the first line of each
+    file is read; with workers > 1 the files are opened in parallel.
+    '''
+    if workers and workers > 1 and len(csv_files) > 1:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            headers = list(pool.map(read_header, csv_files))
+    else:
+        headers = [read_header(file) for file in csv_files]
+
+    all_headers = set()
+    for fieldnames in headers:
+        if fieldnames is not None:
+            all_headers.update(fieldnames)
+    return sorted(all_headers)
+
+
+def stream_rows(file, all_headers):
+    '''
+    Yield the rows of one CSV laid out on all_headers, without building a
+    dict per row. Matches csv.DictReader: blank lines are skipped, missing
+    columns and short rows give '', extra fields are dropped and the last
+    of duplicate column names wins.
+    '''
+    with open(file, newline='', encoding='utf-8', buffering=BUFFER_SIZE) as f:
+        reader = csv.reader(f)
+        fieldnames = next(reader, None)
+        if fieldnames is None:
+            return
+        width = len(fieldnames)
+        index = {name: i for i, name in enumerate(fieldnames)}
+        # Columns this file lacks read the '' appended to every row
+        picks = [index.get(header, -1) for header in all_headers]
+        if len(picks) == 1:
+            pick = lambda row, i=picks[0]: (row[i],)
+        else:
+            pick = itemgetter(*picks)
+
+        for row in reader:
+            if not row:
+                continue
+            if len(row) < width:
+                row += [''] * (width - len(row))
+            row.append('')
+            yield pick(row)
+
+
+def combine_csvs(input_folder, output_file, workers=4):
     # Find all CSV files in the input folder
     csv_files = glob.glob(os.path.join(input_folder, "*.csv"))
     if not csv_files:
         print("No CSV files found in the specified folder.")
         return
 
-    all_rows = []
-    all_headers = set()
+    # First pass: headers only
+    all_headers = collect_headers(csv_files, workers)
 
-    # Read all rows and collect all headers
-    for file in csv_files:
-        with open(file, newline='', encoding='utf-8') as f:
-            reader = csv.DictReader(f)
-            rows = list(reader)
-            all_rows.extend(rows)
-            all_headers.update(reader.fieldnames)
-
-    all_headers = sorted(all_headers)
-
-    # Write combined CSV
-    with open(output_file, "w", newline='', encoding='utf-8') as f:
-        writer = csv.DictWriter(f, fieldnames=all_headers)
-        writer.writeheader()
-        for row in all_rows:
-            # Fill missing columns with empty string
-            full_row = {header: row.get(header, "") for header in all_headers}
-            writer.writerow(full_row)
+    # Second pass: stream every row straight to the output. Write to a
+    # temporary file so an old output inside input_folder is still read
+    # as an input, as before
+    tmp_file = output_file + ".tmp"
+    with open(tmp_file, "w", newline='', encoding='utf-8', buffering=BUFFER_SIZE) as f:
+        writer = csv.writer(f)
+        writer.writerow(all_headers)
+        for file in csv_files:
+            writer.writerows(stream_rows(file, all_headers))
+    os.replace(tmp_file, output_file)
 
     print(f"Combined {len(csv_files)} CSV files into {output_file}")
 
@@ -37,4 +89,4 @@ if __name__ == "__main__":
     # Change 'data_folder' to the folder containing your CSV files
     data_folder = os.path.dirname("Dataset/")
     output_csv = os.path.join(data_folder, "combined_data.csv")
-    combine_csvs(data_folder, output_csv)
\ No newline at end of file
+    combine_csvs(data_folder, output_csv)
@@ -0,0 +1,231 @@
+import collections
+import os
+import re
+import threading
+import time
+import driveLog
+import driverLoader
+
+log = driveLog.get_logger('controllerRegistry')
+
+CONTROLLER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'controller')
+
+# {track}[_{car}]_{kind}_scaler.joblib / _xgb.joblib / .keras, as written by
+# the notebook and trainController.py. Track names contain no underscore.
+ARTEFACT = re.compile(r'^(?P<track>[^_]+)(?:_(?P<car>(?!steer_controller|controller).+?))?'
+                      r'_(?P<kind>steer_controller|controller)'
+                      r'(?:_(?P<part>scaler|xgb))?\.(?P<ext>joblib|keras)$')
+
+# File holding the model of each driver mode
+MODEL_PART = {'xgb': ('xgb', 'joblib'), 'lstm': (None, 'keras')}
+
+
+def check_model(scaler, model):
+    '''Raise ValueError saying why a loaded scaler and model can't drive, if they can't'''
+    estimators = getattr(model, 'estimators_', None)
+    if estimators is not None and len(estimators) == 0:
+        raise ValueError(f'{type(model).__name__} has no trees (saved before it was fitted?)')
+    import featureCompiler
+    featureCompiler.check_feature_order(scaler, model)
+
+
+class Entry(collections.namedtuple('Entry', 'track car kind mode scaler model')):
+    '''One scaler and model pair in the controller directory'''
+    __slots__ = ()
+
+    def files(self):
+        '''Every file whose change means the entry must be reloaded'''
+        import treeModel
+        import lstmModel
+        compiled = lstmModel.compiled_path(self.model) if self.mode == 'lstm' else treeModel.compiled_path(self.model)
+        return (self.scaler, self.model, compiled)
+
+    def describe(self):
+        where = ' '.join(p for p in (self.track, self.car) if p) or 'default'
+        return f'{where} {self.kind} ({self.mode}: {os.path.basename(self.model)})'
+
+
+class Registry(object):
+    '''
+    Index of the controller artefacts by track and car, with an LRU cache
+    of loaded (scaler, model, pipeline) triples.
+
+    lookup() returns candidates from most to least specific: track and car,
+    track only, then the built-in default of the mode (and of the steer
+    controller). load() takes the
+    first one that loads, so a broken artefact falls back instead of
+    stopping the client. With validate, every entry is loaded once when
+    the directory is scanned and the broken ones are logged and dropped.
+    '''
+    def __init__(self, directory=CONTROLLER_DIR, cache_size=4, validate=False):
+        '''Constructor'''
+        self.directory = directory
+        self.cache_size = cache_size
+        self.cache = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.entries = []
+        self.scan(validate)
+
+    def scan(self, validate=False):
+        '''Re-read the controller directory'''
+        files = {}
+        for name in os.listdir(self.directory):
+            match = ARTEFACT.match(name)
+            if match:
+                key = (match['track'], match['car'], match['kind'])
+                files.setdefault(key, {})[(match['part'], match['ext'])] = os.path.join(self.directory, name)
+
+        entries = []
+        for (track, car, kind), parts in sorted(files.items(), key=lambda item: [p or '' for p in item[0]]):
+            scaler = parts.get(('scaler', 'joblib'))
+            for mode, part in MODEL_PART.items():
+                if scaler is not None and part in parts:
+                    entries.append(Entry(track, car, kind, mode, scaler, parts[part]))
+        for mode, (scaler, model) in driverLoader.MODES.items():
+            entries.append(Entry(None, None, 'controller', mode, os.path.join(self.directory, scaler),
+                                 os.path.join(self.directory, model)))
+        scaler, model = driverLoader.STEER_ARTEFACTS
+        entries.append(Entry(None, None, 'steer_controller', 'xgb', os.path.join(self.directory, scaler),
+                             os.path.join(self.directory, model)))
+        self.entries = entries
+        if validate:
+            self.validate()
+        return self.entries
+
+    def validate(self):
+        '''Load every entry, dropping (and logging) the ones that don't load'''
+        valid = []
+        for entry in self.entries:
+            try:
+                self.get(entry)
+            except Exception as e:
+                log.error('Ignoring %s: %s', entry.describe(), e)
+                continue
+            valid.append(entry)
+        self.entries = valid
+        return valid
+
+    def lookup(self, track=None, car=None, mode='xgb', kind='controller'):
+        '''Candidate entries for a track and car, most specific first'''
+        def same(a, b):
+            return a is not None and b is not None and a.lower() == b.lower()
+
+        ranked = []
+        for entry in self.entries:
+            if entry.mode != mode or entry.kind != kind:
+                continue
+            if entry.track is None:
+                rank = 3
+            elif not same(entry.track, track):
+                continue
+            elif entry.car is None:
+                rank = 2 if car is None else 1
+            elif same(entry.car, car):
+                rank = 0
+            else:
+                continue
+            ranked.append((rank, entry))
+        return [entry for _, entry in sorted(ranked, key=lambda item: item[0])]
+
+    def get(self, entry):
+        '''(scaler, model, pipeline) of an entry, from the cache or loaded'''
+        key = (entry.scaler, entry.model, self.stamp(entry))
+        with self.lock:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                return self.cache[key]
+
+        import joblib
+        import autoDriver
+        import inferencePipeline
+        scaler = joblib.load(entry.scaler)
+        model = autoDriver.load_model(entry.model)
+        check_model(scaler, model)
+        pipeline = inferencePipeline.build(scaler, model)
+
+        # One prediction on the training means proves the model is usable
+        # and warms it up
+        mean = getattr(scaler, 'mean_', None)
+        if mean is not None:
+            try:
+                pipeline.predict_row(mean)
+            except Exception as e:
+                raise ValueError(f'{os.path.basename(entry.model)} fails to predict: {type(e).__name__}: {e}') from e
+            pipeline.reset()
+        loaded = (scaler, model, pipeline)
+
+        with self.lock:
+            self.cache[key] = loaded
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return loaded
+
+    def load(self, track=None, car=None, mode='xgb', kind='controller'):
+        '''(entry, scaler, model, pipeline) of the best candidate that loads'''
+        errors = []
+        for entry in self.lookup(track, car, mode, kind):
+            try:
+                return (entry,) + self.get(entry)
+            except Exception as e:
+                log.warning('Skipping %s: %s', entry.describe(), e)
+                errors.append(f'{entry.describe()}: {e}')
+        raise ValueError(f'No loadable {mode} {kind} for track={track} car={car}: ' + '; '.join(errors))
+
+    @staticmethod
+    def stamp(entry):
+        '''Modification times of an entry's files (None for a missing one)'''
+        stamps = []
+        for path in entry.files():
+            try:
+                stamps.append(os.stat(path).st_mtime_ns)
+            except OSError:
+                stamps.append(None)
+        return tuple(stamps)
+
+
+class Reloader(object):
+    '''
+    Watches the artefacts a driver uses and hot-swaps a retrained model in
+    between ticks. Polling, loading and warm-up happen on a daemon thread;
+    the driver only picks up the new artefacts at the start of its next
+    drive(). Files must be unchanged for two polls in a row before they are
+    loaded, so a model still being written is never read half-way.
+    '''
+    def __init__(self, registry, driver, entry, interval=2.0):
+        '''Constructor'''
+        self.registry = registry
+        self.driver = driver
+        self.entry = entry
+        self.interval = interval
+        self.loaded = registry.stamp(entry)
+        self.seen = self.loaded
+        self.swaps = 0
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='controller-reloader', daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while not self.stopping.wait(self.interval):
+            self.poll()
+
+    def poll(self):
+        stamp = self.registry.stamp(self.entry)
+        stable = stamp == self.seen
+        self.seen = stamp
+        if not stable or stamp == self.loaded or None in stamp[:2]:
+            return
+        started = time.perf_counter()
+        try:
+            scaler, model, pipeline = self.registry.get(self.entry)
+        except Exception as e:
+            log.warning('Keeping the current model, %s failed to load: %s', self.entry.describe(), e)
+            self.loaded = stamp
+            return
+        self.loaded = stamp
+        self.driver.request_swap(scaler, model, pipeline)
+        self.swaps += 1
+        log.info('Reloaded %s in %.0f ms', self.entry.describe(), (time.perf_counter() - started) * 1000)
+
+    def stop(self):
+        self.stopping.set()
+        self.thread.join()
@@ -0,0 +1,98 @@
+import atexit
+import logging
+import logging.handlers
+import queue
+import sys
+
+# Parent of every logger in the client; configure() attaches the handler here
+ROOT = 'torcs'
+
+# Production races only report problems
+DEFAULT_LEVEL = 'WARNING'
+
+# A 50 Hz tick logs at most once a second by default
+DEFAULT_EVERY = 50
+
+FORMAT = '%(asctime)s %(levelname)-7s %(name)s: %(message)s'
+
+_listener = None
+
+
+def get_logger(name):
+    '''Logger for one module, under the torcs hierarchy'''
+    return logging.getLogger(f'{ROOT}.{name}')
+
+
+def configure(level=DEFAULT_LEVEL, stream=None, every=None):
+    '''
+    Send torcs log records through a queue to a background thread that
+    writes them to stream (stderr by default), so a slow or piped terminal
+    never stalls the control loop. With every set, Sampled loggers created
+    afterwards log one call in that many. Safe to call again to change the level.
+    '''
+    global _listener
+    if every is not None:
+        Sampled.default_every = max(int(every), 1)
+
+    logger = logging.getLogger(ROOT)
+    logger.setLevel(level.upper() if isinstance(level, str) else level)
+    logger.propagate = False
+    if _listener is not None:
+        return logger
+
+    handler = logging.StreamHandler(stream or sys.stderr)
+    handler.setFormatter(logging.Formatter(FORMAT))
+    records = queue.SimpleQueue()
+    logger.addHandler(logging.handlers.QueueHandler(records))
+    _listener = logging.handlers.QueueListener(records, handler)
+    _listener.start()
+    atexit.register(shutdown)
+    return logger
+
+
+def shutdown():
+    '''Write out every queued record and stop the writer thread'''
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def add_arguments(parser):
+    '''Add the --logLevel and --logEvery options to a client's argument parser'''
+    parser.add_argument('--logLevel', action='store', dest='log_level', default=DEFAULT_LEVEL,
+                        help=f'DEBUG, INFO, WARNING or ERROR (default: {DEFAULT_LEVEL})')
+    parser.add_argument('--logEvery', action='store', dest='log_every', type=int, default=DEFAULT_EVERY,
+                        help=f'Log per-tick debug output every N ticks (default: {DEFAULT_EVERY})')
+
+
+class Sampled(object):
+    '''
+    Rate limiter for messages logged on every tick: due() is True for the
+    first call and then one call in every `every`, and only when the logger
+    would emit the level at all, so callers can skip formatting entirely.
+    '''
+    __slots__ = ('logger', 'every', 'count')
+
+    default_every = DEFAULT_EVERY
+
+    def __init__(self, logger, every=None):
+        '''Constructor'''
+        self.logger = logger
+        self.every = every
+        self.count = 0
+
+    def due(self, level=logging.DEBUG):
+        if not self.logger.isEnabledFor(level):
+            return False
+        n = self.count
+        self.count = n + 1
+        return n % (self.every or Sampled.default_every) == 0
+
+    def debug(self, msg, *args):
+        if self.due(logging.DEBUG):
+            self.logger.debug(msg, *args)
+
+    def warning(self, msg, *args):
+        if self.due(logging.WARNING):
+            self.logger.warning(msg, *args)
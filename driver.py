@@ -4,6 +4,9 @@ import carControl
 from pynput import keyboard
 import time
 import math
+import driveLog
+
+log = driveLog.get_logger('driver')
 
 class Driver(object):
     '''
@@ -146,11 +149,11 @@ class Driver(object):
             elif k == 'e':  # Gear Up
                 if self.manual_gear < 6:
                     self.manual_gear += 1
-                    print(f"Gear Up: {self.manual_gear}")
+                    log.info('Gear Up: %d', self.manual_gear)
             elif k == 'q':  # Gear Down
                 if self.manual_gear > -1:
                     self.manual_gear -= 1
-                    print(f"Gear Down: {self.manual_gear}")
+                    log.info('Gear Down: %d', self.manual_gear)
         except AttributeError:
             pass
 
@@ -165,11 +168,11 @@ class Driver(object):
     
     def onShutDown(self):
         '''Called when TORCS sends a shutdown message'''
-        print('Client Shutdown')
+        log.info('Client Shutdown')
     
     def onRestart(self):
         '''Called when TORCS sends a restart message'''
-        print('Client Restart')
+        log.info('Client Restart')
         # Reset control states
         self.current_accel = 0.0
         self.current_brake = 0.0
@@ -0,0 +1,95 @@
+import gc
+import threading
+import time
+import msgParser
+import carControl
+
+# Imported by the clients before anything heavy: numpy, joblib and the
+# model artefacts are only loaded on the background thread
+
+# Scaler and model artefacts in controller/ for each driver mode
+MODES = {
+    'xgb': ('G-Speedway_controller_scaler.joblib', 'G-Speedway_controller_xgb.joblib'),
+    'lstm': ('scaler.joblib', 'racing_controller_lstm.keras'),
+}
+
+# Scaler and model of the default steer-only controller
+STEER_ARTEFACTS = ('G-Speedway_steer_controller_scaler.joblib', 'G-Speedway_steer_controller_xgb.joblib')
+
+# Sent for sensor frames that arrive while the driver is still loading: hold the car
+IDLE_CONTROL = carControl.CarControl(brake=1.0).toMsg()
+
+
+def init_angles():
+    '''Rangefinder angles sent in the init string'''
+    angles = [0 for x in range(19)]
+    for i in range(5):
+        angles[i] = -90 + i * 15
+        angles[18 - i] = 90 - i * 15
+    for i in range(5, 9):
+        angles[i] = -20 + (i-5) * 5
+        angles[18 - i] = 20 - (i-5) * 5
+    angles[9] = 0
+    return angles
+
+
+def init_message():
+    '''Init string sent until the server answers ***identified***'''
+    return msgParser.MsgParser().stringify({'init': init_angles()})
+
+
+class DriverLoader(object):
+    '''
+    Imports autoDriver, loads the artefacts the controller registry picks
+    for the track and car and warms the driver up on a background thread,
+    so all of it overlaps the UDP identification handshake.
+    result() hands over the ready driver, waiting only if it is not done yet.
+    '''
+    def __init__(self, stage, mode='xgb', track=None, car=None, warm_up=20):
+        '''Constructor'''
+        self.stage = stage
+        self.mode = mode
+        self.track = track
+        self.car = car
+        self.warm_up = warm_up
+        self.registry = None
+        self.entry = None
+        self.started = time.perf_counter()
+        self.ready = None
+        self.driver = None
+        self.error = None
+        self.thread = threading.Thread(target=self.run, name='driver-loader', daemon=True)
+        self.thread.start()
+
+    def run(self):
+        try:
+            import autoDriver
+            import controllerRegistry
+            self.registry = controllerRegistry.Registry()
+            self.entry, scaler, model, pipeline = self.registry.load(self.track, self.car, self.mode)
+            driver = autoDriver.autoDriver(self.stage, scaler, model, pipeline, self.mode)
+            driver.warm_up(self.warm_up)
+            # Everything loaded so far lives for the whole race: keep it out
+            # of the collector's generations so early ticks don't pay for it
+            gc.collect()
+            gc.freeze()
+            self.driver = driver
+        except BaseException as e:
+            self.error = e
+        self.ready = time.perf_counter()
+
+    def done(self):
+        return not self.thread.is_alive()
+
+    def result(self, timeout=None):
+        '''The warmed-up driver; re-raises anything loading raised'''
+        self.thread.join(timeout)
+        if self.thread.is_alive():
+            raise TimeoutError('The driver is still loading')
+        if self.error is not None:
+            raise self.error
+        return self.driver
+
+    def load_time(self):
+        '''Seconds the background load and warm-up took'''
+        return self.ready - self.started
@@ -0,0 +1,426 @@
+import argparse
+import collections
+import itertools
+import json
+import multiprocessing
+import os
+import queue
+import socket
+import subprocess
+import sys
+import time
+import driverLoader
+import driveLog
+import tickProfiler
+
+log = driveLog.get_logger('episodeRunner')
+
+# One evaluation episode: the controller is picked by track, car and mode like
+# the clients do, or named explicitly by the file name of its model artefact
+Episode = collections.namedtuple('Episode', 'index track car mode model')
+
+
+def plan(tracks=(None,), cars=(None,), modes=('xgb',), models=(None,), repeat=1):
+    '''Every combination of tracks, cars, modes and models, each repeat times'''
+    combos = itertools.product(tracks, cars, modes, models)
+    specs = [spec for spec in combos for _ in range(repeat)]
+    return [Episode(i, *spec) for i, spec in enumerate(specs)]
+
+
+def load_plan(path):
+    '''Episodes from a JSON list of {"track", "car", "mode", "model", "repeat"} objects'''
+    with open(path) as f:
+        items = json.load(f)
+    episodes = []
+    for item in items:
+        for _ in range(item.get('repeat', 1)):
+            episodes.append(Episode(len(episodes), item.get('track'), item.get('car'), item.get('mode', 'xgb'),
+                                    item.get('model')))
+    return episodes
+
+
+class Worker(object):
+    '''
+    Runs episodes against one server port. Drivers are kept per controller,
+    so a worker loads each scaler and model once however many episodes
+    use it.
+    '''
+    def __init__(self, host, port, bot_id='SCR', stage=3, max_steps=0, timeout=10.0, served=None):
+        '''Constructor'''
+        import controllerRegistry
+        self.address = (host, port)
+        # Recording the stand-in server on the port replays (None for a real server)
+        self.served = served
+        self.bot_id = bot_id
+        self.stage = stage
+        self.max_steps = max_steps
+        self.timeout = timeout
+        # Broken artefacts are reported once, up front, rather than per episode
+        self.registry = controllerRegistry.Registry(validate=True)
+        self.drivers = {}
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.settimeout(1.0)
+
+    def driver(self, episode):
+        '''(entry, warmed-up driver) for an episode's controller'''
+        import autoDriver
+        key = (episode.track, episode.car, episode.mode, episode.model)
+        if key not in self.drivers:
+            if episode.model is None:
+                entry, scaler, model, pipeline = self.registry.load(episode.track, episode.car, episode.mode)
+            else:
+                matches = [e for e in self.registry.entries
+                           if e.mode == episode.mode and os.path.basename(e.model) == episode.model]
+                if not matches:
+                    raise ValueError(f'No {episode.mode} controller with model {episode.model}')
+                entry = matches[0]
+                scaler, model, pipeline = self.registry.get(entry)
+            d = autoDriver.autoDriver(self.stage, scaler, model, pipeline, episode.mode)
+            d.warm_up()
+            self.drivers[key] = (entry, d)
+        return self.drivers[key]
+
+    def identify(self):
+        '''Send the init string until the server answers; False after timeout seconds'''
+        init = (self.bot_id + driverLoader.init_message()).encode()
+        deadline = time.monotonic() + self.timeout
+        while time.monotonic() < deadline:
+            self.sock.sendto(init, self.address)
+            try:
+                buf, _ = self.sock.recvfrom(1000)
+            except socket.timeout:
+                continue
+            if b'***identified***' in buf:
+                return True
+        return False
+
+    def run(self, episode):
+        '''Drive one episode and return its result'''
+        result = {'episode': episode.index, 'track': episode.track, 'car': episode.car, 'mode': episode.mode,
+                  'model': episode.model, 'port': self.address[1], 'served': self.served, 'pid': os.getpid(),
+                  'controller': None,
+                  'ticks': 0, 'valid': 0, 'laps': [], 'damage': None, 'dist_raced': None, 'end': None,
+                  'wall_s': 0.0, 'latency': tickProfiler.Histogram(), 'error': None}
+        started = time.perf_counter()
+        try:
+            entry, d = self.driver(episode)
+            result['controller'] = entry.describe()
+            if not self.identify():
+                raise TimeoutError(f'No server answered on port {self.address[1]}')
+            result['end'] = self.drive(d, result)
+        except Exception as e:
+            result['error'] = f'{type(e).__name__}: {e}'
+        result['wall_s'] = time.perf_counter() - started
+        return result
+
+    def drive(self, d, result):
+        '''The tick loop of one episode; returns how it ended'''
+        d.onRestart()
+        state = d.state
+        histogram = result['latency']
+        clock = time.perf_counter_ns
+        last_lap = 0.0
+        silent = 0
+        step = 0
+        while True:
+            try:
+                buf, _ = self.sock.recvfrom(1000)
+            except socket.timeout:
+                silent += 1
+                if silent >= self.timeout:
+                    return 'timeout'
+                continue
+            silent = 0
+            if buf.startswith(b'***shutdown***'):
+                return 'shutdown'
+            if buf.startswith(b'***restart***'):
+                return 'restart'
+
+            step += 1
+            if step == self.max_steps:
+                # Ask the server to end the episode; its ***restart*** follows
+                self.sock.sendto(b'(meta 1)', self.address)
+                continue
+
+            t = clock()
+            reply = d.drive(buf.decode())
+            histogram.add(clock() - t)
+            self.sock.sendto(reply.encode(), self.address)
+
+            result['ticks'] += 1
+            result['valid'] += d.valid
+            lap = state.lastLapTime
+            if lap and lap != last_lap:
+                result['laps'].append(lap)
+                last_lap = lap
+            result['damage'] = state.damage
+            result['dist_raced'] = state.distRaced
+
+    def close(self):
+        self.sock.close()
+
+
+def work(host, port, options, tasks, results, served=None):
+    '''Worker process: run episodes from tasks until the None sentinel'''
+    driveLog.configure(options.get('log_level', driveLog.DEFAULT_LEVEL))
+    worker = Worker(host, port, options.get('bot_id', 'SCR'), options.get('stage', 3),
+                    options.get('max_steps', 0), options.get('timeout', 10.0), served)
+    try:
+        while True:
+            episode = tasks.get()
+            if episode is None:
+                break
+            results.put(worker.run(episode))
+    finally:
+        worker.close()
+
+
+def parse_recordings(specs):
+    '''(track, path) of each --csv value: track=path, or a bare path for any track'''
+    recordings = []
+    for spec in specs:
+        track, sep, path = spec.partition('=')
+        recordings.append((track, path) if sep else (None, spec))
+    return recordings
+
+
+def assign_recordings(ports, recordings):
+    '''
+    {port: (track, path)}: port i replays recording i modulo their number,
+    so each recording has a port if there are at least as many ports
+    '''
+    return {port: recordings[i % len(recordings)] for i, port in enumerate(ports)}
+
+
+def venue(track):
+    '''Key of the episode queue a track's episodes go to'''
+    return track.lower() if track else None
+
+
+def route(episodes, venues):
+    '''
+    ({venue: [episodes]}, [episodes nothing serves]) for the tracks the
+    ports replay. An episode goes to the ports replaying its track, else to
+    those replaying unlabelled recordings; one without a track goes to
+    every venue in turn.
+    '''
+    queues = collections.OrderedDict((v, []) for v in venues)
+    unserved = []
+    turn = itertools.cycle(list(queues))
+    for episode in episodes:
+        key = venue(episode.track)
+        if key is None:
+            key = next(turn)
+        elif key not in queues:
+            key = None
+        if key in queues:
+            queues[key].append(episode)
+        else:
+            unserved.append(episode)
+    return queues, unserved
+
+
+def start_servers(host, recordings, rate=50.0, frames=None):
+    '''
+    Stand-in SCRC servers, one process per port of recordings ({port: (track, path)}),
+    restarting episodes until the runner stops them
+    '''
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'scrcServer.py')
+    servers = []
+    for port, (_, path) in recordings.items():
+        command = [sys.executable, script, '--host', host, '--port', str(port), '--episodes', '0',
+                   '--rate', str(rate), '--csv', path]
+        if frames:
+            command += ['--frames', str(frames)]
+        servers.append(subprocess.Popen(command, stdout=subprocess.DEVNULL))
+    return servers
+
+
+def run(episodes, host='localhost', ports=(3001,), options=None, recordings=None):
+    '''
+    Run the episodes on one worker process per port and return their
+    results, in episode order. Workers take the next episode from a shared
+    queue as soon as they finish one, so a slow episode holds up one port only.
+    With recordings ({port: (track, path)} of stand-in servers), each track's
+    episodes only go to the ports replaying it.
+    '''
+    options = options or {}
+    recordings = recordings or {port: (None, None) for port in ports}
+    ctx = multiprocessing.get_context('spawn')
+    results = ctx.Queue()
+    queues, unserved = route(episodes, [venue(track) for track, _ in recordings.values()])
+    tasks = {}
+    for key, queued in queues.items():
+        tasks[key] = ctx.Queue()
+        for episode in queued:
+            tasks[key].put(episode)
+    for track, _ in recordings.values():
+        tasks[venue(track)].put(None)
+
+    workers = [ctx.Process(target=work, args=(host, port, options, tasks[venue(track)], results, path),
+                           name=f'episodes-{port}')
+               for port, (track, path) in recordings.items()]
+    for w in workers:
+        w.start()
+
+    done = []
+    for episode in unserved:
+        log.error('Episode %d: no server replays track %s', episode.index, episode.track)
+        done.append({'episode': episode.index, 'track': episode.track, 'car': episode.car, 'mode': episode.mode,
+                     'model': episode.model, 'port': None, 'served': None, 'pid': None, 'controller': None,
+                     'ticks': 0, 'valid': 0, 'laps': [], 'damage': None, 'dist_raced': None, 'end': None,
+                     'wall_s': 0.0, 'latency': tickProfiler.Histogram(),
+                     'error': f'No server replays track {episode.track}'})
+    while len(done) < len(episodes):
+        try:
+            done.append(results.get(timeout=1.0))
+        except queue.Empty:
+            if not any(w.is_alive() for w in workers):
+                log.error('Every worker exited with %d episodes left', len(episodes) - len(done))
+                break
+            continue
+        r = done[-1]
+        log.info('Episode %d on port %d: %s, %d ticks%s', r['episode'], r['port'], r['end'], r['ticks'],
+                 f", error: {r['error']}" if r['error'] else '')
+    for w in workers:
+        w.join()
+    return sorted(done, key=lambda r: r['episode'])
+
+
+def aggregate(results):
+    '''
+    One summary per controller (track, car, mode and model) and recording
+    served, over its episodes
+    '''
+    groups = collections.OrderedDict()
+    for r in results:
+        groups.setdefault((r['track'], r['car'], r['mode'], r['model'], r['served']), []).append(r)
+
+    report = []
+    for (track, car, mode, model, served), rs in groups.items():
+        ok = [r for r in rs if r['error'] is None]
+        laps = [lap for r in ok for lap in r['laps']]
+        damage = [r['damage'] for r in ok if r['damage'] is not None]
+        dist = [r['dist_raced'] for r in ok if r['dist_raced'] is not None]
+        latency = tickProfiler.Histogram()
+        for r in ok:
+            latency.merge(r['latency'])
+        ticks = sum(r['ticks'] for r in ok)
+        report.append({
+            'track': track, 'car': car, 'mode': mode, 'model': model, 'served': served,
+            'controller': next((r['controller'] for r in rs if r['controller']), None),
+            'episodes': len(rs),
+            'errors': len(rs) - len(ok),
+            'ticks': ticks,
+            'valid': sum(r['valid'] for r in ok) / ticks if ticks else 0.0,
+            'laps': len(laps),
+            'best_lap': min(laps) if laps else None,
+            'mean_lap': sum(laps) / len(laps) if laps else None,
+            'mean_damage': sum(damage) / len(damage) if damage else None,
+            'max_damage': max(damage) if damage else None,
+            'mean_dist_raced': sum(dist) / len(dist) if dist else None,
+            'latency': latency.summary(),
+        })
+    return report
+
+
+def print_report(report, wall):
+    def number(value, width, digits):
+        return f'{value:{width}.{digits}f}' if value is not None else f"{'-':>{width}s}"
+
+    names = [(g['controller'] or '-') + (f" @ {os.path.basename(g['served'])}" if g['served'] else '')
+             for g in report]
+    w = max(len(n) for n in names + ['controller'])
+    print(f"{'controller':{w}s} {'eps':>4s} {'err':>4s} {'laps':>5s} {'best lap':>9s} {'mean lap':>9s} "
+          f"{'damage':>8s} {'dist':>9s} {'p50 us':>8s} {'p99 us':>8s} {'>20ms':>6s}")
+    for name, g in zip(names, report):
+        lat = g['latency']
+        print(f"{name:{w}s} {g['episodes']:4d} {g['errors']:4d} {g['laps']:5d} "
+              f"{number(g['best_lap'], 9, 3)} {number(g['mean_lap'], 9, 3)} "
+              f"{number(g['mean_damage'], 8, 1)} {number(g['mean_dist_raced'], 9, 1)} "
+              f"{lat['p50_us']:8.1f} {lat['p99_us']:8.1f} {lat['over_budget']:6d}")
+    episodes = sum(g['episodes'] for g in report)
+    ticks = sum(g['ticks'] for g in report)
+    print(f'{episodes} episodes, {ticks} ticks in {wall:.1f} s: {episodes / wall:.2f} episodes/s, '
+          f'{ticks / wall:.0f} ticks/s')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Evaluate controllers over many episodes, one worker process per server port.')
+    parser.add_argument('--host', action='store', dest='host', default='localhost',
+                        help='Host of the servers (default: localhost)')
+    parser.add_argument('--port', action='store', type=int, dest='port', default=3001,
+                        help='Port of the first server; worker i uses port + i (default: 3001)')
+    parser.add_argument('--workers', action='store', type=int, dest='workers', default=os.cpu_count(),
+                        help='Worker processes, one per server port (default: the number of CPUs)')
+    parser.add_argument('--episodes', action='store', type=int, dest='episodes', default=1,
+                        help='Episodes per controller (default: 1)')
+    parser.add_argument('--track', action='store', dest='tracks', nargs='+', default=[None],
+                        help='Tracks whose controllers to evaluate (default: any)')
+    parser.add_argument('--car', action='store', dest='cars', nargs='+', default=[None],
+                        help='Cars whose controllers to evaluate (default: any)')
+    parser.add_argument('--mode', action='store', dest='modes', nargs='+', default=['xgb'],
+                        choices=sorted(driverLoader.MODES), help='Driver modes to evaluate (default: xgb)')
+    parser.add_argument('--model', action='store', dest='models', nargs='+', default=[None],
+                        help='Model artefacts in controller/ to evaluate, by file name (default: picked by track and car)')
+    parser.add_argument('--plan', action='store', dest='plan', default=None,
+                        help='JSON list of episodes {"track", "car", "mode", "model", "repeat"}, instead of the options above')
+    parser.add_argument('--id', action='store', dest='id', default='SCR', help='Bot ID (default: SCR)')
+    parser.add_argument('--stage', action='store', dest='stage', type=int, default=3,
+                        help='Stage (0 - Warm-Up, 1 - Qualifying, 2 - Race, 3 - Unknown)')
+    parser.add_argument('--maxSteps', action='store', dest='max_steps', type=int, default=0,
+                        help='Steps after which an episode is ended with a restart request, 0 to let the server end it (default: 0)')
+    parser.add_argument('--timeout', action='store', dest='timeout', type=float, default=10.0,
+                        help='Seconds to wait for a server to identify or send a frame (default: 10)')
+    parser.add_argument('--serve', action='store_true', dest='serve',
+                        help='Start a local stand-in server (scrcServer.py) on every port')
+    parser.add_argument('--csv', action='store', dest='csv', nargs='+', default=['new_new.csv'],
+                        help='Recordings the stand-in servers replay, as track=path to serve only that track\'s '
+                             'episodes, or a bare path for any track; port i replays recording i modulo their '
+                             'number (default: new_new.csv)')
+    parser.add_argument('--frames', action='store', dest='frames', type=int, default=None,
+                        help='Frames per stand-in episode (default: the length of the recording)')
+    parser.add_argument('--rate', action='store', dest='rate', type=float, default=50.0,
+                        help='Frames per second of the stand-in servers, 0 for unpaced (default: 50)')
+    parser.add_argument('--json', action='store', dest='json', default=None,
+                        help='Write the report and every episode result to this JSON file')
+    driveLog.add_arguments(parser)
+    args = parser.parse_args()
+    driveLog.configure(args.log_level, every=args.log_every)
+
+    if args.plan:
+        episodes = load_plan(args.plan)
+    else:
+        episodes = plan(args.tracks, args.cars, args.modes, args.models, args.episodes)
+    ports = [args.port + i for i in range(args.workers)]
+    print('Episodes:', len(episodes), 'on ports', ports)
+
+    recordings = assign_recordings(ports, parse_recordings(args.csv)) if args.serve else None
+    servers = start_servers(args.host, recordings, args.rate, args.frames) if args.serve else []
+    options = {'bot_id': args.id, 'stage': args.stage, 'max_steps': args.max_steps, 'timeout': args.timeout,
+               'log_level': args.log_level}
+    started = time.perf_counter()
+    try:
+        results = run(episodes, args.host, ports, options, recordings)
+    finally:
+        for server in servers:
+            server.terminate()
+            server.wait()
+    wall = time.perf_counter() - started
+
+    report = aggregate(results)
+    print_report(report, wall)
+    for r in results:
+        if r['error']:
+            where = f" on port {r['port']}" if r['port'] is not None else ''
+            print(f"Episode {r['episode']}{where} failed: {r['error']}")
+
+    if args.json:
+        for r in results:
+            r['latency'] = r['latency'].summary()
+        with open(args.json, 'w') as f:
+            json.dump({'wall_s': wall, 'report': report, 'episodes': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
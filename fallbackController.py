@@ -0,0 +1,82 @@
+import os
+import joblib
+import numpy as np
+import driverLoader
+import featureCompiler
+import inferencePipeline
+
+CONTROLLER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'controller')
+
+# Steer-only model trained next to the main controller (trainController.py --kind steer_controller)
+STEER_ARTEFACTS = driverLoader.STEER_ARTEFACTS
+
+# Target speed in km/h: SPEED_AT_WALL plus SPEED_PER_METRE for every metre
+# of free track straight ahead, at most MAX_SPEED
+SPEED_AT_WALL = 60.0
+SPEED_PER_METRE = 1.0
+MAX_SPEED = 230.0
+
+# Shift up above / down below these rpm, per gear: the shift points of the
+# recorded G-Speedway laps, which rev well past the SCR example driver's
+GEAR_UP = (8500, 8500, 8500, 8500, 8500, 0)
+GEAR_DOWN = (0, 4000, 5500, 6000, 6000, 6000)
+
+# Steering angle in radians of a full steer command
+STEER_LOCK = 0.785398
+
+
+class FallbackController(object):
+    '''
+    Cheap controls for ticks the primary model cannot serve in time, or
+    fails on: steer from the steer-only tree model, throttle, brake and
+    gear from rules on the speed, the free distance ahead and the rpm.
+    Without a steer model (or if it fails) the car steers to the track axis.
+    '''
+    def __init__(self, scaler=None, model=None, pipeline=None):
+        '''Constructor'''
+        self.features = None
+        self.pipeline = None
+        if model is not None:
+            self.features = featureCompiler.FeatureCompiler.from_artifacts(scaler, model)
+            self.pipeline = pipeline if pipeline is not None else inferencePipeline.build(scaler, model)
+
+    def steer(self, state):
+        if self.pipeline is not None:
+            return float(self.pipeline.predict_row(self.features.fill(state)))
+        return (state.angle - state.trackPos * 0.5) / STEER_LOCK
+
+    def target_speed(self, state):
+        return min(MAX_SPEED, SPEED_AT_WALL + SPEED_PER_METRE * state.track[9])
+
+    def gear(self, state):
+        gear = max(1, min(6, state.gear or 1))
+        rpm = state.rpm
+        if gear < 6 and rpm > GEAR_UP[gear - 1]:
+            return gear + 1
+        if gear > 1 and rpm < GEAR_DOWN[gear - 1]:
+            return gear - 1
+        return gear
+
+    def control(self, state, control):
+        '''Write this tick's controls for the car state into control'''
+        control.setSteer(float(np.clip(self.steer(state), -1, 1)))
+
+        speed = state.speedX
+        target = self.target_speed(state)
+        if abs(state.trackPos) > 1.0:
+            # Off the track: creep back on
+            target = min(target, SPEED_AT_WALL)
+        control.setAccel(float(np.clip((target - speed) / 10.0, 0, 1)))
+        control.setBrake(float(np.clip((speed - target - 10.0) / 30.0, 0, 1)))
+        control.setClutch(0)
+        control.setGear(self.gear(state))
+
+
+def load(directory=CONTROLLER_DIR, artefacts=STEER_ARTEFACTS):
+    '''The fallback controller with the steer model in directory'''
+    import autoDriver
+    scaler_file, model_file = artefacts
+    scaler = joblib.load(os.path.join(directory, scaler_file))
+    model = autoDriver.load_model(os.path.join(directory, model_file))
+    featureCompiler.check_feature_order(scaler, model)
+    return FallbackController(scaler, model)
@@ -0,0 +1,113 @@
+import operator
+import numpy as np
+import msgParser
+
+# Value used for a feature whose sensor is missing from the message
+DEFAULTS = {'focus': -1.0}
+
+
+def feature_names(obj):
+    '''
+    Return the feature order stored in a fitted scaler or model, or None.
+    sklearn estimators keep it in feature_names_in_, xgboost in its booster.
+    '''
+    names = getattr(obj, 'feature_names_in_', None)
+    if names is None and hasattr(obj, 'get_booster'):
+        names = obj.get_booster().feature_names
+    if names is None:
+        return None
+    return [str(n) for n in names]
+
+
+def check_feature_order(scaler, model):
+    '''
+    Return the feature order the scaler and model agree on.
+    Raises ValueError if their metadata disagrees on names or count.
+    '''
+    scaler_names = feature_names(scaler)
+    model_names = feature_names(model)
+    names = scaler_names if scaler_names is not None else model_names
+    if names is None:
+        raise ValueError('Neither the scaler nor the model records its feature names')
+
+    if scaler_names is not None and model_names is not None and scaler_names != model_names:
+        raise ValueError('Scaler and model disagree on the feature order')
+
+    for obj in (scaler, model):
+        n = getattr(obj, 'n_features_in_', None)
+        if n is not None and n != len(names):
+            raise ValueError(f'{type(obj).__name__} expects {n} features, metadata lists {len(names)}')
+    return names
+
+
+class FeatureCompiler(object):
+    '''
+    Fills a reused feature vector straight from a CarState, in the order a
+    model was trained on. The feature-name to sensor mapping is worked out
+    once, so a tick does no dict or list building of its own.
+
+    The buffer defaults to float64: the scalers were fitted in float64 and
+    rounding the raw sensors to float32 first flips tree splits.
+    '''
+    def __init__(self, names, schema=msgParser.SENSOR_SCHEMA, dtype=np.float64):
+        '''Constructor'''
+        self.names = list(names)
+        self.buffer = np.zeros(len(self.names), dtype=dtype)
+        sizes = {name: size for name, size, _ in schema}
+
+        scalars = {}
+        vectors = {}
+        for pos, feature in enumerate(self.names):
+            sensor, _, index = feature.rpartition('_')
+            if sensor in sizes and sizes[sensor] > 1 and index.isdigit() and int(index) < sizes[sensor]:
+                vectors.setdefault(sensor, []).append((int(index), pos))
+            elif sizes.get(feature) == 1:
+                scalars[feature] = pos
+            else:
+                raise ValueError(f'Feature {feature!r} does not match any sensor')
+
+        self.scalar_names = list(scalars)
+        self.scalar_pos = np.array(list(scalars.values()), dtype=np.intp)
+        self.scalar_defaults = [DEFAULTS.get(n, 0.0) for n in scalars]
+        self.get_scalars = operator.attrgetter(*self.scalar_names) if scalars else None
+
+        # For every vector sensor: where its values go and which ones are used
+        self.vectors = []
+        for sensor, pairs in vectors.items():
+            src = [i for i, _ in pairs]
+            dst = np.array([p for _, p in pairs], dtype=np.intp)
+            pick = operator.itemgetter(*src) if len(src) > 1 else (lambda v, i=src[0]: v[i])
+            if src == list(range(sizes[sensor])):
+                pick = None  # the whole sensor is used in its natural order
+            self.vectors.append((sensor, dst, pick, DEFAULTS.get(sensor, 0.0)))
+
+    @classmethod
+    def from_artifacts(cls, scaler, model, **kwargs):
+        '''Build a compiler for the feature order a scaler and model were trained on'''
+        return cls(check_feature_order(scaler, model), **kwargs)
+
+    def fill(self, state, out=None):
+        '''Write the features of state into out (default: the reused buffer) and return it'''
+        if out is None:
+            out = self.buffer
+
+        if self.get_scalars is not None:
+            values = self.get_scalars(state)
+            if len(self.scalar_names) == 1:
+                values = (values,)
+            if None in values:
+                # Some sensor is missing from this message: fall back to its default
+                for pos, value, default in zip(self.scalar_pos, values, self.scalar_defaults):
+                    out[pos] = default if value is None else value
+            else:
+                out[self.scalar_pos] = values
+
+        for sensor, dst, pick, default in self.vectors:
+            values = getattr(state, sensor)
+            if values is None:
+                out[dst] = default
+            elif pick is None:
+                out[dst] = values
+            else:
+                out[dst] = pick(values)
+        return out
@@ -0,0 +1,133 @@
+import numpy as np
+import treeModel
+import lstmModel
+
+
+class ScaledModel(object):
+    '''
+    Scaler followed by any model with a predict method. The StandardScaler
+    arithmetic is done with precomputed arrays into a reused buffer, which
+    skips sklearn's input validation and copies on every call.
+    '''
+    # Predictions depend only on the current row
+    stateful = False
+
+    def __init__(self, scaler, model):
+        '''Constructor'''
+        self.model = model
+        self.n_features_in_ = scaler.n_features_in_
+        mean = getattr(scaler, 'mean_', None)
+        scale = getattr(scaler, 'scale_', None)
+        self.mean = None if mean is None or not scaler.with_mean else np.asarray(mean, dtype=np.float64)
+        self.scale = None if scale is None or not scaler.with_std else np.asarray(scale, dtype=np.float64)
+        self.buffer = np.zeros((1, self.n_features_in_))
+
+    def transform(self, X, out):
+        '''StandardScaler.transform written into out'''
+        if self.mean is not None:
+            np.subtract(X, self.mean, out=out)
+        else:
+            out[...] = X
+        if self.scale is not None:
+            np.divide(out, self.scale, out=out)
+        return out
+
+    def predict(self, X):
+        X = np.asarray(X, dtype=np.float64)
+        return self.model.predict(self.transform(X, np.empty_like(X)))
+
+    def predict_row(self, x):
+        '''Prediction for one unscaled feature vector'''
+        return self.model.predict(self.transform(x, self.buffer))[0]
+
+    def observe(self, x):
+        '''A tick whose prediction is not needed: nothing to remember'''
+        pass
+
+    def reset(self):
+        pass
+
+
+class FoldedForest(object):
+    '''
+    Tree ensemble with the scaler folded into its split thresholds: one call
+    on raw features, no scaling pass at all.
+    '''
+    stateful = False
+
+    def __init__(self, scaler, forest):
+        '''Constructor'''
+        self.forest = forest.fold_scaler(scaler)
+        self.n_features_in_ = self.forest.n_features_in_
+
+    def predict(self, X):
+        return self.forest.predict(X)
+
+    def predict_row(self, x):
+        '''Prediction for one unscaled feature vector'''
+        return self.forest.predict(x)[0]
+
+    def observe(self, x):
+        pass
+
+    def reset(self):
+        pass
+
+
+class SequenceModel(ScaledModel):
+    '''
+    Scaler followed by an LSTM over the last timesteps ticks. Each tick's
+    scaled features go into the LSTMStepper's ring buffer, so the pipeline
+    holds per-car history: every driver needs its own fork().
+    '''
+    stateful = True
+
+    def __init__(self, scaler, network, incremental=False):
+        '''Constructor'''
+        super().__init__(scaler, network)
+        self.scaler = scaler
+        self.incremental = incremental
+        self.stepper = lstmModel.LSTMStepper(network, incremental)
+
+    def fork(self):
+        '''A pipeline sharing the weights, with empty history'''
+        return SequenceModel(self.scaler, self.model, self.incremental)
+
+    def predict_row(self, x):
+        '''Prediction for this tick's unscaled feature vector, given the previous ticks'''
+        self.stepper.push(self.transform(x, self.buffer)[0])
+        return self.stepper.predict()
+
+    def observe(self, x):
+        '''
+        Keep a tick in the history without predicting, so a skipped tick
+        leaves no gap in the window. The incremental stepper also advances
+        its recurrent state, which is most of a prediction's cost.
+        '''
+        self.stepper.push(self.transform(x, self.buffer)[0])
+        if self.incremental:
+            self.stepper.advance()
+
+    def reset(self):
+        '''Forget the history, e.g. on a race restart'''
+        self.stepper.reset()
+
+
+def build(scaler, model):
+    '''
+    Return the fused equivalent of model.predict(scaler.transform(X)), built
+    once at load time. Tree models get the scaler folded into their
+    thresholds, LSTMs a per-tick SequenceModel; anything else gets the
+    validation-free ScaledModel.
+    '''
+    if isinstance(model, lstmModel.LSTMNetwork):
+        return SequenceModel(scaler, model)
+    forest = model
+    if not isinstance(forest, treeModel.CompiledForest):
+        try:
+            forest = treeModel.compile_model(model)
+        except ValueError:
+            forest = None
+    if forest is not None and type(scaler).__name__ == 'StandardScaler':
+        return FoldedForest(scaler, forest)
+    return ScaledModel(scaler, model)
@@ -0,0 +1,269 @@
+import argparse
+import io
+import json
+import os
+import zipfile
+import numpy as np
+
+ACTIVATIONS = {
+    'linear': lambda x: x,
+    'relu': lambda x: np.maximum(x, 0.0, out=x),
+    'tanh': lambda x: np.tanh(x, out=x),
+    'sigmoid': lambda x: np.divide(1.0, np.add(1.0, np.exp(np.negative(x, out=x), out=x), out=x), out=x),
+}
+
+
+def export_keras(path):
+    '''
+    Read the layer configuration and weights of a Keras 3 .keras archive of
+    LSTM and Dense layers (as trained in model.ipynb) into plain arrays.
+    Needs h5py, but not TensorFlow. Returns a dict that LSTMNetwork takes as-is.
+    '''
+    import h5py
+
+    with zipfile.ZipFile(path) as archive:
+        config = json.loads(archive.read('config.json'))
+        weights = io.BytesIO(archive.read('model.weights.h5'))
+
+    layers = []
+    arrays = {}
+    timesteps = n_features = None
+    seen = {}
+    with h5py.File(weights, 'r') as h5:
+        for layer in config['config']['layers']:
+            kind, cfg = layer['class_name'], layer['config']
+            name = cfg['name']
+            if kind == 'InputLayer':
+                if len(cfg['batch_shape']) != 3:
+                    raise ValueError(f"Input shape {cfg['batch_shape']} is not a (batch, timesteps, features) sequence")
+                _, timesteps, n_features = cfg['batch_shape']
+                continue
+            # Weights are stored under the class name, numbered in layer order
+            # (lstm, lstm_1, dense), not under the layer's own name
+            base = kind.lower()
+            seen[base] = seen.get(base, -1) + 1
+            path = f'layers/{base}' + (f'_{seen[base]}' if seen[base] else '')
+            if kind == 'LSTM':
+                if cfg.get('go_backwards') or cfg.get('stateful'):
+                    raise ValueError(f'{name}: only forward, stateless LSTMs are supported')
+                group = h5[f'{path}/cell/vars']
+                arrays[f'{name}.kernel'] = group['0'][()]
+                arrays[f'{name}.recurrent_kernel'] = group['1'][()]
+                arrays[f'{name}.bias'] = group['2'][()]
+                layers.append({'name': name, 'kind': 'lstm', 'units': cfg['units'], 'activation': cfg['activation'],
+                               'recurrent_activation': cfg['recurrent_activation'],
+                               'return_sequences': cfg['return_sequences']})
+            elif kind == 'Dense':
+                group = h5[f'{path}/vars']
+                arrays[f'{name}.kernel'] = group['0'][()]
+                arrays[f'{name}.bias'] = group['1'][()]
+                layers.append({'name': name, 'kind': 'dense', 'units': cfg['units'], 'activation': cfg['activation']})
+            else:
+                raise ValueError(f'Unsupported layer {kind} ({name})')
+
+    for layer in layers:
+        for key in ('activation', 'recurrent_activation'):
+            if key in layer and layer[key] not in ACTIVATIONS:
+                raise ValueError(f"{layer['name']}: unsupported activation {layer[key]!r}")
+    if not layers or layers[0]['kind'] != 'lstm':
+        raise ValueError('Expected a model starting with an LSTM layer')
+
+    arrays['layers'] = json.dumps(layers)
+    arrays['timesteps'] = timesteps
+    arrays['n_features'] = n_features
+    return arrays
+
+
+class LSTMNetwork(object):
+    '''
+    NumPy forward pass of a Keras LSTM stack followed by Dense layers.
+    Gates are in Keras order (input, forget, cell, output); every sequence
+    starts from zero state, as in training.
+    '''
+    def __init__(self, arrays):
+        '''Constructor'''
+        self.layers = json.loads(str(arrays['layers']))
+        self.timesteps = int(arrays['timesteps'])
+        self.n_features_in_ = int(arrays['n_features'])
+        # SHA-1 of the .keras archive the arrays were exported from ('' if unknown)
+        self.source_sha1 = str(arrays.get('source_sha1', ''))
+        self.weights = {k: np.asarray(v, dtype=np.float64) for k, v in arrays.items()
+                        if k not in ('layers', 'timesteps', 'n_features', 'source_sha1')}
+        for layer in self.layers:
+            layer['kernel'] = self.weights[layer['name'] + '.kernel']
+            layer['bias'] = self.weights[layer['name'] + '.bias']
+            if layer['kind'] == 'lstm':
+                layer['recurrent_kernel'] = self.weights[layer['name'] + '.recurrent_kernel']
+        self.n_targets = self.layers[-1]['units']
+        self.n_lstm = next((i for i, layer in enumerate(self.layers) if layer['kind'] != 'lstm'), len(self.layers))
+
+    def arrays(self):
+        layers = [{k: v for k, v in layer.items() if not isinstance(v, np.ndarray)} for layer in self.layers]
+        return {'layers': json.dumps(layers), 'timesteps': self.timesteps, 'n_features': self.n_features_in_,
+                'source_sha1': self.source_sha1, **self.weights}
+
+    def save(self, path):
+        np.savez(path, **self.arrays())
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls({k: data[k] for k in data.files})
+
+    @staticmethod
+    def recur(layer, projected, h, c):
+        '''
+        Run one LSTM layer over input projections (steps, 4 * units) from
+        state (h, c), updated in place. Returns the hidden state of every step.
+        '''
+        units = layer['units']
+        U = layer['recurrent_kernel']
+        act = ACTIVATIONS[layer['activation']]
+        gate = ACTIVATIONS[layer['recurrent_activation']]
+        out = np.empty((len(projected), units))
+        z = np.empty(4 * units)
+        for step, x in enumerate(projected):
+            np.dot(h, U, out=z)
+            z += x
+            gate(z[:2 * units])
+            gate(z[3 * units:])
+            act(z[2 * units:3 * units])
+            i, f, g, o = z[:units], z[units:2 * units], z[2 * units:3 * units], z[3 * units:]
+            c *= f
+            c += i * g
+            h[...] = c
+            act(h)
+            h *= o
+            out[step] = h
+        return out
+
+    def head(self, x, first=1):
+        '''Run the layers after the LSTMs (from index first) on a hidden state'''
+        for layer in self.layers[first:]:
+            x = ACTIVATIONS[layer['activation']](x @ layer['kernel'] + layer['bias'])
+        return x
+
+    def predict(self, X):
+        '''Predictions for scaled windows of shape (rows, timesteps, features)'''
+        X = np.asarray(X, dtype=np.float64)
+        if X.ndim == 2:
+            X = X[None]
+        out = np.empty((len(X), self.n_targets))
+        for row, window in enumerate(X):
+            sequence = window
+            for layer in self.layers[:self.n_lstm]:
+                units = layer['units']
+                sequence = self.recur(layer, sequence @ layer['kernel'] + layer['bias'],
+                                      np.zeros(units), np.zeros(units))
+            out[row] = self.head(sequence[-1], self.n_lstm)
+        return out
+
+
+class LSTMStepper(object):
+    '''
+    Per-tick LSTM inference over the last timesteps scaled feature vectors.
+
+    The first layer's input projection x @ W + b of each tick is computed
+    once, when the tick arrives, and kept in a preallocated ring buffer; the
+    window is then replayed from zero state as in training, which only
+    costs the recurrent products. Before the ring is full it is padded with
+    the first frame of the episode.
+
+    With incremental=True the recurrent state is instead carried over and
+    advanced one step per tick (one step of every layer instead of
+    timesteps): much cheaper, but the model then sees its whole history
+    rather than the 10-tick window it was trained on, so outputs differ.
+    '''
+    def __init__(self, network, incremental=False):
+        '''Constructor'''
+        self.network = network
+        self.incremental = incremental
+        self.lstms = network.layers[:network.n_lstm]
+        self.first = self.lstms[0]
+        self.n_head = network.n_lstm
+        self.timesteps = network.timesteps
+        self.ring = np.zeros((self.timesteps, 4 * self.first['units']))
+        self.order = np.empty(self.timesteps, dtype=np.intp)
+        self.reset()
+
+    def reset(self):
+        '''Forget the history, e.g. on a race restart'''
+        self.pos = 0
+        self.count = 0
+        self.states = [(np.zeros(layer['units']), np.zeros(layer['units'])) for layer in self.lstms]
+
+    def push(self, x):
+        '''Add one scaled feature vector as the newest step'''
+        slot = self.ring[self.pos]
+        np.dot(x, self.first['kernel'], out=slot)
+        slot += self.first['bias']
+        if self.count == 0:
+            self.ring[:] = slot
+        self.pos = (self.pos + 1) % self.timesteps
+        self.count += 1
+
+    def advance(self):
+        '''
+        Incremental mode: step the carried recurrent state over the newest
+        tick, without the dense head. Returns the last layer's hidden state.
+        '''
+        sequence = self.ring[self.pos - 1:self.pos] if self.pos else self.ring[-1:]
+        for index, layer in enumerate(self.lstms):
+            if index:
+                sequence = sequence @ layer['kernel'] + layer['bias']
+            h, c = self.states[index]
+            sequence = self.network.recur(layer, sequence, h, c)
+        return sequence[-1]
+
+    def predict(self):
+        '''Prediction for the current window'''
+        if self.incremental:
+            return self.network.head(self.advance(), self.n_head)
+
+        # Oldest step first: the slot after the newest one
+        np.mod(np.arange(self.pos, self.pos + self.timesteps), self.timesteps, out=self.order)
+        sequence = self.ring.take(self.order, axis=0)
+        for index, layer in enumerate(self.lstms):
+            if index:
+                sequence = sequence @ layer['kernel'] + layer['bias']
+            units = layer['units']
+            sequence = self.network.recur(layer, sequence, np.zeros(units), np.zeros(units))
+        return self.network.head(sequence[-1], self.n_head)
+
+
+def compiled_path(keras_path):
+    '''Where the exported arrays of a .keras model are stored'''
+    return os.path.splitext(keras_path)[0] + '.npz'
+
+
+def load(path):
+    '''
+    Load an LSTMNetwork from its exported .npz, or export it from the .keras
+    archive when there is none or it was exported from another version of it
+    '''
+    import treeModel
+    compiled = compiled_path(path)
+    if os.path.exists(compiled):
+        network = LSTMNetwork.load(compiled)
+        if not os.path.exists(path) or network.source_sha1 == treeModel.file_sha1(path):
+            return network
+    return LSTMNetwork(export_keras(path))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export Keras LSTM controllers to .npz arrays for NumPy inference.')
+    parser.add_argument('models', nargs='+', help='Paths of .keras models')
+    args = parser.parse_args()
+
+    import treeModel
+    for path in args.models:
+        network = LSTMNetwork(export_keras(path))
+        network.source_sha1 = treeModel.file_sha1(path)
+        out = compiled_path(path)
+        network.save(out)
+        shape = ' -> '.join(f"{layer['kind']}({layer['units']})" for layer in network.layers)
+        print(f'{path} -> {out}: input ({network.timesteps}, {network.n_features_in_}), {shape}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+import concurrent.futures
+import os
+import numpy as np
+import featureCompiler
+import inferencePipeline
+
+# Outputs of the full controller, in the order of its prediction vector
+TARGETS = ('accel', 'brake', 'clutch', 'gear', 'steer')
+
+# Outputs of each controller kind (see controllerRegistry.ARTEFACT)
+KIND_CHANNELS = {'controller': TARGETS, 'steer_controller': ('steer',)}
+
+
+class Member(object):
+    '''
+    A model run next to the driver's own pipeline: its own feature order,
+    its fused pipeline and the output channels it provides.
+    '''
+    def __init__(self, name, scaler, model, channels, pipeline=None):
+        '''Constructor'''
+        if pipeline is None:
+            pipeline = inferencePipeline.build(scaler, model)
+        if pipeline.stateful:
+            raise ValueError('A sequence model keeps per-car history: use it as the driver\'s own model')
+        self.name = name
+        self.features = featureCompiler.FeatureCompiler.from_artifacts(scaler, model)
+        self.pipeline = pipeline
+        self.channels = np.array([TARGETS.index(c) for c in channels], dtype=np.intp)
+
+    def predict(self, x):
+        return self.pipeline.predict_row(x)
+
+
+class ModelPool(object):
+    '''
+    Runs extra models next to the driver's pipeline on every tick and merges
+    their outputs per channel: a channel comes from the last member that
+    provides it, so specialised models override the full controller on
+    their outputs.
+
+    The members run on a small persistent thread pool while the calling
+    thread runs the driver's pipeline, so a tick costs the slowest model
+    rather than the sum wherever the models release the GIL (xgboost does,
+    NumPy only for its larger array operations). With workers=0, e.g. on a
+    single CPU where threads can only add hand-off latency, the models run
+    one after another on the calling thread.
+    '''
+    def __init__(self, members, workers=None):
+        '''Constructor'''
+        if workers is None:
+            workers = min(len(members), (os.cpu_count() or 1) - 1)
+        self.members = list(members)
+        self.workers = workers
+        self.executor = None
+        if workers > 0:
+            self.executor = concurrent.futures.ThreadPoolExecutor(workers, thread_name_prefix='model')
+        self.out = np.zeros(len(TARGETS))
+
+    def predict(self, pipeline, x, state):
+        '''
+        pipeline's prediction for its feature vector x, with the members'
+        channels merged in. Their features are filled from state here, so
+        the worker threads only run the models.
+        '''
+        inputs = [member.features.fill(state) for member in self.members]
+        out = self.out
+        if self.executor is None:
+            out[:] = pipeline.predict_row(x)
+            for member, xi in zip(self.members, inputs):
+                out[member.channels] = member.predict(xi)
+            return out
+
+        futures = [self.executor.submit(member.predict, xi) for member, xi in zip(self.members, inputs)]
+        out[:] = pipeline.predict_row(x)
+        for member, future in zip(self.members, futures):
+            out[member.channels] = future.result()
+        return out
+
+    def describe(self):
+        threads = f"{self.workers} thread{'s' if self.workers > 1 else ''}" if self.workers else 'inline'
+        return ', '.join(member.name for member in self.members) + f' ({threads})'
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+
+
+def load_member(registry, kind='steer_controller', track=None, car=None, mode='xgb'):
+    '''The registry's best controller of a kind for the track and car, as a member'''
+    entry, scaler, model, pipeline = registry.load(track, car, mode, kind)
+    return Member(entry.describe(), scaler, model, KIND_CHANNELS[kind], pipeline)
@@ -41,4 +41,82 @@ class MsgParser(object):
                     msg += ' ' + str(val)
                 msg += ')'
         
-        return msg
\ No newline at end of file
+        return msg
+
+# Sensor groups of a TORCS SCRC message, in the order the server sends them:
+# (tag, number of values, type of each value)
+SENSOR_SCHEMA = (
+    ('angle', 1, float),
+    ('curLapTime', 1, float),
+    ('damage', 1, float),
+    ('distFromStart', 1, float),
+    ('distRaced', 1, float),
+    ('focus', 5, float),
+    ('fuel', 1, float),
+    ('gear', 1, int),
+    ('lastLapTime', 1, float),
+    ('opponents', 36, float),
+    ('racePos', 1, int),
+    ('rpm', 1, float),
+    ('speedX', 1, float),
+    ('speedY', 1, float),
+    ('speedZ', 1, float),
+    ('track', 19, float),
+    ('trackPos', 1, float),
+    ('wheelSpinVel', 4, float),
+    ('z', 1, float),
+)
+
+
+class SensorParser(MsgParser):
+    '''
+    A schema-aware parser for sensor messages. Turns one UDP message into
+    typed values (float, int or list of floats) in a single pass.
+    '''
+    def __init__(self, schema=SENSOR_SCHEMA):
+        '''Constructor'''
+        self.schema = schema
+        self.scalars = {}
+        self.vectors = set()
+        for name, size, kind in schema:
+            if size == 1:
+                self.scalars[name] = kind
+            else:
+                self.vectors.add(name)
+
+    def split(self, str_sensors):
+        '''Return a list of (tag, raw value string) pairs from the UDP message'''
+        b_open = str_sensors.find('(')
+        b_close = str_sensors.rfind(')')
+        if b_open < 0 or b_close < b_open:
+            print("Problem parsing sensor string: ", str_sensors)
+            return None
+
+        groups = []
+        for group in str_sensors[b_open + 1: b_close].split(')('):
+            name, _, values = group.partition(' ')
+            if not values:
+                print("Problem parsing substring: ", group)
+            else:
+                groups.append((name, values))
+        return groups
+
+    def parse(self, str_sensors):
+        '''Return a dictionary with tags and typed values from the UDP message'''
+        groups = self.split(str_sensors)
+        if groups is None:
+            return None
+
+        scalars = self.scalars
+        vectors = self.vectors
+        sensors = {}
+        for name, values in groups:
+            kind = scalars.get(name)
+            if kind is not None:
+                sensors[name] = kind(values)
+            elif name in vectors:
+                sensors[name] = list(map(float, values.split()))
+            else:
+                # Unknown tag: keep the raw strings like MsgParser.parse does
+                sensors[name] = values.split()
+        return sensors
@@ -0,0 +1,165 @@
+import argparse
+import collections
+import time
+import numpy as np
+
+# Grid step in standard deviations of each feature
+DEFAULT_STEP = 0.05
+DEFAULT_SIZE = 4096
+
+
+def grid_steps(names, step=DEFAULT_STEP, overrides=None):
+    '''Per-feature grid steps: step everywhere, except the features named in overrides'''
+    steps = np.full(len(names), float(step))
+    for name, value in (overrides or {}).items():
+        steps[list(names).index(name)] = float(value)
+    return steps
+
+
+class CachedPipeline(object):
+    '''
+    Memoizes an inference pipeline's predict_row on a quantized feature
+    vector. The key is floor(scaled feature / step) per feature, so every
+    vector in the same grid cell gets the prediction of the first one seen
+    there. At most size cells are kept, least recently used first out.
+
+    Only stateless pipelines can be cached: a sequence model's output
+    depends on more than the current vector.
+    '''
+    stateful = False
+
+    def __init__(self, pipeline, scaler, steps, size=DEFAULT_SIZE):
+        '''Constructor'''
+        if pipeline.stateful:
+            raise ValueError('Predictions of a sequence model cannot be cached per feature vector')
+        self.pipeline = pipeline
+        self.n_features_in_ = pipeline.n_features_in_
+        self.size = size
+        n = self.n_features_in_
+        mean = getattr(scaler, 'mean_', None)
+        scale = getattr(scaler, 'scale_', None)
+        self.mean = np.zeros(n) if mean is None else np.asarray(mean, dtype=np.float64)
+        scale = np.ones(n) if scale is None else np.asarray(scale, dtype=np.float64)
+        # One multiply maps a raw feature to its grid cell
+        self.inverse_step = 1.0 / (scale * np.broadcast_to(np.asarray(steps, dtype=np.float64), (n,)))
+        self.buffer = np.zeros(n)
+        self.cells = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, x):
+        buffer = self.buffer
+        np.subtract(x, self.mean, out=buffer)
+        buffer *= self.inverse_step
+        np.floor(buffer, out=buffer)
+        return buffer.tobytes()
+
+    def predict_row(self, x):
+        '''Cached prediction for one unscaled feature vector'''
+        key = self.key(x)
+        cells = self.cells
+        prediction = cells.get(key)
+        if prediction is not None:
+            cells.move_to_end(key)
+            self.hits += 1
+            return prediction
+        self.misses += 1
+        prediction = self.pipeline.predict_row(x)
+        cells[key] = prediction
+        if len(cells) > self.size:
+            cells.popitem(last=False)
+        return prediction
+
+    def predict(self, X):
+        '''Batches go straight to the pipeline'''
+        return self.pipeline.predict(X)
+
+    def observe(self, x):
+        pass
+
+    def reset(self):
+        self.pipeline.reset()
+
+    def clear(self):
+        self.cells.clear()
+        self.hits = self.misses = 0
+
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def summary(self):
+        return (f'cache hits: {self.hits}  misses: {self.misses}  hit rate: {self.hit_rate() * 100:.1f}%  '
+                f'cells: {len(self.cells)}/{self.size}')
+
+
+TARGETS = ('accel', 'brake', 'clutch', 'gear', 'steer')
+
+
+def report(csv_path, steps, size=DEFAULT_SIZE, overrides=None, limit=None):
+    '''
+    Replay a telemetry CSV through the default controller with and without
+    the cache for every grid step. Returns one dict per step with the hit
+    rate, the error against the uncached predictions and the time per tick.
+    '''
+    import autoDriver
+    import telemetry
+
+    driver = autoDriver.autoDriver(3)
+    features = []
+    for msg in telemetry.load_messages(csv_path, limit):
+        x = driver.prepare(msg)
+        if x is not None:
+            features.append(x.copy())
+    pipeline = driver.pipeline
+
+    t = time.perf_counter()
+    exact = np.array([pipeline.predict_row(x) for x in features])
+    exact_us = (time.perf_counter() - t) / len(features) * 1e6
+
+    results = []
+    for step in steps:
+        cache = CachedPipeline(pipeline, driver.scaler, grid_steps(driver.input_features, step, overrides), size)
+        t = time.perf_counter()
+        cached = np.array([cache.predict_row(x) for x in features])
+        cached_us = (time.perf_counter() - t) / len(features) * 1e6
+        error = np.abs(cached - exact)
+        results.append({
+            'step': step,
+            'hit_rate': cache.hit_rate(),
+            'mae': dict(zip(TARGETS, error.mean(axis=0))),
+            'max_error': dict(zip(TARGETS, error.max(axis=0))),
+            'gear_changes': int(np.sum(np.round(cached[:, 3]) != np.round(exact[:, 3]))),
+            'us_per_tick': cached_us,
+            'uncached_us_per_tick': exact_us,
+        })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Report the hit rate and accuracy cost of the prediction cache on telemetry CSVs.')
+    parser.add_argument('csv', nargs='+', help='Telemetry CSV files to replay')
+    parser.add_argument('--step', action='store', dest='steps', type=float, nargs='+',
+                        default=[0.01, 0.02, 0.05, 0.1, 0.2], help='Grid steps to try, in standard deviations')
+    parser.add_argument('--grid', action='store', dest='grid', nargs='*', default=[],
+                        help='Per-feature steps as name=step, e.g. distRaced=1.0')
+    parser.add_argument('--size', action='store', dest='size', type=int, default=DEFAULT_SIZE,
+                        help=f'Cache cells (default: {DEFAULT_SIZE})')
+    parser.add_argument('--limit', action='store', dest='limit', type=int, default=None,
+                        help='Rows per CSV to replay (default: all)')
+    args = parser.parse_args()
+    overrides = dict(item.split('=', 1) for item in args.grid)
+
+    for path in args.csv:
+        print(path)
+        print(f"{'step':>6s} {'hit %':>6s} {'us/tick':>8s} {'accel':>8s} {'brake':>8s} {'steer':>8s} "
+              f"{'steer max':>9s} {'gear diff':>9s}")
+        for r in report(path, args.steps, args.size, overrides, args.limit):
+            print(f"{r['step']:6.3f} {r['hit_rate'] * 100:6.1f} {r['us_per_tick']:8.1f} {r['mae']['accel']:8.4f} "
+                  f"{r['mae']['brake']:8.4f} {r['mae']['steer']:8.4f} {r['max_error']['steer']:9.4f} "
+                  f"{r['gear_changes']:9d}")
+        print(f"uncached: {r['uncached_us_per_tick']:.1f} us/tick")
+
+
+if __name__ == '__main__':
+    main()
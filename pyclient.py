@@ -1,10 +1,13 @@
 import sys
+import time
 import argparse
 import socket
-import autoDriver
-import csv
-import os
-import re
+import driverLoader
+import tickProfiler
+import driveLog
+
+# Time-to-first-control is measured from here
+started = time.perf_counter()
 
 if __name__ == '__main__':
     pass
@@ -23,26 +26,36 @@ parser.add_argument('--maxEpisodes', action='store', dest='max_episodes', type=i
 parser.add_argument('--maxSteps', action='store', dest='max_steps', type=int, default=0,
                     help='Maximum number of steps (default: 0)')
 parser.add_argument('--track', action='store', dest='track', default=None,
-                    help='Name of the track')
+                    help='Name of the track, to pick its controller (default: any)')
+parser.add_argument('--car', action='store', dest='car', default=None,
+                    help='Name of the car, to pick its controller (default: any)')
 parser.add_argument('--stage', action='store', dest='stage', type=int, default=3,
                     help='Stage (0 - Warm-Up, 1 - Qualifying, 2 - Race, 3 - Unknown)')
+parser.add_argument('--mode', action='store', dest='mode', default='xgb', choices=sorted(driverLoader.MODES),
+                    help='Controller to drive with: xgb or lstm (default: xgb)')
+parser.add_argument('--reload', action='store', dest='reload', type=float, default=0.0,
+                    help='Seconds between checks for a retrained controller to hot-swap, 0 to disable (default: 0)')
+parser.add_argument('--cache', action='store', dest='cache', type=float, default=0.0,
+                    help='Reuse predictions for feature vectors within this many standard deviations, 0 to disable (default: 0)')
+parser.add_argument('--budget', action='store', dest='budget', type=float, default=0.0,
+                    help='Milliseconds per tick for the model; ticks it would overrun are answered by the '
+                         'steer model and throttle/gear rules, 0 to disable (default: 0)')
+parser.add_argument('--steerModel', action='store_true', dest='steer_model',
+                    help='Take steer from the dedicated steer controller, run next to the main one')
+parser.add_argument('--modelThreads', action='store', dest='model_threads', type=int, default=None,
+                    help='Threads running the extra models, 0 to run them inline (default: CPUs - 1)')
+parser.add_argument('--profile', action='store', dest='profile', default=None,
+                    help='Write per-stage tick latencies to this .json or .csv file on shutdown')
+parser.add_argument('--record', action='store', dest='record', default=None,
+                    help='Append every tick\'s sensors and controls to this binary recording')
+driveLog.add_arguments(parser)
 
 arguments = parser.parse_args()
 
-# Take track name and car name as input when the game starts
-# track_name = input("Enter track name: ").strip()
-# car_name = input("Enter car name: ").strip()
-
-# # Create the CSV filename based on the track and car name
-# csv_filename = f"{track_name}_{car_name}.csv"
-
-# # Ensure headers are consistent
-# csv_headers = None
-
-# if not os.path.exists(csv_filename):
-#     # If the file doesn't exist, create it and write the headers
-#     with open(csv_filename, mode="w", newline="") as f:
-#         csv_headers = None  # Reset headers to ensure they are written later
+# Log records are written from a background thread; per-tick ones are sampled
+driveLog.configure(arguments.log_level, every=arguments.log_every)
+log = driveLog.get_logger('client')
+sent = driveLog.Sampled(log)
 
 # Print summary
 print('Connecting to server host ip:', arguments.host_ip, '@ port:', arguments.host_port)
@@ -50,13 +63,16 @@ print('Bot ID:', arguments.id)
 print('Maximum episodes:', arguments.max_episodes)
 print('Maximum steps:', arguments.max_steps)
 print('Track:', arguments.track)
+print('Car:', arguments.car)
 print('Stage:', arguments.stage)
+print('Mode:', arguments.mode)
+print('Recording:', arguments.record)
 print('*********************************************')
 
 try:
     sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
 except socket.error:
-    print('Could not make a socket.')
+    log.error('Could not make a socket.')
     sys.exit(-1)
 
 sock.settimeout(1.0)  # one second timeout
@@ -64,49 +80,88 @@ sock.settimeout(1.0)  # one second timeout
 shutdownClient = False
 curEpisode = 0
 
-verbose = True
-
-# Initialize the autoDriver instead of manual driver
-d = autoDriver.autoDriver(arguments.stage)
-
-# Function to extract values from data string
-def extract_data(data_string):
-    """Parses a data string in the format '(key value)(key value)' into a dictionary."""
-    pattern = r'\((\w+) ([^()]+)\)'
-    return dict(re.findall(pattern, data_string))
-
-# Function to update CSV headers dynamically
-def update_csv_headers(new_data, csv_headers, csv_filename):
-    """Update CSV headers if new keys are found in the data."""
-    new_keys = set(new_data.keys()) - set(csv_headers)
-    if new_keys:
-        csv_headers.extend(new_keys)  # Add new keys to the headers
-        # Rewrite the CSV file with updated headers
-        with open(csv_filename, mode="w", newline="") as f:
-            writer = csv.DictWriter(f, fieldnames=csv_headers)
-            writer.writeheader()
-            print(f"CSV headers updated: {csv_headers}")
-    return csv_headers
+# Load and warm up the autoDriver in the background while identifying with the server
+loader = driverLoader.DriverLoader(arguments.stage, arguments.mode, arguments.track, arguments.car)
+d = None
+reloader = None
+first_control = None
+
+# Per-stage latency histograms, reported per episode
+profiler = tickProfiler.StageProfiler() if arguments.profile else tickProfiler.NULL
+
+# Training data recorder, written from a background thread
+recorder = None
+if arguments.record:
+    import telemetryRecorder
+    recorder = telemetryRecorder.TelemetryRecorder(arguments.record)
 
 while not shutdownClient:
     while True:
-        buf = arguments.id + d.init()
+        buf = arguments.id + driverLoader.init_message()
         
         try:
             sock.sendto(buf.encode(), (arguments.host_ip, arguments.host_port))
         except socket.error:
-            print("Failed to send data...Exiting...")
+            log.error('Failed to send data...Exiting...')
             sys.exit(-1)       
         try:
             buf, addr = sock.recvfrom(1000)
             buf = buf.decode()
         except socket.error:
-            print("didn't get response from server...")
+            log.warning("didn't get response from server...")
     
         if buf.find('***identified***') >= 0:
-            # print('Received response: ', buf)
+            log.info('Received response: %s', buf)
             break
 
+    if d is None:
+        # Frames that arrive before the background load is done are answered
+        # with idle controls, so the server never waits on the client
+        stopped = False
+        while not loader.done():
+            try:
+                buf, addr = sock.recvfrom(1000)
+                buf = buf.decode()
+            except socket.error:
+                continue
+
+            # Shutdown or restart before the driver is ready: the episode is over
+            if '***shutdown***' in buf:
+                shutdownClient = True
+                log.info('Client Shutdown')
+                stopped = True
+                break
+            if '***restart***' in buf:
+                log.info('Client Restart')
+                stopped = True
+                break
+
+            if buf.startswith('('):
+                sock.sendto(driverLoader.IDLE_CONTROL.encode(), (arguments.host_ip, arguments.host_port))
+        if stopped:
+            curEpisode += 1
+            if curEpisode == arguments.max_episodes:
+                shutdownClient = True
+            continue
+        d = loader.result()
+        d.profiler = profiler
+        print(f'Driver loaded and warmed up in {loader.load_time() * 1000:.1f} ms, '
+              f'ready after {(time.perf_counter() - started) * 1000:.1f} ms')
+        print('Controller:', loader.entry.describe())
+        if arguments.cache > 0:
+            d.enable_cache(arguments.cache)
+        if arguments.steer_model:
+            import modelEnsemble
+            member = modelEnsemble.load_member(loader.registry, 'steer_controller', arguments.track, arguments.car)
+            d.add_models([member], arguments.model_threads)
+            print('Extra models:', d.ensemble.describe())
+        if arguments.budget > 0:
+            d.enable_budget(arguments.budget)
+        if arguments.reload > 0:
+            # Hot-swaps retrained artefacts in between ticks
+            import controllerRegistry
+            reloader = controllerRegistry.Reloader(loader.registry, d, loader.entry, arguments.reload)
+
     currentStep = 0
     
     while True:
@@ -115,97 +170,48 @@ while not shutdownClient:
             buf, addr = sock.recvfrom(1000)
             buf = buf.decode()
         except socket.error:
-            print("didn't get response from server...")
-
-        # if verbose and buf:
-        #     print('Received: ', buf)
+            log.warning("didn't get response from server...")
+        tick_start = profiler.clock()
 
         # Handle shutdown or restart
         if buf and '***shutdown***' in buf:
+            profiler.end_episode()
             d.onShutDown()
             shutdownClient = True
-            print('Client Shutdown')
+            log.info('Client Shutdown')
             break
 
         if buf and '***restart***' in buf:
+            profiler.end_episode()
             d.onRestart()
-            print('Client Restart')
+            log.info('Client Restart')
             break
 
         # Process Received Data
-        received_data = extract_data(buf) if buf else {}
-        # print(buf)
+        sensors = buf
         currentStep += 1
         if currentStep != arguments.max_steps:
             if buf:
                 buf = d.drive(buf)
+                # Queue the tick for the background recorder, which never blocks
+                if recorder is not None:
+                    c = d.control
+                    recorder.record(sensors, (c.accel, c.brake, c.gear, c.steer, c.clutch, c.focus, c.meta))
         else:
             buf = '(meta 1)'
 
-        # Process Sending Data
-        sending_data = extract_data(buf) if buf else {}
-        
-        # Only log data if car is connected and moving
-        if received_data and sending_data:
-            try:
-                # Check if car is connected and moving
-                speed_str = received_data.get('speedX', ['0'])[0]
-                rpm_str = received_data.get('rpm', ['0'])[0]
-                
-                # Handle invalid values
-                speed = 0.0
-                rpm = 0.0
-                
-                if speed_str != '-':
-                    speed = float(speed_str)
-                if rpm_str != '-':
-                    rpm = float(rpm_str)
-                
-                # Only log if car is moving (speed > 0.1) or engine is running (rpm > 100)
-                # if abs(speed) > 0.1 or rpm > 100:
-                    # Expand multi-value fields into separate columns
-                    # def expand_multi_values(data, key_prefix):
-                    #     """Expand multi-value fields into separate columns."""
-                    #     expanded = {}
-                    #     if key_prefix in data:
-                    #         values = data[key_prefix].split()
-                    #         for i, value in enumerate(values):
-                    #             expanded[f"{key_prefix}_{i}"] = value
-                    #         del data[key_prefix]  # Remove the original multi-value field
-                    #     return expanded
-
-                    # # Expand multi-value fields
-                    # received_data.update(expand_multi_values(received_data, "opponents"))
-                    # received_data.update(expand_multi_values(received_data, "track"))
-                    # received_data.update(expand_multi_values(received_data, "focus"))
-                    # received_data.update(expand_multi_values(received_data, "wheelSpinVel"))
-
-                    # # Merge received and sending data
-                    # combined_data = {**received_data, **sending_data}
-
-                    # # Update CSV headers dynamically
-                    # if csv_headers is None:
-                    #     csv_headers = sorted(combined_data.keys())  # Initialize headers
-                    #     with open(csv_filename, mode="w", newline="") as f:
-                    #         writer = csv.DictWriter(f, fieldnames=csv_headers)
-                    #         writer.writeheader()
-                    # else:
-                    #     csv_headers = update_csv_headers(combined_data, csv_headers, csv_filename)
-
-                    # # Append data row
-                    # with open(csv_filename, mode="a", newline="") as f:
-                    #     writer = csv.DictWriter(f, fieldnames=csv_headers)
-                    #     writer.writerow(combined_data)
-
-            except (ValueError, IndexError) as e:
-                print(f"Error processing data: {e}")
-
         if buf:
             try:
-                print(buf)
+                sent.debug('Sending: %s', buf)
+                t = profiler.clock()
                 sock.sendto(buf.encode(), (arguments.host_ip, arguments.host_port))
+                profiler.record('sock.sendto', t)
+                profiler.record('tick', tick_start)
+                if first_control is None and d.valid:
+                    first_control = time.perf_counter() - started
+                    print(f'Time to first valid control: {first_control * 1000:.1f} ms')
             except socket.error:
-                print("Failed to send data...Exiting...")
+                log.error('Failed to send data...Exiting...')
                 sys.exit(-1)
 
     curEpisode += 1
@@ -213,4 +219,16 @@ while not shutdownClient:
     if curEpisode == arguments.max_episodes:
         shutdownClient = True
 
+if d is not None and hasattr(d.pipeline, 'hit_rate'):
+    print(d.pipeline.summary())
+if d is not None and d.budget_ns is not None:
+    print('Control paths:', ', '.join(f'{path} {n}' for path, n in d.paths.most_common()))
+if reloader is not None:
+    reloader.stop()
+    print('Controller reloads:', reloader.swaps)
+if arguments.profile:
+    profiler.dump(arguments.profile)
+if recorder is not None:
+    recorder.close()
+    print('Recorded', recorder.rows, 'ticks to', arguments.record)
 sock.close()
@@ -0,0 +1,173 @@
+import argparse
+import json
+import time
+import numpy as np
+import msgParser
+import telemetry
+import tickProfiler
+
+# Controls compared against the recorded ones
+CHANNELS = ('accel', 'brake', 'clutch', 'gear', 'steer')
+
+
+def make_driver(kind='auto', mode='xgb', track=None, car=None, stage=3, budget=0.0, steer_model=False,
+                model_threads=None):
+    '''The driver to replay: autoDriver with the registry's controller, or the keyboard driver.Driver'''
+    if kind == 'manual':
+        # Imports pynput and listens to the keyboard, so only on request
+        import driver
+        return driver.Driver(stage)
+    import autoDriver
+    import controllerRegistry
+    import modelEnsemble
+    registry = controllerRegistry.Registry()
+    _, scaler, model, pipeline = registry.load(track, car, mode)
+    d = autoDriver.autoDriver(stage, scaler, model, pipeline, mode)
+    d.warm_up()
+    if steer_model:
+        d.add_models([modelEnsemble.load_member(registry, 'steer_controller', track, car)], model_threads)
+    if budget > 0:
+        d.enable_budget(budget)
+    return d
+
+
+def recorded_controls(csv_path, limit=None):
+    '''(rows, channels) array of the controls recorded with each sensor frame; NaN where missing'''
+    out = []
+    for row in telemetry.read_rows(csv_path, limit):
+        values = []
+        for name in CHANNELS:
+            try:
+                values.append(float(row.get(name)))
+            except (TypeError, ValueError):
+                values.append(np.nan)
+        out.append(values)
+    return np.array(out, dtype=np.float64).reshape(-1, len(CHANNELS))
+
+
+def parse_controls(replies):
+    '''(rows, channels) array of the controls in the driver's reply messages'''
+    parser = msgParser.MsgParser()
+    out = np.full((len(replies), len(CHANNELS)), np.nan)
+    for i, reply in enumerate(replies):
+        actions = parser.parse(reply) or {}
+        for j, name in enumerate(CHANNELS):
+            value = actions.get(name)
+            if value:
+                out[i, j] = float(value[0])
+    return out
+
+
+def replay(driver, messages, profiler=None):
+    '''
+    Feed every message through driver.drive() back to back.
+    Returns the reply messages, per-tick latencies in ns and the wall time.
+    '''
+    if profiler is not None:
+        driver.profiler = profiler
+    clock = time.perf_counter_ns
+    drive = driver.drive
+    replies = [None] * len(messages)
+    latencies = np.zeros(len(messages), dtype=np.int64)
+    started = clock()
+    for i, msg in enumerate(messages):
+        t = clock()
+        replies[i] = drive(msg)
+        latencies[i] = clock() - t
+    return replies, latencies, (clock() - started) / 1e9
+
+
+def agreement(produced, recorded):
+    '''How well the produced controls match the recorded ones, per channel'''
+    result = {}
+    for j, name in enumerate(CHANNELS):
+        a, b = produced[:, j], recorded[:, j]
+        ok = ~(np.isnan(a) | np.isnan(b))
+        if not ok.any():
+            continue
+        a, b = a[ok], b[ok]
+        stats = {'mae': float(np.mean(np.abs(a - b)))}
+        if name == 'gear':
+            stats['match'] = float(np.mean(np.round(a) == np.round(b)))
+        elif a.std() > 0 and b.std() > 0:
+            stats['corr'] = float(np.corrcoef(a, b)[0, 1])
+        result[name] = stats
+    return result
+
+
+def run(csv_path, driver, limit=None, profiler=None):
+    '''Replay one CSV and return its throughput, latency and control agreement'''
+    messages = telemetry.load_messages(csv_path, limit)
+    paths = getattr(driver, 'paths', None)
+    if paths is not None:
+        paths.clear()
+    replies, latencies, wall = replay(driver, messages, profiler)
+    if hasattr(driver, 'onRestart'):
+        driver.onRestart()
+    p50, p90, p99, p999 = np.percentile(latencies, [50, 90, 99, 99.9]) / 1000.0
+    return {
+        'csv': csv_path,
+        'ticks': len(messages),
+        'ticks_per_s': len(messages) / wall if wall else 0.0,
+        'latency_us': {'mean': float(latencies.mean() / 1000.0), 'p50': float(p50), 'p90': float(p90),
+                       'p99': float(p99), 'p99.9': float(p999), 'max': float(latencies.max() / 1000.0)},
+        'over_budget': int(np.sum(latencies > tickProfiler.TICK_BUDGET_NS)),
+        'controls': agreement(parse_controls(replies), recorded_controls(csv_path, limit)),
+        'paths': dict(paths) if paths else {},
+    }
+
+
+def print_result(r):
+    lat = r['latency_us']
+    print(f"{r['csv']}: {r['ticks']} ticks, {r['ticks_per_s']:.0f} ticks/s, over 20 ms: {r['over_budget']}")
+    print(f"  latency us  mean {lat['mean']:.1f}  p50 {lat['p50']:.1f}  p90 {lat['p90']:.1f}  "
+          f"p99 {lat['p99']:.1f}  p99.9 {lat['p99.9']:.1f}  max {lat['max']:.1f}")
+    if r['paths']:
+        print('  paths  ' + '  '.join(f'{path} {n}' for path, n in sorted(r['paths'].items())))
+    for name, s in r['controls'].items():
+        extra = f"  match {s['match'] * 100:.1f}%" if 'match' in s else (f"  corr {s['corr']:.3f}" if 'corr' in s else '')
+        print(f"  {name:6s} MAE {s['mae']:.4f}{extra}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay recorded telemetry through a driver as fast as possible.')
+    parser.add_argument('csv', nargs='*', default=['new_new.csv'], help='Telemetry CSVs (default: new_new.csv)')
+    parser.add_argument('--driver', action='store', dest='driver', default='auto', choices=('auto', 'manual'),
+                        help='autoDriver or the keyboard driver.Driver (default: auto)')
+    parser.add_argument('--mode', action='store', dest='mode', default='xgb', choices=('xgb', 'lstm'),
+                        help='autoDriver controller (default: xgb)')
+    parser.add_argument('--track', action='store', dest='track', default=None, help='Track of the controller')
+    parser.add_argument('--car', action='store', dest='car', default=None, help='Car of the controller')
+    parser.add_argument('--limit', action='store', dest='limit', type=int, default=None,
+                        help='Rows per CSV to replay (default: all)')
+    parser.add_argument('--budget', action='store', dest='budget', type=float, default=0.0,
+                        help='Tick budget in ms of the autoDriver model, with the fallback controller '
+                             'answering ticks it would overrun (default: 0, off)')
+    parser.add_argument('--steerModel', action='store_true', dest='steer_model',
+                        help='Take steer from the dedicated steer controller, run next to the main one')
+    parser.add_argument('--modelThreads', action='store', dest='model_threads', type=int, default=None,
+                        help='Threads running the extra models, 0 to run them inline (default: CPUs - 1)')
+    parser.add_argument('--stages', action='store_true', dest='stages',
+                        help='Also print the per-stage latency table of autoDriver')
+    parser.add_argument('--json', action='store', dest='json', default=None,
+                        help='Write the results to this JSON file')
+    args = parser.parse_args()
+
+    driver = make_driver(args.driver, args.mode, args.track, args.car, budget=args.budget,
+                         steer_model=args.steer_model, model_threads=args.model_threads)
+    results = []
+    for path in args.csv:
+        profiler = tickProfiler.StageProfiler() if args.stages else None
+        result = run(path, driver, args.limit, profiler)
+        print_result(result)
+        if profiler is not None:
+            profiler.end_episode()
+        results.append(result)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,199 @@
+import argparse
+import json
+import socket
+import threading
+import time
+import numpy as np
+import telemetry
+
+
+class CarSession(object):
+    '''
+    Stand-in for the TORCS side of one SCRC client: answers the init
+    handshake, streams recorded sensor frames at a fixed rate, and times
+    each control reply against the deadline.
+    '''
+    def __init__(self, host, port, messages, rate=50.0, deadline=0.02, episodes=1, frames=None,
+                 handshake_timeout=10.0):
+        '''Constructor'''
+        self.port = port
+        self.messages = messages
+        self.period = 1.0 / rate if rate > 0 else 0.0
+        self.deadline = deadline
+        self.episodes = episodes
+        self.frames = frames or len(messages)
+        self.handshake_timeout = handshake_timeout
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind((host, port))
+        self.client = None
+
+        self.sent = 0
+        self.rtts = []
+        self.late = 0
+        self.missed = 0
+        self.stale = 0
+        self.restarts = 0
+        self.error = None
+
+    def handshake(self):
+        '''Wait for SCR(init ...) and answer ***identified***. False if no client came.'''
+        self.sock.settimeout(self.handshake_timeout)
+        while True:
+            try:
+                data, addr = self.sock.recvfrom(1000)
+            except socket.timeout:
+                return False
+            if b'(init' in data:
+                self.client = addr
+                self.sock.sendto(b'***identified***', addr)
+                return True
+
+    def wait_reply(self, until):
+        '''The first control reply before the monotonic time until, or None'''
+        while True:
+            remaining = until - time.perf_counter()
+            if remaining <= 0:
+                return None
+            self.sock.settimeout(remaining)
+            try:
+                data, addr = self.sock.recvfrom(1000)
+            except socket.timeout:
+                return None
+            if b'(init' in data:
+                # The client is still re-sending its init string
+                self.sock.sendto(b'***identified***', addr)
+                continue
+            return data
+
+    def drain(self):
+        '''Throw away replies that arrived after their frame's window'''
+        self.sock.setblocking(False)
+        try:
+            while True:
+                self.sock.recvfrom(1000)
+                self.stale += 1
+        except (BlockingIOError, socket.error):
+            pass
+        self.sock.setblocking(True)
+
+    def episode(self):
+        '''Stream one episode of frames. Returns False if the client asked for a restart.'''
+        next_send = time.perf_counter()
+        for k in range(self.frames):
+            msg = self.messages[k % len(self.messages)].encode()
+            if self.period:
+                delay = next_send - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            self.drain()
+            sent = time.perf_counter()
+            self.sock.sendto(msg, self.client)
+            self.sent += 1
+            next_send = sent + self.period
+
+            # Wait until the next frame is due, or a generous timeout when unpaced
+            reply = self.wait_reply(sent + (self.period or 1.0))
+            if reply is None:
+                self.missed += 1
+                continue
+            rtt = time.perf_counter() - sent
+            self.rtts.append(rtt)
+            if rtt > self.deadline:
+                self.late += 1
+            if b'(meta 1)' in reply:
+                return False
+        return True
+
+    def run(self):
+        try:
+            if not self.handshake():
+                self.error = 'no client connected'
+                return
+            episode = 0
+            while True:
+                self.episode()
+                episode += 1
+                if episode == self.episodes:
+                    break
+                self.sock.sendto(b'***restart***', self.client)
+                self.restarts += 1
+                # With unlimited episodes the session ends when no client comes back
+                if not self.handshake():
+                    return
+            self.sock.sendto(b'***shutdown***', self.client)
+        except Exception as e:
+            self.error = str(e)
+        finally:
+            self.sock.close()
+
+    def summary(self):
+        rtts = np.array(self.rtts) * 1000.0 if self.rtts else np.zeros(1)
+        p50, p99 = np.percentile(rtts, [50, 99])
+        return {
+            'port': self.port,
+            'frames': self.sent,
+            'replies': len(self.rtts),
+            'missed': self.missed,
+            'late': self.late,
+            'missed_deadlines': self.missed + self.late,
+            'stale_replies': self.stale,
+            'restarts': self.restarts,
+            'rtt_ms': {'mean': float(rtts.mean()), 'p50': float(p50), 'p99': float(p99), 'max': float(rtts.max())},
+            'error': self.error,
+        }
+
+
+def serve(host, ports, csv_paths, rate=50.0, deadline=0.02, episodes=1, frames=None, limit=None):
+    '''Run one session per port on its own thread; returns their summaries'''
+    recordings = [telemetry.load_messages(path, limit) for path in csv_paths]
+    sessions = [CarSession(host, port, recordings[i % len(recordings)], rate, deadline, episodes, frames)
+                for i, port in enumerate(ports)]
+    threads = [threading.Thread(target=s.run, name=f'scrc-{s.port}', daemon=True) for s in sessions]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return [s.summary() for s in sessions]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local stand-in for the TORCS SCRC server, replaying recorded sensor frames.')
+    parser.add_argument('--host', action='store', dest='host', default='localhost',
+                        help='Address to listen on (default: localhost)')
+    parser.add_argument('--port', action='store', type=int, dest='port', default=3001,
+                        help='Port of the first car; car i uses port + i (default: 3001)')
+    parser.add_argument('--cars', action='store', type=int, dest='cars', default=1,
+                        help='Number of clients to serve (default: 1)')
+    parser.add_argument('--csv', action='store', dest='csv', nargs='+', default=['new_new.csv'],
+                        help='Recordings to replay; car i gets recording i modulo their number (default: new_new.csv)')
+    parser.add_argument('--rate', action='store', type=float, dest='rate', default=50.0,
+                        help='Frames per second per car, 0 to send each frame as soon as the reply arrives (default: 50)')
+    parser.add_argument('--deadline', action='store', type=float, dest='deadline', default=20.0,
+                        help='Milliseconds a reply may take before it counts as late (default: 20)')
+    parser.add_argument('--frames', action='store', type=int, dest='frames', default=None,
+                        help='Frames per episode (default: the length of the recording)')
+    parser.add_argument('--episodes', action='store', type=int, dest='episodes', default=1,
+                        help='Episodes, separated by ***restart***; 0 to keep restarting until no client '
+                             'identifies within 10 s (default: 1)')
+    parser.add_argument('--limit', action='store', type=int, dest='limit', default=None,
+                        help='Rows of each recording to load (default: all)')
+    parser.add_argument('--json', action='store', dest='json', default=None,
+                        help='Write the per-client results to this JSON file')
+    args = parser.parse_args()
+
+    ports = [args.port + i for i in range(args.cars)]
+    print('Serving ports:', ports, 'at', args.rate, 'Hz')
+    results = serve(args.host, ports, args.csv, args.rate, args.deadline / 1000.0, args.episodes,
+                    args.frames, args.limit)
+    for r in results:
+        rtt = r['rtt_ms']
+        print(f"Port {r['port']}: {r['frames']} frames, {r['replies']} replies, missed deadlines "
+              f"{r['missed_deadlines']} (late {r['late']}, no reply {r['missed']}), rtt ms p50 {rtt['p50']:.2f} "
+              f"p99 {rtt['p99']:.2f} max {rtt['max']:.2f}" + (f", error: {r['error']}" if r['error'] else ''))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,33 @@
+import csv
+import msgParser
+
+
+def read_rows(csv_path, limit=None):
+    '''Yield the rows of a recorded telemetry CSV as dictionaries of strings'''
+    with open(csv_path, newline='', encoding='utf-8') as f:
+        for i, row in enumerate(csv.DictReader(f)):
+            if limit is not None and i >= limit:
+                break
+            yield row
+
+
+def row_to_msg(row, schema=msgParser.SENSOR_SCHEMA):
+    '''
+    Rebuild the sensor message TORCS sent for a recorded CSV row.
+    Multi-value sensors were expanded into name_0 .. name_N columns.
+    '''
+    msg = []
+    for name, size, _ in schema:
+        if size == 1:
+            values = [row.get(name)]
+        else:
+            values = [row.get(name + '_' + str(i)) for i in range(size)]
+        if any(v is None or v == '' for v in values):
+            continue
+        msg.append('(' + name + ' ' + ' '.join(values) + ')')
+    return ''.join(msg)
+
+
+def load_messages(csv_path, limit=None):
+    '''Return the sensor messages rebuilt from a recorded telemetry CSV'''
+    return [row_to_msg(row) for row in read_rows(csv_path, limit)]
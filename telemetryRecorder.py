@@ -0,0 +1,224 @@
+import argparse
+import collections
+import csv
+import json
+import os
+import struct
+import threading
+import numpy as np
+import msgParser
+
+MAGIC = b'TORCSREC1\n'
+ROWS = struct.Struct('<I')
+
+# Controls sent back to the server; gear and focus also exist as sensors
+CONTROL_COLUMNS = ('accel', 'brake', 'gear_cmd', 'steer', 'clutch', 'focus_cmd', 'meta')
+
+
+def sensor_columns(schema=msgParser.SENSOR_SCHEMA):
+    '''Column names of the sensors, multi-value sensors expanded to name_0 .. name_N'''
+    columns = []
+    for name, size, _ in schema:
+        if size == 1:
+            columns.append(name)
+        else:
+            columns.extend(f'{name}_{i}' for i in range(size))
+    return columns
+
+
+COLUMNS = tuple(sensor_columns()) + CONTROL_COLUMNS
+
+
+class TelemetryRecorder(object):
+    '''
+    Records every tick's sensor message and controls to an append-only
+    binary columnar file from a background thread.
+
+    The control loop only appends (message, controls) to a deque, which is
+    thread-safe without locks; the writer thread parses the messages and
+    writes them in blocks, so the loop never waits for the disk.
+
+    File layout: MAGIC, a uint32-length JSON header with the column names,
+    then blocks of one uint32 row count followed by every column's float32
+    values for those rows (column-major). Missing values are NaN.
+    '''
+    def __init__(self, path, batch_rows=500, interval=0.25):
+        '''Constructor'''
+        self.path = path
+        self.batch_rows = batch_rows
+        self.interval = interval
+        self.queue = collections.deque()
+        self.parser = msgParser.SensorParser()
+        self.rows = 0
+
+        self.offsets = {}
+        offset = 0
+        for name, size, _ in msgParser.SENSOR_SCHEMA:
+            self.offsets[name] = (offset, size)
+            offset += size
+        self.n_sensors = offset
+
+        self.file = open_recording(path, COLUMNS)
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='telemetry-recorder', daemon=True)
+        self.thread.start()
+
+    def record(self, msg, controls):
+        '''Queue one tick: the sensor message string and the 7 control values'''
+        self.queue.append((msg, controls))
+
+    def run(self):
+        while not self.stopping.wait(self.interval):
+            self.flush()
+        self.flush()
+
+    def flush(self):
+        '''Write everything queued so far, in blocks of at most batch_rows'''
+        queue = self.queue
+        while queue:
+            n = min(len(queue), self.batch_rows)
+            block = np.full((n, len(COLUMNS)), np.nan, dtype=np.float32)
+            for row in block:
+                msg, controls = queue.popleft()
+                self.fill(row, msg, controls)
+            self.file.write(ROWS.pack(n))
+            self.file.write(np.ascontiguousarray(block.T).tobytes())
+            self.rows += n
+        self.file.flush()
+
+    def fill(self, row, msg, controls):
+        sensors = self.parser.parse(msg) or {}
+        for name, value in sensors.items():
+            place = self.offsets.get(name)
+            if place is None:
+                continue
+            offset, size = place
+            try:
+                if size == 1:
+                    row[offset] = value
+                else:
+                    row[offset:offset + min(size, len(value))] = value[:size]
+            except (TypeError, ValueError):
+                pass
+        row[self.n_sensors:] = [np.nan if v is None else v for v in controls]
+
+    def close(self):
+        '''Stop the writer thread after it has written everything queued'''
+        self.stopping.set()
+        self.thread.join()
+        self.file.close()
+
+
+def open_recording(path, columns):
+    '''
+    Open a recording for appending, writing the header if the file is new.
+    A block cut short (e.g. the client was killed mid-write) is truncated
+    first, so new blocks follow the last complete one.
+    '''
+    f = open(path, 'a+b')
+    f.seek(0)
+    try:
+        existing = read_header(f)
+    except EOFError:
+        # New, or killed while writing the header: start it over
+        f.truncate(0)
+        header = json.dumps({'columns': list(columns), 'dtype': 'float32'}).encode()
+        f.write(MAGIC + ROWS.pack(len(header)) + header)
+        return f
+    except ValueError:
+        f.close()
+        raise
+    if existing != list(columns):
+        f.close()
+        raise ValueError(f'{path} was recorded with a different set of columns')
+
+    end = f.tell()
+    for offset, n in blocks(f, len(existing)):
+        end = offset + 4 * n * len(existing)
+    f.truncate(end)
+    return f
+
+
+def read_header(f):
+    '''Column names of a recording. Raises EOFError if the file ends inside its header.'''
+    magic = f.read(len(MAGIC))
+    if magic != MAGIC:
+        if MAGIC.startswith(magic):
+            raise EOFError('The recording ends inside its header')
+        raise ValueError('Not a telemetry recording')
+    head = f.read(ROWS.size)
+    if len(head) < ROWS.size:
+        raise EOFError('The recording ends inside its header')
+    (length,) = ROWS.unpack(head)
+    header = f.read(length)
+    if len(header) < length:
+        raise EOFError('The recording ends inside its header')
+    return json.loads(header)['columns']
+
+
+def blocks(f, n_columns):
+    '''
+    (data offset, rows) of every complete block from the position of f on.
+    Stops at a block running past the end of the file, without reading it.
+    '''
+    size = os.fstat(f.fileno()).st_size
+    offset = f.tell()
+    while offset + ROWS.size <= size:
+        f.seek(offset)
+        (n,) = ROWS.unpack(f.read(ROWS.size))
+        end = offset + ROWS.size + 4 * n * n_columns
+        if end > size:
+            break
+        yield offset + ROWS.size, n
+        offset = end
+
+
+def read_recording(path, columns=None):
+    '''
+    Return {column: float32 array} for a recording. A block cut short
+    (e.g. the client was killed mid-write) is ignored.
+    '''
+    with open(path, 'rb') as f:
+        names = read_header(f)
+        wanted = names if columns is None else list(columns)
+        index = [names.index(c) for c in wanted]
+        parts = {c: [] for c in wanted}
+        for offset, n in blocks(f, len(names)):
+            f.seek(offset)
+            block = np.frombuffer(f.read(4 * n * len(names)), dtype=np.float32).reshape(len(names), n)
+            for c, i in zip(wanted, index):
+                parts[c].append(block[i])
+    return {c: np.concatenate(p) if p else np.zeros(0, dtype=np.float32) for c, p in parts.items()}
+
+
+def to_csv(path, csv_path):
+    '''
+    Export a recording in the CSV layout pyclient.py used to write (sorted
+    headers, the sent gear and focus in the gear and focus columns), for the
+    training notebook.
+    '''
+    data = read_recording(path)
+    data['gear'] = data.pop('gear_cmd')
+    data['focus'] = data.pop('focus_cmd')
+    headers = sorted(data)
+    n = len(data[headers[0]]) if headers else 0
+    with open(csv_path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(headers)
+        columns = [data[h] for h in headers]
+        for i in range(n):
+            writer.writerow(['' if np.isnan(c[i]) else '%.7g' % c[i] for c in columns])
+    return n
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export a binary telemetry recording to CSV.')
+    parser.add_argument('recording', help='Recording written with --record')
+    parser.add_argument('csv', help='CSV file to write')
+    args = parser.parse_args()
+    n = to_csv(args.recording, args.csv)
+    print(f'Wrote {n} rows to {args.csv}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,160 @@
+import csv
+import json
+import time
+
+# Each power of two is split into 2**SUB_BITS buckets (12.5% resolution)
+SUB_BITS = 3
+SUB_BUCKETS = 1 << SUB_BITS
+N_BUCKETS = (64 - SUB_BITS) * SUB_BUCKETS + SUB_BUCKETS
+
+# TORCS control period: a tick slower than this misses the server's deadline
+TICK_BUDGET_NS = 20_000_000
+
+
+def bucket_index(ns):
+    '''Histogram bucket of a duration in nanoseconds'''
+    bits = ns.bit_length()
+    if bits <= SUB_BITS:
+        return ns
+    return (bits - SUB_BITS) * SUB_BUCKETS + ((ns >> (bits - SUB_BITS - 1)) - SUB_BUCKETS)
+
+
+def bucket_upper(index):
+    '''Largest duration in nanoseconds that falls into a bucket'''
+    if index < SUB_BUCKETS:
+        return index
+    bits = index // SUB_BUCKETS + SUB_BITS
+    top = index % SUB_BUCKETS + SUB_BUCKETS
+    return ((top + 1) << (bits - SUB_BITS - 1)) - 1
+
+
+class Histogram(object):
+    '''
+    Fixed-size log-scale histogram of durations in nanoseconds
+    '''
+    __slots__ = ('counts', 'count', 'total', 'max', 'over_budget', 'budget')
+
+    def __init__(self, budget=TICK_BUDGET_NS):
+        '''Constructor'''
+        self.counts = [0] * N_BUCKETS
+        self.count = 0
+        self.total = 0
+        self.max = 0
+        self.over_budget = 0
+        self.budget = budget
+
+    def add(self, ns):
+        self.counts[bucket_index(ns)] += 1
+        self.count += 1
+        self.total += ns
+        if ns > self.max:
+            self.max = ns
+        if ns > self.budget:
+            self.over_budget += 1
+
+    def merge(self, other):
+        '''Add the durations counted by another histogram, e.g. one from another process'''
+        counts = self.counts
+        for index, n in enumerate(other.counts):
+            if n:
+                counts[index] += n
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+        self.over_budget += other.over_budget
+
+    def percentile(self, p):
+        '''Upper bound of the p-th percentile in nanoseconds (0 if empty)'''
+        if self.count == 0:
+            return 0
+        rank = p / 100.0 * self.count
+        seen = 0
+        for index, n in enumerate(self.counts):
+            seen += n
+            if n and seen >= rank:
+                return min(bucket_upper(index), self.max)
+        return self.max
+
+    def summary(self):
+        '''Count, mean, p50, p99 and max in microseconds'''
+        return {
+            'count': self.count,
+            'mean_us': round(self.total / self.count / 1000.0, 3) if self.count else 0.0,
+            'p50_us': round(self.percentile(50) / 1000.0, 3),
+            'p99_us': round(self.percentile(99) / 1000.0, 3),
+            'max_us': round(self.max / 1000.0, 3),
+            'over_budget': self.over_budget,
+        }
+
+
+class StageProfiler(object):
+    '''
+    Records how long each stage of a drive tick takes, per episode.
+    Call clock() at the start of a tick and record(stage, start) after each
+    stage; record returns the current time so stages can be chained.
+    '''
+    def __init__(self, budget=TICK_BUDGET_NS):
+        '''Constructor'''
+        self.budget = budget
+        self.stages = {}
+        self.episodes = []
+
+    clock = staticmethod(time.perf_counter_ns)
+
+    def record(self, stage, start):
+        now = time.perf_counter_ns()
+        histogram = self.stages.get(stage)
+        if histogram is None:
+            histogram = self.stages[stage] = Histogram(self.budget)
+        histogram.add(now - start)
+        return now
+
+    def end_episode(self):
+        '''Close the current episode, print its summary and start a new one'''
+        if not self.stages:
+            return
+        summary = {name: h.summary() for name, h in self.stages.items()}
+        self.episodes.append({'episode': len(self.episodes) + 1, 'stages': summary})
+        self.stages = {}
+        self.report(summary)
+
+    def report(self, summary):
+        print(f"{'stage':18s} {'count':>7s} {'p50 us':>9s} {'p99 us':>9s} {'max us':>9s} {'>budget':>8s}")
+        for name, s in summary.items():
+            print(f"{name:18s} {s['count']:7d} {s['p50_us']:9.1f} {s['p99_us']:9.1f} "
+                  f"{s['max_us']:9.1f} {s['over_budget']:8d}")
+
+    def dump(self, path):
+        '''Write every episode summary to a .json or .csv file'''
+        self.end_episode()
+        if path.endswith('.csv'):
+            with open(path, 'w', newline='') as f:
+                writer = csv.writer(f)
+                writer.writerow(['episode', 'stage', 'count', 'mean_us', 'p50_us', 'p99_us', 'max_us', 'over_budget'])
+                for episode in self.episodes:
+                    for name, s in episode['stages'].items():
+                        writer.writerow([episode['episode'], name, s['count'], s['mean_us'], s['p50_us'],
+                                         s['p99_us'], s['max_us'], s['over_budget']])
+        else:
+            with open(path, 'w') as f:
+                json.dump({'budget_us': self.budget / 1000.0, 'episodes': self.episodes}, f, indent=2)
+
+
+class NullProfiler(object):
+    '''
+    Stand-in used when profiling is off: every call is a no-op
+    '''
+    def clock(self):
+        return 0
+
+    def record(self, stage, start):
+        return 0
+
+    def end_episode(self):
+        pass
+
+    def dump(self, path):
+        pass
+
+
+NULL = NullProfiler()
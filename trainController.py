@@ -0,0 +1,389 @@
+import argparse
+import hashlib
+import json
+import os
+import platform
+import time
+import joblib
+import numpy as np
+import pandas as pd
+import treeModel
+import windowDataset
+
+TARGETS = ['accel', 'brake', 'clutch', 'gear', 'steer']
+
+# Columns model.ipynb drops before training the full controller
+DROPPED = ['damage', 'curLapTime', 'focus', 'fuel', 'lastLapTime', 'meta', 'racePos']
+DROPPED_PREFIXES = ('opponents_',)
+
+# Inputs of the steer-only controller, in the notebook's order
+STEER_FEATURES = (['trackPos', 'angle', 'distFromStart', 'distRaced'] + [f'track_{i}' for i in range(19)]
+                  + ['speedX', 'speedY', 'speedZ'] + [f'wheelSpinVel_{i}' for i in range(4)] + ['rpm'])
+
+# model.ipynb's grid search for the full controller
+PARAM_GRID = {
+    'n_estimators': [100, 200],
+    'learning_rate': [0.01, 0.1],
+    'max_depth': [3, 5],
+}
+REGULARIZATION = {'reg_alpha': 0.1, 'reg_lambda': 0.1}
+STEER_PARAMS = {'n_estimators': 100, 'learning_rate': 0.1, 'max_depth': 3}
+
+KINDS = ('controller', 'steer_controller')
+
+# Models trained for the full controller; the steer controller is xgb only
+MODES = ('xgb', 'lstm')
+
+# model.ipynb's LSTM controller: units of its LSTM layers, and epochs
+LSTM_UNITS = (64, 32)
+LSTM_EPOCHS = 15
+
+
+def controller_features(columns):
+    '''Every column except the targets and the ones the notebook drops, in data order'''
+    return [c for c in columns
+            if c not in TARGETS and c not in DROPPED and not c.startswith(DROPPED_PREFIXES)]
+
+
+def load_frame(sources, columns=None):
+    '''
+    Load the training data. sources is a list of telemetry CSVs (read as the
+    notebook does) or a single columnStore directory.
+    '''
+    if len(sources) == 1 and os.path.isdir(sources[0]):
+        import columnStore
+        store = columnStore.open_store(sources[0])
+        names = store.columns if columns is None else columns
+        return pd.DataFrame({name: np.asarray(store[name], dtype=np.float64) for name in names})
+    frames = [pd.read_csv(path, usecols=columns) for path in sources]
+    return frames[0] if len(frames) == 1 else pd.concat(frames, ignore_index=True)
+
+
+def source_columns(sources):
+    '''Column names of the training data without loading it'''
+    if len(sources) == 1 and os.path.isdir(sources[0]):
+        import columnStore
+        return list(columnStore.open_store(sources[0]).columns)
+    return list(pd.read_csv(sources[0], nrows=0).columns)
+
+
+def window_columns(sources, columns):
+    '''
+    (columns, episode bounds) of the training data for windowDataset: the
+    columnStore itself, or the CSVs' columns with an episode per file, split
+    again at restarts
+    '''
+    if len(sources) == 1 and os.path.isdir(sources[0]):
+        import columnStore
+        store = columnStore.open_store(sources[0])
+        return store, windowDataset.store_bounds(store)
+    frames, bounds, start = [], [], 0
+    for path in sources:
+        df = pd.read_csv(path, usecols=list(dict.fromkeys(columns + ['distRaced'])))
+        bounds.extend(windowDataset.episode_bounds(df['distRaced'].to_numpy(), start))
+        start += len(df)
+        frames.append(df)
+    df = frames[0] if len(frames) == 1 else pd.concat(frames, ignore_index=True)
+    return {name: df[name].to_numpy(dtype=np.float64) for name in df.columns}, bounds
+
+
+def source_key(sources):
+    '''Identity of the input files, for the split cache'''
+    parts = []
+    for path in sources:
+        paths = [path]
+        if os.path.isdir(path):
+            paths = sorted(os.path.join(path, f) for f in os.listdir(path))
+        for p in paths:
+            st = os.stat(p)
+            parts.append(f'{os.path.abspath(p)}:{st.st_size}:{st.st_mtime_ns}')
+    return parts
+
+
+class Timer(object):
+    '''Wall-clock seconds of each named training stage'''
+    def __init__(self):
+        '''Constructor'''
+        self.timings = {}
+        self.start = time.perf_counter()
+
+    def lap(self, stage):
+        now = time.perf_counter()
+        self.timings[stage] = round(now - self.start, 3)
+        self.start = now
+
+
+def split_and_scale(sources, features, targets, test_size, seed, cache_dir, timer):
+    '''
+    Split the data and fit the StandardScaler once, as the notebook does.
+    The split, scaled matrices and scaler are cached under cache_dir keyed on
+    the input files, features, targets, test size and seed.
+    '''
+    from sklearn.model_selection import train_test_split
+    from sklearn.preprocessing import StandardScaler
+
+    key = hashlib.sha1(json.dumps([source_key(sources), features, targets, test_size, seed]).encode()).hexdigest()[:16]
+    cache = os.path.join(cache_dir, key) if cache_dir else None
+    if cache and os.path.exists(cache + '.npz'):
+        with np.load(cache + '.npz') as data:
+            split = {k: data[k] for k in data.files}
+        split['scaler'] = joblib.load(cache + '_scaler.joblib')
+        split['cached'] = True
+        timer.lap('load_cached_split')
+        return split
+
+    df = load_frame(sources, list(dict.fromkeys(features + targets)))
+    timer.lap('load_data')
+    X = df[features]
+    y = df[targets]
+    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=test_size, random_state=seed)
+
+    # Fitted on a DataFrame, so feature_names_in_ records the order autoDriver feeds
+    scaler = StandardScaler()
+    split = {
+        'X_train': scaler.fit_transform(X_train),
+        'X_test': scaler.transform(X_test),
+        'y_train': y_train.to_numpy(),
+        'y_test': y_test.to_numpy(),
+    }
+    timer.lap('split_and_scale')
+    if cache:
+        os.makedirs(cache_dir, exist_ok=True)
+        np.savez(cache + '.npz', **split)
+        joblib.dump(scaler, cache + '_scaler.joblib')
+    split['scaler'] = scaler
+    split['cached'] = False
+    return split
+
+
+def fit_model(kind, X_train, y_train, seed, jobs, cv):
+    '''Fit the notebook's model for one controller kind. Returns (model, search summary)'''
+    import xgboost as xgb
+
+    if kind == 'steer_controller':
+        model = xgb.XGBRegressor(objective='reg:squarederror', random_state=seed, **STEER_PARAMS)
+        model.fit(X_train, y_train)
+        return model, {'best_params': dict(STEER_PARAMS)}
+
+    from sklearn.model_selection import GridSearchCV
+    # Parallelism goes to the folds; each candidate fits single-threaded so
+    # the cores are not oversubscribed
+    search = GridSearchCV(xgb.XGBRegressor(objective='reg:squarederror', random_state=seed, n_jobs=1),
+                          PARAM_GRID, scoring='neg_mean_absolute_error', cv=cv, n_jobs=jobs)
+    search.fit(X_train, y_train)
+    best_params = search.best_params_
+
+    model = xgb.XGBRegressor(objective='reg:squarederror', random_state=seed, **best_params, **REGULARIZATION)
+    model.fit(X_train, y_train)
+    results = search.cv_results_
+    return model, {
+        'best_params': best_params,
+        'best_cv_mae': round(float(-search.best_score_), 6),
+        'candidates': [{'params': p, 'mean_mae': round(float(-m), 6), 'fit_s': round(float(t), 3)}
+                       for p, m, t in zip(results['params'], results['mean_test_score'], results['mean_fit_time'])],
+    }
+
+
+def train(name, sources, out_dir='controller', kind='controller', seed=42, test_size=0.2, jobs=-1, cv=5,
+          cache_dir='.train_cache'):
+    '''
+    Train one controller the way model.ipynb does and write
+    {name}_{kind}_scaler.joblib, {name}_{kind}_xgb.joblib, the compiled .npz
+    autoDriver loads, and {name}_{kind}_manifest.json. Returns the manifest.
+    '''
+    from sklearn.metrics import mean_absolute_error
+
+    if kind not in KINDS:
+        raise ValueError(f'Unknown controller kind {kind!r}, expected one of {KINDS}')
+    timer = Timer()
+    if kind == 'steer_controller':
+        features, targets = list(STEER_FEATURES), ['steer']
+    else:
+        features, targets = controller_features(source_columns(sources)), list(TARGETS)
+
+    split = split_and_scale(sources, features, targets, test_size, seed, cache_dir, timer)
+    y_train, y_test = split['y_train'], split['y_test']
+    if len(targets) == 1:
+        y_train, y_test = y_train[:, 0], y_test[:, 0]
+
+    model, search = fit_model(kind, split['X_train'], y_train, seed, jobs, cv)
+    timer.lap('fit')
+    mae = mean_absolute_error(y_test, model.predict(split['X_test']))
+    timer.lap('evaluate')
+
+    os.makedirs(out_dir, exist_ok=True)
+    prefix = os.path.join(out_dir, f'{name}_{kind}')
+    scaler_path, model_path = prefix + '_scaler.joblib', prefix + '_xgb.joblib'
+    joblib.dump(split['scaler'], scaler_path)
+    joblib.dump(model, model_path)
+    compiled = treeModel.compile_model(model)
+    compiled.source_sha1 = treeModel.file_sha1(model_path)
+    compiled.feature_names_in_ = np.asarray(split['scaler'].feature_names_in_, dtype=str)
+    compiled.save(treeModel.compiled_path(model_path))
+    timer.lap('export')
+
+    import sklearn
+    import xgboost
+    manifest = {
+        'name': name,
+        'kind': kind,
+        'sources': [os.path.basename(s) for s in sources],
+        'rows': {'train': int(len(split['X_train'])), 'test': int(len(split['X_test']))},
+        'features': features,
+        'targets': targets,
+        'seed': seed,
+        'test_size': test_size,
+        'cv': cv,
+        'test_mae': round(float(mae), 6),
+        **search,
+        'artefacts': {
+            'scaler': os.path.basename(scaler_path),
+            'model': os.path.basename(model_path),
+            'compiled': os.path.basename(treeModel.compiled_path(model_path)),
+        },
+        'split_cached': split['cached'],
+        'timings_s': timer.timings,
+        'versions': {'python': platform.python_version(), 'numpy': np.__version__, 'pandas': pd.__version__,
+                     'scikit-learn': sklearn.__version__, 'xgboost': xgboost.__version__},
+    }
+    with open(prefix + '_manifest.json', 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def train_lstm(name, sources, out_dir='controller', seed=42, test_size=0.2, epochs=LSTM_EPOCHS, batch_size=32,
+               timesteps=windowDataset.TIMESTEPS):
+    '''
+    Train model.ipynb's LSTM controller on batches of windows streamed by
+    windowDataset, split per episode, and write {name}_controller.keras, the
+    exported .npz autoDriver loads, and {name}_controller_lstm_manifest.json.
+    The registry pairs the .keras with {name}_controller_scaler.joblib, so
+    the xgb controller's scaler is reused when there is one; otherwise one
+    is fitted on the training episodes and written. Returns the manifest.
+    '''
+    from tensorflow import keras
+    import lstmModel
+
+    timer = Timer()
+    prefix = os.path.join(out_dir, f'{name}_controller')
+    scaler_path, model_path = prefix + '_scaler.joblib', prefix + '.keras'
+    scaler = joblib.load(scaler_path) if os.path.exists(scaler_path) else None
+    if scaler is not None:
+        features = list(scaler.feature_names_in_)
+    else:
+        features = controller_features(source_columns(sources))
+    columns, bounds = window_columns(sources, features + TARGETS)
+    timer.lap('load_data')
+    train_set, test_set, fitted = windowDataset.build(columns, features, TARGETS, timesteps, test_size, batch_size,
+                                                      seed, scaler, bounds)
+    timer.lap('split_and_scale')
+
+    keras.utils.set_random_seed(seed)
+    model = keras.Sequential([keras.Input((timesteps, len(features)))]
+                             + [keras.layers.LSTM(units, activation='relu', return_sequences=i < len(LSTM_UNITS) - 1)
+                                for i, units in enumerate(LSTM_UNITS)]
+                             + [keras.layers.Dense(len(TARGETS))])
+    model.compile(optimizer='adam', loss='mse', metrics=['mae'])
+    history = model.fit(train_set.repeat(), steps_per_epoch=len(train_set), epochs=epochs, verbose=0)
+    timer.lap('fit')
+    _, mae = model.evaluate(test_set.repeat(), steps=len(test_set), verbose=0)
+    timer.lap('evaluate')
+
+    os.makedirs(out_dir, exist_ok=True)
+    if scaler is None:
+        joblib.dump(fitted, scaler_path)
+    model.save(model_path)
+    network = lstmModel.LSTMNetwork(lstmModel.export_keras(model_path))
+    network.source_sha1 = treeModel.file_sha1(model_path)
+    network.save(lstmModel.compiled_path(model_path))
+    timer.lap('export')
+
+    import tensorflow
+    manifest = {
+        'name': name,
+        'kind': 'controller',
+        'mode': 'lstm',
+        'sources': [os.path.basename(s) for s in sources],
+        'episodes': len(bounds),
+        'windows': {'train': int(len(train_set.ends)), 'test': int(len(test_set.ends))},
+        'features': features,
+        'targets': list(TARGETS),
+        'seed': seed,
+        'test_size': test_size,
+        'timesteps': timesteps,
+        'units': list(LSTM_UNITS),
+        'epochs': epochs,
+        'batch_size': batch_size,
+        'loss': [round(float(v), 6) for v in history.history['loss']],
+        'test_mae': round(float(mae), 6),
+        'artefacts': {
+            'scaler': os.path.basename(scaler_path),
+            'model': os.path.basename(model_path),
+            'compiled': os.path.basename(lstmModel.compiled_path(model_path)),
+        },
+        'scaler_reused': scaler is not None,
+        'timings_s': timer.timings,
+        'versions': {'python': platform.python_version(), 'numpy': np.__version__, 'pandas': pd.__version__,
+                     'tensorflow': tensorflow.__version__},
+    }
+    with open(prefix + '_lstm_manifest.json', 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Train TORCS controllers from telemetry, as model.ipynb does.')
+    parser.add_argument('sources', nargs='*', help='Telemetry CSVs, or one columnStore directory')
+    parser.add_argument('--name', action='store', dest='name', default='G-Speedway',
+                        help='Artefact name prefix, e.g. the track (default: G-Speedway)')
+    parser.add_argument('--kind', action='store', dest='kinds', nargs='+', choices=KINDS, default=list(KINDS),
+                        help='Controllers to train (default: both)')
+    parser.add_argument('--mode', action='store', dest='modes', nargs='+', choices=MODES, default=['xgb'],
+                        help='Models to train: xgb for every kind, lstm for the full controller, after its xgb '
+                             'model whose scaler it shares (default: xgb)')
+    parser.add_argument('--batch', action='store', dest='batch', default=None,
+                        help='JSON list of {"name": ..., "sources": [...]} jobs (optionally "kinds" and "modes") '
+                             'to train instead of the positional sources')
+    parser.add_argument('--out', action='store', dest='out', default='controller',
+                        help='Directory to write the artefacts to (default: controller)')
+    parser.add_argument('--seed', action='store', dest='seed', type=int, default=42,
+                        help='Seed of the train/test split and the models (default: 42)')
+    parser.add_argument('--testSize', action='store', dest='test_size', type=float, default=0.2,
+                        help='Fraction of rows held out for the test MAE (default: 0.2)')
+    parser.add_argument('--jobs', action='store', dest='jobs', type=int, default=-1,
+                        help='Parallel cross-validation fits, -1 for all cores (default: -1)')
+    parser.add_argument('--cv', action='store', dest='cv', type=int, default=5,
+                        help='Cross-validation folds (default: 5)')
+    parser.add_argument('--cache', action='store', dest='cache', default='.train_cache',
+                        help='Directory caching split and scaled matrices, empty to disable (default: .train_cache)')
+    parser.add_argument('--epochs', action='store', dest='epochs', type=int, default=LSTM_EPOCHS,
+                        help=f'Training epochs of the LSTM (default: {LSTM_EPOCHS})')
+    parser.add_argument('--batchSize', action='store', dest='batch_size', type=int, default=32,
+                        help='Windows per LSTM training batch (default: 32)')
+    args = parser.parse_args()
+
+    if args.batch:
+        with open(args.batch) as f:
+            jobs = json.load(f)
+    elif args.sources:
+        jobs = [{'name': args.name, 'sources': args.sources}]
+    else:
+        parser.error('give telemetry sources or --batch')
+
+    for job in jobs:
+        modes = job.get('modes', args.modes)
+        if 'xgb' in modes:
+            for kind in job.get('kinds', args.kinds):
+                manifest = train(job['name'], job['sources'], args.out, kind, args.seed, args.test_size,
+                                 args.jobs, args.cv, args.cache or None)
+                print(f"{manifest['name']}_{kind}: test MAE {manifest['test_mae']:.4f}, "
+                      f"params {manifest['best_params']}, timings {manifest['timings_s']}")
+        if 'lstm' in modes:
+            manifest = train_lstm(job['name'], job['sources'], args.out, args.seed, args.test_size, args.epochs,
+                                  args.batch_size)
+            print(f"{manifest['name']}_controller (lstm): test MAE {manifest['test_mae']:.4f}, "
+                  f"{manifest['windows']['train']} training windows, timings {manifest['timings_s']}")
+
+
+if __name__ == '__main__':
+    main()
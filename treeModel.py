@@ -0,0 +1,338 @@
+import argparse
+import hashlib
+import json
+import os
+import numpy as np
+
+# Objectives whose prediction is the raw margin (identity link)
+IDENTITY_OBJECTIVES = ('reg:squarederror', 'reg:squaredlogerror', 'reg:absoluteerror',
+                       'reg:pseudohubererror', 'reg:linear')
+
+
+def _parse_floats(text):
+    '''Parse an xgboost JSON number that may be written as "[a,b,...]"'''
+    return [float(v) for v in str(text).strip('[]').split(',')]
+
+
+def export_xgboost(model):
+    '''
+    Flatten the boosters of an XGBRegressor (or xgboost Booster) into
+    contiguous arrays. Returns a dict that CompiledForest takes as-is.
+    '''
+    booster = model.get_booster() if hasattr(model, 'get_booster') else model
+    learner = json.loads(booster.save_raw('json'))['learner']
+
+    objective = learner['objective']['name']
+    if objective not in IDENTITY_OBJECTIVES:
+        raise ValueError(f'Unsupported objective {objective!r}: only identity-link regression is compiled')
+    booster_model = learner['gradient_booster']['model']
+    if learner['gradient_booster']['name'] != 'gbtree':
+        raise ValueError('Only gbtree boosters can be compiled')
+
+    params = learner['learner_model_param']
+    n_targets = max(int(params.get('num_target', 1)), 1)
+    base_score = _parse_floats(params['base_score'])
+    if len(base_score) == 1:
+        base_score = base_score * n_targets
+
+    # Honour early stopping the same way XGBRegressor.predict does
+    trees = booster_model['trees']
+    tree_info = booster_model['tree_info']
+    best = learner.get('attributes', {}).get('best_iteration')
+    if best is not None and 'iteration_indptr' in booster_model:
+        n_trees = booster_model['iteration_indptr'][int(best) + 1]
+        trees, tree_info = trees[:n_trees], tree_info[:n_trees]
+
+    feature, threshold, left, right, default_left, value, roots = [], [], [], [], [], [], []
+    depth = 0
+    for tree in trees:
+        if int(tree['tree_param'].get('size_leaf_vector', 1)) > 1:
+            raise ValueError('Multi-output trees (vector leaves) are not supported')
+        if any(tree.get('split_type', [])):
+            raise ValueError('Categorical splits are not supported')
+        offset = len(feature)
+        roots.append(offset)
+        lc, rc = tree['left_children'], tree['right_children']
+        for i in range(len(lc)):
+            leaf = lc[i] == -1
+            feature.append(0 if leaf else tree['split_indices'][i])
+            threshold.append(tree['split_conditions'][i])
+            left.append(offset + i if leaf else offset + lc[i])
+            right.append(offset + i if leaf else offset + rc[i])
+            default_left.append(bool(tree['default_left'][i]))
+            value.append(tree['split_conditions'][i] if leaf else 0.0)
+        depth = max(depth, _depth(lc, rc))
+
+    return {
+        'kind': 'xgboost',
+        'n_features': int(params['num_feature']),
+        'feature': np.array(feature, dtype=np.int32),
+        'threshold': np.array(threshold, dtype=np.float32),
+        'left': np.array(left, dtype=np.int32),
+        'right': np.array(right, dtype=np.int32),
+        'default_left': np.array(default_left, dtype=bool),
+        'value': np.array(value, dtype=np.float32)[:, None],
+        'roots': np.array(roots, dtype=np.int32),
+        'tree_target': np.array(tree_info, dtype=np.int32),
+        'base_score': np.array(base_score, dtype=np.float64),
+        'depth': depth,
+        'feature_names': np.array(booster.feature_names or [], dtype=str),
+    }
+
+
+def export_sklearn(model):
+    '''
+    Flatten a fitted sklearn DecisionTreeRegressor or RandomForestRegressor
+    into contiguous arrays. Returns a dict that CompiledForest takes as-is.
+    '''
+    estimators = getattr(model, 'estimators_', [model])
+    if len(estimators) == 0:
+        raise ValueError(f'{type(model).__name__} has no fitted trees')
+    feature, threshold, left, right, value, roots = [], [], [], [], [], []
+    offset = 0
+    depth = 0
+    for estimator in estimators:
+        tree = estimator.tree_
+        nodes = np.arange(tree.node_count)
+        leaf = tree.children_left == -1
+        roots.append(offset)
+        feature.append(np.where(leaf, 0, tree.feature))
+        threshold.append(tree.threshold)
+        left.append(offset + np.where(leaf, nodes, tree.children_left))
+        right.append(offset + np.where(leaf, nodes, tree.children_right))
+        value.append(tree.value[:, :, 0])
+        offset += tree.node_count
+        depth = max(depth, tree.max_depth)
+
+    n_targets = value[0].shape[1]
+    return {
+        'kind': 'sklearn',
+        'n_features': int(model.n_features_in_),
+        'feature': np.concatenate(feature).astype(np.int32),
+        'threshold': np.concatenate(threshold).astype(np.float64),
+        'left': np.concatenate(left).astype(np.int32),
+        'right': np.concatenate(right).astype(np.int32),
+        'default_left': np.zeros(offset, dtype=bool),
+        'value': np.concatenate(value).astype(np.float64),
+        'roots': np.array(roots, dtype=np.int32),
+        'tree_target': np.zeros(len(roots), dtype=np.int32),
+        'base_score': np.zeros(n_targets, dtype=np.float64),
+        'depth': depth,
+        'feature_names': np.array(getattr(model, 'feature_names_in_', []), dtype=str),
+    }
+
+
+def _depth(left, right):
+    '''Depth of a tree given as child index lists (root at 0)'''
+    depth = 0
+    level = [0]
+    while True:
+        level = [c for n in level for c in (left[n], right[n]) if c != -1]
+        if not level:
+            return depth
+        depth += 1
+
+
+def export(model):
+    '''Flatten any supported tree model into arrays'''
+    if hasattr(model, 'get_booster') or type(model).__name__ == 'Booster':
+        return export_xgboost(model)
+    if hasattr(model, 'tree_') or hasattr(model, 'estimators_'):
+        return export_sklearn(model)
+    raise ValueError(f'Cannot compile a {type(model).__name__}')
+
+
+class CompiledForest(object):
+    '''
+    Evaluates a tree ensemble exported by export() with vectorized NumPy,
+    walking every tree of every row one level per step.
+
+    xgboost trees go left when x < threshold (float32) and sum their leaves
+    per target on top of base_score; sklearn forests go left when
+    x <= threshold and average their leaf vectors. A forest returned by
+    fold_scaler() takes raw features and compares x < threshold in float64.
+    '''
+    def __init__(self, arrays):
+        '''Constructor'''
+        self.kind = str(arrays['kind'])
+        self.n_features_in_ = int(arrays['n_features'])
+        self.feature = np.asarray(arrays['feature'], dtype=np.intp)
+        self.threshold = np.asarray(arrays['threshold'])
+        self.left = np.asarray(arrays['left'], dtype=np.intp)
+        self.right = np.asarray(arrays['right'], dtype=np.intp)
+        self.default_left = np.asarray(arrays['default_left'], dtype=bool)
+        self.value = np.asarray(arrays['value'])
+        self.roots = np.asarray(arrays['roots'], dtype=np.intp)
+        self.tree_target = np.asarray(arrays['tree_target'], dtype=np.intp)
+        self.base_score = np.asarray(arrays['base_score'], dtype=np.float64)
+        self.depth = int(arrays['depth'])
+        self.raw_input = bool(arrays.get('raw_input', False))
+        # SHA-1 of the artefact the arrays were exported from ('' if unknown)
+        self.source_sha1 = str(arrays.get('source_sha1', ''))
+        # Feature order of the training data, checked against the scaler's at load time
+        names = arrays.get('feature_names')
+        if names is not None and len(names):
+            self.feature_names_in_ = np.asarray(names, dtype=str)
+        self.n_targets = len(self.base_score)
+
+        # Tree -> target one-hot matrix, to sum xgboost leaves per target in one product
+        self.target_matrix = np.zeros((len(self.roots), self.n_targets))
+        self.target_matrix[np.arange(len(self.roots)), self.tree_target] = 1.0
+
+        # Right children followed by left ones: children[node + n_nodes * go_left]
+        self.children = np.concatenate([self.right, self.left])
+        self.compare = np.less if self.kind == 'xgboost' or self.raw_input else np.less_equal
+        self.input_dtype = np.float64 if self.raw_input else np.float32
+
+    def arrays(self):
+        return {
+            'kind': self.kind, 'n_features': self.n_features_in_, 'feature': self.feature.astype(np.int32),
+            'threshold': self.threshold, 'left': self.left.astype(np.int32), 'right': self.right.astype(np.int32),
+            'default_left': self.default_left, 'value': self.value, 'roots': self.roots.astype(np.int32),
+            'tree_target': self.tree_target.astype(np.int32), 'base_score': self.base_score, 'depth': self.depth,
+            'raw_input': self.raw_input, 'source_sha1': self.source_sha1,
+            'feature_names': getattr(self, 'feature_names_in_', np.array([], dtype=str)),
+        }
+
+    def fold_scaler(self, scaler):
+        '''
+        Return an equivalent forest that takes unscaled features: every split
+        threshold is mapped back through the StandardScaler, so
+        predict(X) == self.predict(scaler.transform(X)) without the scaling step.
+        '''
+        if self.raw_input:
+            raise ValueError('The scaler is already folded into this forest')
+        n = self.n_features_in_
+        mean = getattr(scaler, 'mean_', None)
+        scale = getattr(scaler, 'scale_', None)
+        mean = np.zeros(n) if mean is None or not scaler.with_mean else np.asarray(mean, dtype=np.float64)
+        scale = np.ones(n) if scale is None or not scaler.with_std else np.asarray(scale, dtype=np.float64)
+
+        # Both libraries round the scaled value to float32 before comparing it,
+        # so find the float64 cut point where that comparison flips
+        t = self.threshold
+        if self.kind == 'xgboost':
+            # float32(xs) < t  <=>  xs < midpoint(float32 below t, t)
+            high = t.astype(np.float32)
+            low = np.nextafter(high, np.float32(-np.inf))
+        else:
+            # float32(xs) <= t  <=>  xs < midpoint(largest float32 <= t, next float32)
+            low = t.astype(np.float32)
+            low = np.where(low.astype(np.float64) > t, np.nextafter(low, np.float32(-np.inf)), low)
+            high = np.nextafter(low, np.float32(np.inf))
+        cut = (low.astype(np.float64) + high.astype(np.float64)) / 2.0
+
+        arrays = self.arrays()
+        arrays['threshold'] = cut * scale[self.feature] + mean[self.feature]
+        arrays['raw_input'] = True
+        return CompiledForest(arrays)
+
+    def save(self, path):
+        np.savez(path, **self.arrays())
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls({k: data[k] for k in data.files})
+
+    def leaves(self, X):
+        '''Leaf node reached in every tree, shape (rows, trees)'''
+        # Both libraries compare scaled features in float32
+        X = np.ascontiguousarray(X, dtype=self.input_dtype)
+        if X.ndim == 1:
+            X = X[None, :]
+        n_rows, n_features = X.shape
+        n_nodes = len(self.feature)
+        flat = X.ravel()
+        row_offset = (np.arange(n_rows) * n_features)[:, None]
+        missing = np.isnan(flat).any()
+
+        node = np.repeat(self.roots[None, :], n_rows, axis=0)
+        for _ in range(self.depth):
+            index = self.feature.take(node)
+            index += row_offset
+            x = flat.take(index)
+            go_left = self.compare(x, self.threshold.take(node))
+            if missing:
+                go_left = np.where(np.isnan(x), self.default_left.take(node), go_left)
+            node += n_nodes * go_left
+            node = self.children.take(node)
+        return node
+
+    def predict(self, X):
+        '''Predictions of shape (rows, targets), or (rows,) for a single target'''
+        node = self.leaves(X)
+        if self.kind == 'xgboost':
+            out = self.value[node, 0].astype(np.float64) @ self.target_matrix + self.base_score
+        else:
+            out = self.value[node].mean(axis=1)
+        if self.n_targets == 1:
+            return out[:, 0]
+        return out
+
+
+def compile_model(model):
+    '''Return a CompiledForest equivalent to a fitted tree model'''
+    return CompiledForest(export(model))
+
+
+def compiled_path(joblib_path):
+    '''Where the compiled arrays of a .joblib model are stored'''
+    return os.path.splitext(joblib_path)[0] + '.npz'
+
+
+def file_sha1(path):
+    '''SHA-1 of a file's contents. Unlike its mtime, a git checkout does not change it'''
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def scaler_path(joblib_path):
+    '''The scaler saved next to a {name}_xgb.joblib model, as trainController.py writes them'''
+    root = os.path.splitext(joblib_path)[0]
+    if root.endswith('_xgb'):
+        root = root[:-len('_xgb')]
+    return root + '_scaler.joblib'
+
+
+def load_compiled(joblib_path):
+    '''
+    The compiled forest of a .joblib model, or None if there is none or it
+    was exported from a different file than the current .joblib (e.g. the
+    model was retrained since). Without the .joblib the arrays are trusted.
+    '''
+    compiled = compiled_path(joblib_path)
+    if not os.path.exists(compiled):
+        return None
+    forest = CompiledForest.load(compiled)
+    if os.path.exists(joblib_path) and forest.source_sha1 != file_sha1(joblib_path):
+        return None
+    return forest
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export tree-model .joblib artefacts to flat .npz arrays.')
+    parser.add_argument('models', nargs='+', help='Paths of .joblib tree models (XGBRegressor or sklearn forests)')
+    args = parser.parse_args()
+
+    import joblib
+    for path in args.models:
+        model = joblib.load(path)
+        compiled = compile_model(model)
+        compiled.source_sha1 = file_sha1(path)
+        # Models fitted on scaled arrays don't know their feature names: take the scaler's
+        scaler = scaler_path(path)
+        if not hasattr(compiled, 'feature_names_in_') and os.path.exists(scaler):
+            names = getattr(joblib.load(scaler), 'feature_names_in_', None)
+            if names is not None:
+                compiled.feature_names_in_ = np.asarray(names, dtype=str)
+        out = compiled_path(path)
+        compiled.save(out)
+        print(f'{path} -> {out}: {len(compiled.roots)} trees, {len(compiled.feature)} nodes, depth {compiled.depth}')
+
+
+if __name__ == '__main__':
+    main()
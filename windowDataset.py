@@ -0,0 +1,183 @@
+import argparse
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+# Past ticks the LSTM controller sees, as in model.ipynb
+TIMESTEPS = 10
+
+TARGETS = ['accel', 'brake', 'clutch', 'gear', 'steer']
+
+
+def sliding_windows(X, timesteps=TIMESTEPS):
+    '''
+    Every run of timesteps consecutive rows of X as a read-only strided view
+    of shape (len(X) - timesteps + 1, timesteps, features), or
+    (len(X) - timesteps + 1, timesteps) for a single column. Nothing is copied.
+    '''
+    return np.moveaxis(sliding_window_view(X, timesteps, axis=0), -1, 1)
+
+
+def episode_bounds(dist_raced, start=0):
+    '''
+    Split one recording into episodes wherever distRaced goes backwards
+    (the race was restarted). Returns (start, stop) row ranges.
+    '''
+    dist_raced = np.asarray(dist_raced)
+    cuts = np.flatnonzero(np.diff(dist_raced) < 0) + 1
+    edges = np.concatenate([[0], cuts, [len(dist_raced)]]) + start
+    return [(int(a), int(b)) for a, b in zip(edges[:-1], edges[1:]) if b > a]
+
+
+def window_ends(bounds, timesteps=TIMESTEPS):
+    '''
+    Row index i of every window [i - timesteps, i) that lies inside one
+    episode; the window is labelled with the targets of row i, as the
+    notebook's reshape_data does.
+    '''
+    ends = [np.arange(start + timesteps, stop) for start, stop in bounds if stop - start > timesteps]
+    return np.concatenate(ends) if ends else np.zeros(0, dtype=np.intp)
+
+
+def split_bounds(bounds, test_size=0.2):
+    '''
+    Hold out the last test_size of every episode, so no window straddles
+    the train/test cut and test windows never overlap training ones.
+    Returns (train bounds, test bounds).
+    '''
+    train, test = [], []
+    for start, stop in bounds:
+        cut = stop - int(round((stop - start) * test_size))
+        if cut > start:
+            train.append((start, cut))
+        if stop > cut:
+            test.append((cut, stop))
+    return train, test
+
+
+def store_bounds(store):
+    '''Episodes of a columnStore: its source segments, split again at restarts'''
+    bounds = []
+    dist = store['distRaced'] if 'distRaced' in store else None
+    for start, stop in store.segment_bounds():
+        if dist is None:
+            bounds.append((start, stop))
+        else:
+            bounds.extend(episode_bounds(dist[start:stop], start))
+    return bounds
+
+
+class WindowDataset(object):
+    '''
+    Streams (X, y) batches of LSTM windows, shape (batch, timesteps,
+    features), from per-column arrays such as the memory maps of a
+    columnStore. Each column is viewed as its sliding_windows(), so a batch
+    is one gather per feature of the windows it needs; only those rows are
+    read and scaled, and memory is one batch whatever the dataset size.
+
+    columns maps a name to a 1-D array; features and targets are names.
+    ends comes from window_ends(). With a fitted StandardScaler, feature
+    values are standardised per batch as scaler.transform would.
+    '''
+    def __init__(self, columns, features, targets, ends, timesteps=TIMESTEPS, batch_size=32, scaler=None,
+                 shuffle=True, seed=42, dtype=np.float32):
+        '''Constructor'''
+        self.windows = [sliding_windows(np.asarray(columns[name]), timesteps) for name in features]
+        self.targets = [columns[name] for name in targets]
+        self.ends = np.asarray(ends, dtype=np.intp)
+        self.timesteps = timesteps
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.rng = np.random.default_rng(seed)
+        self.dtype = dtype
+
+        self.mean = self.scale = None
+        if scaler is not None:
+            self.mean = np.asarray(scaler.mean_, dtype=np.float64)
+            self.scale = np.asarray(scaler.scale_, dtype=np.float64)
+
+    def __len__(self):
+        '''Batches per epoch'''
+        return -(-len(self.ends) // self.batch_size)
+
+    def batch(self, ends):
+        '''Windows ending before each row in ends and the targets of those rows'''
+        # Window k of a column covers rows k .. k + timesteps - 1
+        starts = ends - self.timesteps
+        X = np.empty((len(ends), self.timesteps, len(self.windows)), dtype=np.float64)
+        for j, windows in enumerate(self.windows):
+            X[:, :, j] = windows[starts]
+        if self.mean is not None:
+            X -= self.mean
+            X /= self.scale
+        y = np.empty((len(ends), len(self.targets)), dtype=self.dtype)
+        for j, column in enumerate(self.targets):
+            y[:, j] = column[ends]
+        return X.astype(self.dtype, copy=False), y
+
+    def __iter__(self):
+        '''One epoch of batches, reshuffled every epoch when shuffle is set'''
+        order = self.rng.permutation(len(self.ends)) if self.shuffle else np.arange(len(self.ends))
+        for i in range(0, len(order), self.batch_size):
+            yield self.batch(np.sort(self.ends[order[i:i + self.batch_size]]))
+
+    def repeat(self):
+        '''Endless batches, for model.fit(..., steps_per_epoch=len(dataset))'''
+        while True:
+            yield from self
+
+
+def fit_scaler(columns, features, bounds):
+    '''StandardScaler statistics over the rows of bounds, one column at a time'''
+    from sklearn.preprocessing import StandardScaler
+    scaler = StandardScaler()
+    for start, stop in bounds:
+        scaler.partial_fit(np.column_stack([np.asarray(columns[name][start:stop], dtype=np.float64)
+                                            for name in features]))
+    scaler.feature_names_in_ = np.array(features, dtype=object)
+    return scaler
+
+
+def build(store, features, targets=TARGETS, timesteps=TIMESTEPS, test_size=0.2, batch_size=32, seed=42,
+          scaler=None, bounds=None):
+    '''
+    Train and test WindowDatasets over a columnStore (or any column
+    mapping, with its episode bounds), split per episode and scaled with
+    scaler, by default a StandardScaler fitted on the training rows only.
+    Returns (train, test, scaler).
+    '''
+    if bounds is None:
+        bounds = store_bounds(store)
+    train_bounds, test_bounds = split_bounds(bounds, test_size)
+    if scaler is None:
+        scaler = fit_scaler(store, features, train_bounds)
+    train = WindowDataset(store, features, targets, window_ends(train_bounds, timesteps), timesteps,
+                          batch_size, scaler, shuffle=True, seed=seed)
+    test = WindowDataset(store, features, targets, window_ends(test_bounds, timesteps), timesteps,
+                         batch_size, scaler, shuffle=False)
+    return train, test, scaler
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Summarise the LSTM training windows of a columnStore.')
+    parser.add_argument('store', help='columnStore directory')
+    parser.add_argument('--scaler', action='store', dest='scaler', default='controller/scaler.joblib',
+                        help='Scaler whose feature names are the LSTM inputs (default: controller/scaler.joblib)')
+    parser.add_argument('--timesteps', action='store', dest='timesteps', type=int, default=TIMESTEPS,
+                        help=f'Window length (default: {TIMESTEPS})')
+    parser.add_argument('--batchSize', action='store', dest='batch_size', type=int, default=32,
+                        help='Windows per batch (default: 32)')
+    args = parser.parse_args()
+
+    import joblib
+    import columnStore
+    store = columnStore.open_store(args.store)
+    features = list(joblib.load(args.scaler).feature_names_in_)
+    bounds = store_bounds(store)
+    train, test, _ = build(store, features, timesteps=args.timesteps, batch_size=args.batch_size)
+    X, y = next(iter(train))
+    print(f'{len(bounds)} episodes, {len(train.ends)} training and {len(test.ends)} test windows')
+    print(f'{len(train)} batches per epoch of X {X.shape} {X.dtype}, y {y.shape}')
+
+
+if __name__ == '__main__':
+    main()